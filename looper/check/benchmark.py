@@ -0,0 +1,122 @@
+import time
+from typing import List, Optional
+
+import numpy as np
+from nuclear.sublog import log
+
+from looper.runner.config import Config
+from looper.runner.config_load import load_config
+from looper.runner.dsp import SignalProcessor
+from looper.runner.mixer import InputMixer, input_gains_vector
+from looper.runner.sample import sample_format_max_amplitude
+from looper.runner.storage import storage_bytes
+from looper.runner.track import Track
+
+BENCHMARK_CHUNKS = 2000
+
+
+def benchmark_track_storage(config_path: Optional[str], tracks_num: int = 8):
+    """Compare mixing cost and memory of track storage precisions"""
+    base_config = load_config(config_path)
+    for track_storage in ['native', 'int16', 'float16']:
+        config = base_config.copy(update={'track_storage': track_storage})
+        tracks = _make_tracks(config, tracks_num, loop_chunks=100)
+        input_chunk = _noise_chunk(config)
+
+        def callback(position: int):
+            chunks = [track.current_playback(position) for track in tracks]
+            sum(chunks)
+            tracks[0].overdub(input_chunk, position)
+
+        callback_s = _measure_callback(callback, loop_chunks=100)
+        minute_mb = 60 * config.sampling_rate * storage_bytes(config) / 1024 / 1024
+        log.info('track storage benchmarked',
+            track_storage=track_storage,
+            tracks=tracks_num,
+            callback_time=f'{callback_s * 1e6:.1f}us',
+            callback_load=f'{callback_s / config.chunk_length_s * 100:.2f}%',
+            memory_per_track_minute=f'{minute_mb:.2f}MB',
+        )
+
+
+def benchmark_channels(config_path: Optional[str], tracks_num: int = 8):
+    """Compare mixing cost and memory of mono and multi-channel processing"""
+    base_config = load_config(config_path)
+    for channels in [1, 2, 4]:
+        config = base_config.copy(update={'channels': channels})
+        tracks = _make_tracks(config, tracks_num, loop_chunks=100)
+        for track in tracks:
+            track.set_pan(0.5)
+        input_chunk = _noise_chunk(config)
+        dsp = SignalProcessor(config)
+
+        def callback(position: int):
+            chunks = [track.current_playback(position) for track in tracks]
+            out_chunk = sum(chunks) + input_chunk
+            dsp.amplify(out_chunk, -3)
+            tracks[0].overdub(input_chunk, position)
+
+        callback_s = _measure_callback(callback, loop_chunks=100)
+        minute_mb = 60 * config.sampling_rate * channels * storage_bytes(config) / 1024 / 1024
+        log.info('channels benchmarked',
+            channels=channels,
+            tracks=tracks_num,
+            callback_time=f'{callback_s * 1e6:.1f}us',
+            callback_load=f'{callback_s / config.chunk_length_s * 100:.2f}%',
+            memory_per_track_minute=f'{minute_mb:.2f}MB',
+        )
+
+
+def benchmark_inputs(config_path: Optional[str], tracks_num: int = 8):
+    """Compare callback cost of mixing and routing 1, 2 and 4 input channels"""
+    base_config = load_config(config_path)
+    for inputs in [1, 2, 4]:
+        config = base_config.copy(update={'input_channels': inputs})
+        tracks = _make_tracks(config, tracks_num, loop_chunks=100)
+        gains = [0] * inputs
+        gains[-1] = 1
+        mixer = InputMixer(config)
+        tracks[0].input_gains = input_gains_vector(config, gains)
+        amplitude = sample_format_max_amplitude(config.sample_format) / 4
+        input_frames = np.random.default_rng().uniform(-amplitude, amplitude, config.input_chunk_shape)
+        input_frames = input_frames.astype(mixer.np_type)
+
+        def callback(position: int):
+            frames = mixer.process(input_frames, 6)
+            chunks = [track.current_playback(position) for track in tracks]
+            sum(chunks) + mixer.route(frames)
+            tracks[0].overdub(mixer.route(frames, tracks[0].input_gains), position)
+
+        callback_s = _measure_callback(callback, loop_chunks=100)
+        log.info('inputs benchmarked',
+            inputs=inputs,
+            channels=config.channels,
+            tracks=tracks_num,
+            callback_time=f'{callback_s * 1e6:.1f}us',
+            callback_load=f'{callback_s / config.chunk_length_s * 100:.2f}%',
+        )
+
+
+def _make_tracks(config: Config, tracks_num: int, loop_chunks: int) -> List[Track]:
+    tracks = []
+    for index in range(tracks_num):
+        track = Track(index, config, has_gpio=False)
+        track.set_track([_noise_chunk(config) for _ in range(loop_chunks)], fade=False)
+        track.playing = True
+        tracks.append(track)
+    return tracks
+
+
+def _noise_chunk(config: Config) -> np.array:
+    dsp = SignalProcessor(config)
+    amplitude = sample_format_max_amplitude(config.sample_format) / 4
+    noise = np.random.default_rng().uniform(-amplitude, amplitude, config.chunk_shape)
+    return noise.astype(dsp.np_type)
+
+
+def _measure_callback(callback, loop_chunks: int) -> float:
+    """Return mean duration of a callback in seconds"""
+    start_time = time.perf_counter()
+    for i in range(BENCHMARK_CHUNKS):
+        callback(i % loop_chunks)
+    return (time.perf_counter() - start_time) / BENCHMARK_CHUNKS
@@ -1,12 +1,15 @@
-from typing import Tuple, Dict
+from typing import TYPE_CHECKING, Tuple, Dict
 
-import pyaudio
 from looper.runner.config import Config
 from nuclear.sublog import log
 from nuclear import shell
 
+if TYPE_CHECKING:
+    import pyaudio
+
 
 def list_devices():
+    import pyaudio
     log.info(f'Listing sound cards (for JACK)')
     shell('cat /proc/asound/cards')
 
@@ -31,7 +34,7 @@ def list_devices():
     pa.terminate()
 
 
-def populate_devices(pa: pyaudio.PyAudio) -> Dict:
+def populate_devices(pa: 'pyaudio.PyAudio') -> Dict:
     devices = {}
     devices_num = pa.get_device_count()
     for i in range(devices_num):
@@ -43,14 +46,14 @@ def populate_devices(pa: pyaudio.PyAudio) -> Dict:
     return devices
 
 
-def verify_device_index(device_index: int, pa: pyaudio.PyAudio):
+def verify_device_index(device_index: int, pa: 'pyaudio.PyAudio'):
     info = pa.get_device_info_by_index(device_index)
     assert info.get('maxInputChannels', 0) > 0, 'device has no input channels'
     assert info.get('maxOutputChannels', 0) > 0, 'device has no output channels'
     return info
 
 
-def find_device_index(config: Config, pa: pyaudio.PyAudio) -> Tuple[int, int]:
+def find_device_index(config: Config, pa: 'pyaudio.PyAudio') -> Tuple[int, int]:
     in_device = config.in_device
     out_device = config.out_device
     
@@ -76,7 +79,7 @@ def find_device_index(config: Config, pa: pyaudio.PyAudio) -> Tuple[int, int]:
     return in_device, out_device
 
 
-def _find_best_device(config: Config, pa: pyaudio.PyAudio) -> int:
+def _find_best_device(config: Config, pa: 'pyaudio.PyAudio') -> int:
     default_devices = []
 
     devices = populate_devices(pa)
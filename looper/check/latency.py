@@ -1,59 +1,96 @@
-import re
+from dataclasses import dataclass
 import time
 from pathlib import Path
 import math
 from typing import List, Optional
 
-import pyaudio
 from nuclear.sublog import log
 import numpy as np
 from looper.runner.audio_backend import AudioBackend, PyAudioBackend
 
 from looper.runner.config import Config
-from looper.runner.config_load import load_config
-from looper.runner.dsp import SignalProcessor
+from looper.runner.config_load import load_config, update_config_file
 from looper.runner.sample import sample_format_numpy_type, sample_format_max_amplitude
 
-
-def measure_input_latency(config_path: Optional[str]):
+LATENCY_RECORDING_FILE = 'out/latency.rec'
+# silent chunks played before the first pulse, letting the stream settle
+LEAD_IN_CHUNKS = 10
+# minimum distance between pulses [s], the longest latency that can be measured
+PULSE_PERIOD_S = 0.3
+PULSE_DURATION_S = 0.01
+# correlation peak has to stand out of the background by that many times to be detected
+DETECTION_RATIO = 8
+
+
+@dataclass
+class PulseTrain:
+    signal: np.array  # whole output stream, float samples in range [-1, 1]
+    pulse: np.array  # single test pulse
+    emissions: List[int]  # sample indices where pulses start
+    period: int  # samples between pulses
+
+
+@dataclass
+class LatencyStats:
+    latencies: List[int]  # detected latency of every pulse [samples]
+    pulses: int
+    sampling_rate: int
+
+    @property
+    def detected(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def median(self) -> float:
+        return float(np.median(self.latencies))
+
+    @property
+    def spread(self) -> int:
+        return int(np.max(self.latencies) - np.min(self.latencies))
+
+    @property
+    def jitter(self) -> float:
+        """Standard deviation of latencies [samples]"""
+        return float(np.std(self.latencies))
+
+    def ms(self, samples: float) -> str:
+        return f'{samples * 1000 / self.sampling_rate:.2f}ms'
+
+    def log(self):
+        log.info('latency measured',
+            detected_pulses=f'{self.detected}/{self.pulses}',
+            median_samples=self.median,
+            median=self.ms(self.median),
+            min=self.ms(min(self.latencies)),
+            max=self.ms(max(self.latencies)),
+            spread=self.ms(self.spread),
+            jitter=self.ms(self.jitter),
+        )
+
+
+def measure_input_latency(config_path: Optional[str], repetitions: int = 20):
+    """Play pulse train directly through PyAudio stream and measure latency of recording it back"""
+    import pyaudio
     log.info("Measuring output-input latency...")
     log.info("Put microphone close to a speaker or wire the output with the input.")
-    log.debug("Initializing PyAudio...")
-    pa = pyaudio.PyAudio()
-
-    config = load_config(config_path)
-    chunk = config.chunk_size
-    dsp = SignalProcessor(config)
-
-    silence = dsp.silence()
-    amplitude = sample_format_max_amplitude(config.sample_format)
-
+    # pulses are emitted and detected on a single channel
+    config = load_config(config_path).copy(update={'channels': 1})
     log.info(f"one buffer length: {config.chunk_length_s * 1000}ms")
 
-    sine = dsp.sine(frequency=440, amplitude=amplitude)
-
-    max_recordings = 10
+    train = generate_pulse_train(config, repetitions)
+    out_chunks = _split_to_chunks(train.signal, config)
     np_type = sample_format_numpy_type(config.sample_format)
-    recordings = np.zeros([max_recordings, chunk], dtype=np_type)
-    started = False
-    current_buffer_idx: int = -1
+    recorded_chunks: List[np.array] = []
+    silence = np.zeros(config.chunk_size, dtype=np_type)
 
     def stream_callback(in_data, frame_count, time_info, status_flags):
-        nonlocal started, current_buffer_idx, recordings
-        if not started:
-            return silence, pyaudio.paContinue
-
-        if current_buffer_idx == -1:  # play tone
-            current_buffer_idx += 1
-            return sine, pyaudio.paContinue
-
-        if current_buffer_idx >= max_recordings:
+        index = len(recorded_chunks)
+        if index >= len(out_chunks):
             return silence, pyaudio.paComplete
+        recorded_chunks.append(np.frombuffer(in_data, dtype=np_type).copy())
+        return out_chunks[index], pyaudio.paContinue
 
-        recordings[current_buffer_idx, :] = np.frombuffer(in_data, dtype=np_type)
-        current_buffer_idx += 1
-        return silence, pyaudio.paContinue
-
+    pa = pyaudio.PyAudio()
     loop_stream = pa.open(
         format=PyAudioBackend.pyaudio_sample_format(config.sample_format),
         channels=config.channels,
@@ -67,129 +104,147 @@ def measure_input_latency(config_path: Optional[str]):
         stream_callback=stream_callback,
     )
     loop_stream.start_stream()
-
-    started = True
     log.debug("stream started")
     while loop_stream.is_active():
         time.sleep(0.1)
-    log.debug("recording stopped")
-
-    record_file = Path('out/latency.rec')
-    record_file.parent.mkdir(exist_ok=True)
-    np.save(str(record_file), recordings)
-    log.debug("recordings saved", record_file=record_file)
-
-    joined = np.concatenate(recordings)
-    threshold_amp = amplitude / 2
-    start_sample = np.argmax(joined>threshold_amp)
-    
-    if start_sample == 0:
-        raise RuntimeError('cannot find a tone in a recorded audio')
+    loop_stream.close()
+    pa.terminate()
+    log.debug("recording stopped", chunks=len(recorded_chunks))
 
-    max_amplitude = max(np.max(joined), -np.min(joined))
+    recording = np.concatenate(recorded_chunks)
+    save_latency_recording(Path(LATENCY_RECORDING_FILE), recording, train, config)
+    stats = analyze_latency(_to_float(recording, config), train, config.sampling_rate)
+    stats.log()
 
-    latency_chunks = math.ceil(start_sample / config.chunk_size)
 
-    chunk_length_ms = 1000 * config.chunk_size / config.sampling_rate
-
-    log.debug("tone recognized", 
-        start_sample=start_sample, 
-        max_amplitude=max_amplitude, 
-        latency_chunks=latency_chunks, 
-        chunk_length_ms=chunk_length_ms)
-
-    sample_time_s = 1 / config.sampling_rate
-    latency_ms = start_sample * sample_time_s * 1000
-
-    # latency based on minimum number of recorded chunks
-    latency_max_ms = latency_chunks * config.chunk_size * sample_time_s * 1000
-
-    log.info('latency calculated', 
-        min_latency_ms=latency_ms, 
-        max_latency_max_ms=latency_max_ms)
-    log.info(f'suggested latency: {latency_max_ms}ms')
-
-
-def measure_cycle_latency(config_path: Optional[str]):
+def measure_cycle_latency(config_path: Optional[str], repetitions: int = 20):
+    """Play pulse train through the looper's audio backend and measure full cycle latency"""
     log.info("Measuring full cycle latency...")
     log.info("Put microphone close to a speaker or wire the output with the input.")
 
-    config = load_config(config_path)
-    dsp = SignalProcessor(config)
+    # pulses are emitted and detected on a single channel
+    config = load_config(config_path).copy(update={'channels': 1})
     audio_backend = AudioBackend.make(config.active_audio_backend_type)
-
     log.info(f"one buffer length", chunk_length=f'{config.chunk_length_s * 1000}ms')
 
-    max_amplitude = sample_format_max_amplitude(config.sample_format)
-    short_sine = _short_sine(dsp, config)
-    silence = dsp.silence()
-    arming_chunks_num = 20
+    train = generate_pulse_train(config, repetitions)
+    out_chunks = _split_to_chunks(train.signal, config)
+    silence = np.zeros(config.chunk_size, dtype=sample_format_numpy_type(config.sample_format))
     recorded_chunks: List[np.array] = []
-    chunk_size = config.chunk_size
-    loopback = True
 
     def stream_audio_chunk(input_chunk: np.ndarray) -> np.ndarray:
-        if not loopback:
-            return silence
-        recorded_chunks.append(input_chunk)
-        if len(recorded_chunks) <= 10:
+        index = len(recorded_chunks)
+        if index >= len(out_chunks):
             return silence
-        if len(recorded_chunks) == arming_chunks_num:
-            return short_sine
-        return input_chunk
+        recorded_chunks.append(np.copy(input_chunk))
+        return out_chunks[index]
 
     audio_backend.open(config, stream_audio_chunk)
-
-    while len(recorded_chunks) < 40:
-        log.debug("Recording chunks...")
+    while len(recorded_chunks) < len(out_chunks):
         time.sleep(0.1)
-
-    loopback = False
     audio_backend.close()
     log.info("Recording stopped", chunks=len(recorded_chunks))
 
-    joined = np.concatenate(recorded_chunks)
-    record_file = Path('out/latency.rec')
-    record_file.parent.mkdir(exist_ok=True)
-    np.save(str(record_file), joined)
-    log.debug("recordings saved", record_file=record_file)
-
-    armed_chunks = joined[arming_chunks_num * chunk_size:]
-    peaks_mask = np.absolute(armed_chunks) > 0.1
-    max_recorded_amplitude = np.max(np.absolute(armed_chunks))
-    assert any(peaks_mask), f'no peak detected in recorded audio, max recorded amplitude: {max_recorded_amplitude}'
-
-    peak_indices = []
-    view = peaks_mask
-    offset = 0
-    while True:
-        first_peak = np.argmax(view)
-        if view[first_peak] == False:
-            break
-        peak_indices.append(first_peak + offset)
-        offset += first_peak+chunk_size
-        view = view[first_peak+chunk_size:]
-        if view.size == 0:
-            break
-    assert len(peak_indices) == 2, 'at least two peaks are expected'
-
-    peak_indices_diff = []
-    for i in range(len(peak_indices) - 1):
-        peak_indices_diff.append(peak_indices[i+1] - peak_indices[i])
-    peak_indices_diff
-
-    latency_median = np.median(peak_indices_diff)
-    latency_ms = latency_median * 1000 / config.sampling_rate
-
-    log.info('latency measured', 
-        latency_samples=latency_median,
-        latency_ms=f'{latency_ms} ms')
-
-
-def _short_sine(dsp: SignalProcessor, config: Config):
+    recording = select_input_channel(np.concatenate(recorded_chunks))
+    save_latency_recording(Path(LATENCY_RECORDING_FILE), recording, train, config)
+    stats = analyze_latency(_to_float(recording, config), train, config.sampling_rate)
+    stats.log()
+
+    update_config_file(config_path, {'latency_compensation_samples': int(round(stats.median))})
+
+
+def analyze_latency_recording(file: str = LATENCY_RECORDING_FILE) -> LatencyStats:
+    """Analyze latency of a recording saved earlier, without the audio hardware"""
+    path = Path(file)
+    if not path.is_file():
+        raise FileNotFoundError(f"latency recording {path} doesn't exist")
+    with path.open('rb') as handle:
+        data = np.load(handle)
+        recording = data['recording']
+        train = PulseTrain(
+            signal=data['signal'],
+            pulse=data['pulse'],
+            emissions=list(data['emissions']),
+            period=int(data['period']),
+        )
+        sampling_rate = int(data['sampling_rate'])
+    log.info('latency recording loaded', file=path, samples=len(recording), sampling_rate=sampling_rate)
+    stats = analyze_latency(recording, train, sampling_rate)
+    stats.log()
+    return stats
+
+
+def select_input_channel(recording: np.array) -> np.array:
+    """Pick the input channel receiving the pulses out of multiple input channels, the loudest one"""
+    if recording.ndim == 1:
+        return recording
+    peaks = np.max(np.abs(recording.astype(np.float64)), axis=0)
+    channel = int(np.argmax(peaks))
+    log.info('measuring latency on input channel', channel=channel, input_channels=recording.shape[1])
+    return recording[:, channel]
+
+
+def generate_pulse_train(config: Config, repetitions: int) -> PulseTrain:
+    """Generate windowed chirps repeated with a period longer than the expected latency"""
+    from scipy.signal import chirp
+
+    rate = config.sampling_rate
+    pulse_samples = int(PULSE_DURATION_S * rate)
+    t = np.arange(pulse_samples) / rate
+    pulse = chirp(t, f0=500, t1=PULSE_DURATION_S, f1=min(8000, rate / 2 * 0.8)) * np.hanning(pulse_samples) * 0.5
+
+    period = math.ceil(PULSE_PERIOD_S / config.chunk_length_s) * config.chunk_size
+    lead_in = LEAD_IN_CHUNKS * config.chunk_size
+    signal = np.zeros(lead_in + (repetitions + 1) * period)
+    emissions = [lead_in + i * period for i in range(repetitions)]
+    for emission in emissions:
+        signal[emission:emission + pulse_samples] = pulse
+    return PulseTrain(signal, pulse, emissions, period)
+
+
+def analyze_latency(recording: np.array, train: PulseTrain, sampling_rate: int) -> LatencyStats:
+    """Find every pulse in the recording by FFT-based cross-correlation with the test pulse"""
+    from scipy.signal import correlate
+
+    recording = recording.astype(np.float64) - np.mean(recording)
+    correlation = np.abs(correlate(recording, train.pulse, mode='valid', method='fft'))
+    background = np.median(correlation) + 1e-12
+
+    latencies = []
+    for emission in train.emissions:
+        window = correlation[emission:emission + train.period]
+        if window.size == 0:
+            continue
+        peak = int(np.argmax(window))
+        if window[peak] / background >= DETECTION_RATIO:
+            latencies.append(peak)
+
+    if not latencies:
+        raise RuntimeError(f'no pulse detected in recorded audio, max recorded amplitude: {np.max(np.abs(recording))}')
+    return LatencyStats(latencies=latencies, pulses=len(train.emissions), sampling_rate=sampling_rate)
+
+
+def save_latency_recording(path: Path, recording: np.array, train: PulseTrain, config: Config):
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with path.open('wb') as handle:
+        np.savez(handle,
+            recording=_to_float(recording, config),
+            signal=train.signal,
+            pulse=train.pulse,
+            emissions=np.array(train.emissions),
+            period=train.period,
+            sampling_rate=config.sampling_rate,
+            chunk_size=config.chunk_size,
+        )
+    log.debug("recordings saved", record_file=path)
+
+
+def _split_to_chunks(signal: np.array, config: Config) -> List[np.array]:
     max_amplitude = sample_format_max_amplitude(config.sample_format)
-    sine = dsp.sine(frequency=440, amplitude=max_amplitude)
-    for i in range(config.chunk_size):
-        if i > config.chunk_size // 2:
-            sine[i] = 0
-    return sine
+    np_type = sample_format_numpy_type(config.sample_format)
+    samples = (signal * max_amplitude).astype(np_type)
+    return np.split(samples, len(samples) // config.chunk_size)
+
+
+def _to_float(samples: np.array, config: Config) -> np.array:
+    return samples.astype(np.float64) / sample_format_max_amplitude(config.sample_format)
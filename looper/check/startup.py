@@ -0,0 +1,67 @@
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import psutil
+from nuclear.sublog import log
+
+from looper.runner.config import AudioBackendType
+from looper.runner.config_load import load_config
+from looper.runner.looper import Looper
+
+BENCHMARKED_MODULES = [
+    'looper.main',
+    'looper.runner.looper',
+    'looper.runner.server',
+    'numpy',
+    'fastapi',
+    'matplotlib.pyplot',
+    'pydub',
+    'scipy.io.wavfile',
+    'pyaudio',
+    'jack',
+]
+
+
+def measure_startup(config_path: Optional[str], audio_backend_type: Optional[str]):
+    log.info('Measuring import times of modules (each in a fresh interpreter)...')
+    for module in BENCHMARKED_MODULES:
+        import_time = measure_import_time(module)
+        if import_time is None:
+            log.warn('module could not be imported', module=module)
+        else:
+            log.info('module imported', module=module, import_time=f'{import_time * 1000:.1f}ms')
+
+    log.info('Measuring time to the first audio callback...')
+    config = load_config(config_path)
+    if audio_backend_type:
+        config.audio_backend = AudioBackendType(audio_backend_type)
+    config.offline = True
+    config.journal = False
+
+    process_start_time = psutil.Process().create_time()
+    run_start_time = time.time()
+    looper = Looper(None, config)
+    looper.run()
+    while looper.first_callback_time is None:
+        if time.time() - run_start_time > 30:
+            looper.close()
+            raise RuntimeError('audio callback has not been called within 30 seconds')
+        time.sleep(0.001)
+    looper.close()
+
+    log.info('first audio callback measured',
+        audio_backend=config.active_audio_backend_type.value,
+        since_process_start=f'{looper.first_callback_time - process_start_time:.3f}s',
+        since_engine_start=f'{looper.first_callback_time - run_start_time:.3f}s',
+    )
+
+
+def measure_import_time(module: str) -> Optional[float]:
+    """Return duration of importing a module in a new Python process (in seconds)"""
+    code = f'import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
@@ -0,0 +1,98 @@
+import time
+from typing import List, Optional
+
+import numpy as np
+from nuclear.sublog import log
+
+from looper.runner.config import AudioBackendType, Config
+from looper.runner.config_load import load_config, update_config_file
+from looper.runner.looper import LoopPhase, Looper
+from looper.runner.sample import sample_format_max_amplitude, sample_format_numpy_type
+
+CANDIDATE_CHUNK_SIZES = [64, 128, 256, 512, 1024, 2048]
+# duration of the loop recorded on every track while tuning [s]
+TUNE_LOOP_DURATION_S = 4
+
+
+def tune_chunk_size(
+    config_path: Optional[str],
+    audio_backend_type: Optional[str],
+    tracks: Optional[str],
+    seconds: float,
+):
+    """
+    Measure callback cost for candidate chunk sizes and pick the smallest one
+    with 99th percentile of callback time below the configured fraction of chunk length.
+    """
+    base_config = load_config(config_path)
+    backend = AudioBackendType(audio_backend_type) if audio_backend_type else AudioBackendType.SIMULATED
+    tracks_nums = [int(num) for num in tracks.split(',')] if tracks else [base_config.tracks_num]
+    max_load = base_config.tune_max_callback_load
+    log.info('tuning chunk size', audio_backend=backend.value, tracks=tracks_nums,
+        max_callback_load=max_load, candidates=CANDIDATE_CHUNK_SIZES)
+
+    best_chunk_size: Optional[int] = None
+    for chunk_size in CANDIDATE_CHUNK_SIZES:
+        loads = []
+        for tracks_num in tracks_nums:
+            config = base_config.copy(update={
+                'chunk_size': chunk_size,
+                'tracks_num': tracks_num,
+                'audio_backend': backend,
+                'offline': True,
+                'journal': False,
+                'prioritize_process': base_config.prioritize_process and backend != AudioBackendType.SIMULATED,
+            })
+            report = measure_callback_cost(config, seconds)
+            loads.append(report['p99_load'])
+            log.info('callback cost measured',
+                chunk_size=chunk_size,
+                tracks=tracks_num,
+                chunk_length=f"{report['chunk_length_ms']:.2f}ms",
+                p50=f"{report['p50_ms']:.3f}ms",
+                p99=f"{report['p99_ms']:.3f}ms",
+                p99_load=f"{report['p99_load'] * 100:.1f}%",
+                late_callbacks=report['late_count'],
+            )
+        if max(loads) < max_load:
+            best_chunk_size = chunk_size
+            break
+
+    if best_chunk_size is None:
+        raise RuntimeError(f'none of the chunk sizes keeps callback load below {max_load}')
+    log.info('chunk size chosen', chunk_size=best_chunk_size,
+        chunk_length=f'{best_chunk_size / base_config.sampling_rate * 1000:.2f}ms')
+    update_config_file(config_path, {'chunk_size': best_chunk_size})
+
+
+def measure_callback_cost(config: Config, seconds: float) -> dict:
+    """Run the looper with every track playing and one overdubbing, return callback time statistics"""
+    looper = Looper(None, config)
+    looper.run()
+    try:
+        _fill_tracks(looper)
+        looper.callback_stats.reset()
+        time.sleep(seconds)
+        return looper.callback_stats.report()
+    finally:
+        looper.close()
+
+
+def _fill_tracks(looper: Looper):
+    config = looper.config
+    loop_chunks = max(1, int(TUNE_LOOP_DURATION_S / config.chunk_length_s))
+    amplitude = sample_format_max_amplitude(config.sample_format) / 4
+    np_type = sample_format_numpy_type(config.sample_format)
+    rng = np.random.default_rng()
+
+    def noise_chunks() -> List[np.array]:
+        return [rng.uniform(-amplitude, amplitude, config.chunk_shape).astype(np_type) for _ in range(loop_chunks)]
+
+    with looper._lock:
+        looper.master_chunks = noise_chunks()
+        looper.current_position = 0
+        for track in looper.tracks:
+            track.set_track(noise_chunks(), fade=False)
+            track.playing = True
+        looper.phase = LoopPhase.LOOP
+    looper.start_recording(looper.tracks[-1].index)
@@ -1,45 +1,147 @@
 from typing import Optional
 from nuclear import CliBuilder
 
-from looper.check.devices import list_devices
-from looper.check.latency import measure_input_latency, measure_cycle_latency
-from looper.check.wire import wire_input_output
-from looper.runner.runner import run_looper
-
 
+# commands import their modules lazily, so that none of them pays for loading all subsystems
 def main():
     cli = CliBuilder(log_error=True)
 
     @cli.add_command("run")
-    def run(config: Optional[str] = None, backend: Optional[str] = None):
+    def run(
+        config: Optional[str] = None,
+        backend: Optional[str] = None,
+        recover: bool = False,
+        capture: Optional[str] = None,
+    ):
         """
         Run looper in a standard mode
         :param config: path to config YAML file
-        :param backend: audio backend for streaming chunks, pyaudio or jack
+        :param backend: audio backend for streaming chunks, pyaudio, jack or simulated
+        :param recover: restore loop state journaled by the previous run
+        :param capture: file to capture input audio and control events to, for a deterministic replay
+        """
+        from looper.runner.runner import run_looper
+        run_looper(config, backend, recover, capture)
+
+    @cli.add_command("replay")
+    def replay(trace: str, update: bool = False):
+        """
+        Replay captured engine trace faster than real time, verify the output is bit-exact and report callback timings
+        :param trace: trace file captured with "looper run --capture"
+        :param update: accept the replayed output as the expected one
+        """
+        from looper.runner.trace import replay_trace
+        replay_trace(trace, update)
+
+    @cli.add_command("tune")
+    def tune(
+        config: Optional[str] = None,
+        backend: Optional[str] = None,
+        tracks: Optional[str] = None,
+        seconds: float = 3,
+    ):
+        """
+        Find the smallest chunk size with enough headroom for the callback and save it to config
+        :param config: path to config YAML file
+        :param backend: audio backend used for measurement, simulated by default
+        :param tracks: comma-separated numbers of tracks to test, eg. 4,8
+        :param seconds: duration of measurement for every candidate
         """
-        run_looper(config, backend)
+        from looper.check.tune import tune_chunk_size
+        tune_chunk_size(config, backend, tracks, seconds)
+
+    @cli.add_command("render")
+    def render(session: str, loops: int = 1, out: Optional[str] = None, config: Optional[str] = None):
+        """
+        Mix down a saved session to WAV or MP3 file, faster than real time
+        :param session: session file name or path
+        :param loops: number of loop repetitions
+        :param out: output file, .wav or .mp3, saved to recordings directory by default
+        :param config: path to config YAML file
+        """
+        from looper.runner.config_load import load_config
+        from looper.runner.render import render_session
+        render_session(load_config(config), session, loops, out)
 
     @cli.add_command("wire")
     def wire():
         """Wire input with output"""
+        from looper.check.wire import wire_input_output
         wire_input_output()
 
     @cli.add_command('latency', 'input')
-    def latency_input(config: Optional[str] = None):
-        """Measure output-input latency"""
-        measure_input_latency(config)
+    def latency_input(config: Optional[str] = None, repetitions: int = 20):
+        """
+        Measure output-input latency
+        :param config: path to config YAML file
+        :param repetitions: number of test pulses
+        """
+        from looper.check.latency import measure_input_latency
+        measure_input_latency(config, repetitions)
 
     @cli.add_command('latency', 'cycle')
-    def latency_cycle(config: Optional[str] = None):
+    def latency_cycle(config: Optional[str] = None, repetitions: int = 20):
         """
         Measure full cycle latency
         :param config: path to config YAML file
+        :param repetitions: number of test pulses
+        """
+        from looper.check.latency import measure_cycle_latency
+        measure_cycle_latency(config, repetitions)
+
+    @cli.add_command('latency', 'analyze')
+    def latency_analyze(file: str = 'out/latency.rec'):
         """
-        measure_cycle_latency(config)
+        Analyze latency of a saved recording offline
+        :param file: path to recording saved by latency measurement
+        """
+        from looper.check.latency import analyze_latency_recording
+        analyze_latency_recording(file)
 
     @cli.add_command("devices")
     def devices():
         """List input devices"""
+        from looper.check.devices import list_devices
         list_devices()
 
+    @cli.add_command('benchmark', 'storage')
+    def benchmark_storage(config: Optional[str] = None, tracks: int = 8):
+        """
+        Compare mixing cost and memory of track storage precisions
+        :param config: path to config YAML file
+        :param tracks: number of playing tracks
+        """
+        from looper.check.benchmark import benchmark_track_storage
+        benchmark_track_storage(config, tracks)
+
+    @cli.add_command('benchmark', 'channels')
+    def benchmark_channels(config: Optional[str] = None, tracks: int = 8):
+        """
+        Compare mixing cost and memory of 1, 2 and 4 channels
+        :param config: path to config YAML file
+        :param tracks: number of playing tracks
+        """
+        from looper.check.benchmark import benchmark_channels
+        benchmark_channels(config, tracks)
+
+    @cli.add_command('benchmark', 'inputs')
+    def benchmark_inputs(config: Optional[str] = None, tracks: int = 8):
+        """
+        Compare callback cost of mixing and routing 1, 2 and 4 input channels
+        :param config: path to config YAML file
+        :param tracks: number of playing tracks
+        """
+        from looper.check.benchmark import benchmark_inputs
+        benchmark_inputs(config, tracks)
+
+    @cli.add_command("startup")
+    def startup(config: Optional[str] = None, backend: Optional[str] = None):
+        """
+        Measure import times and time to the first audio callback
+        :param config: path to config YAML file
+        :param backend: audio backend for streaming chunks, pyaudio or jack
+        """
+        from looper.check.startup import measure_startup
+        measure_startup(config, backend)
+
     cli.run()
@@ -0,0 +1,101 @@
+from dataclasses import dataclass, field
+from enum import Enum
+import time
+from typing import Callable, Dict, List, Optional
+
+TRACK_ACTIONS = {'record', 'stop', 'mute', 'unmute'}
+
+
+class Quantize(Enum):
+    NOW = 'now'  # at the next chunk
+    BEAT = 'beat'
+    BAR = 'bar'
+    LOOP = 'loop'  # at the loop start
+
+
+@dataclass
+class ScheduledAction:
+    id: int
+    name: str  # record, stop, mute, unmute or session
+    track_id: Optional[int]
+    quantize: Quantize
+    target_sample: int  # sample within the loop at which the action is executed
+    apply: Optional[Callable[[], None]] = None  # executed by the audio callback for actions other than track ones
+    created_at: float = field(default_factory=time.time)
+
+
+class ActionScheduler:
+    """
+    Queue of actions executed by the audio callback at the exact sample of a beat, bar or loop start.
+    Beats are derived from the loop tempo, boundaries are rounded to samples without accumulating drift.
+    """
+
+    def __init__(self, chunk_size: int) -> None:
+        self.chunk_size = chunk_size
+        self.pending: List[ScheduledAction] = []  # sorted by target sample
+        self._next_id: int = 1
+
+    def target_sample(
+        self, quantize: Quantize, position: int, loop_samples: int, loop_beats: int, bar_beats: int,
+    ) -> int:
+        """
+        Find the first boundary not earlier than a loop position [samples]
+        :param loop_beats: number of beats in the loop
+        :param bar_beats: number of beats in a bar
+        """
+        if quantize == Quantize.NOW:
+            return position % loop_samples
+        if quantize == Quantize.LOOP:
+            divisions = 1
+        elif quantize == Quantize.BAR:
+            divisions = max(1, loop_beats // bar_beats)
+        else:
+            divisions = loop_beats
+        boundary = position * divisions // loop_samples
+        while _ceil_div(boundary * loop_samples, divisions) < position:
+            boundary += 1
+        return _ceil_div(boundary * loop_samples, divisions) % loop_samples
+
+    def add(
+        self,
+        name: str,
+        track_id: Optional[int],
+        quantize: Quantize,
+        target_sample: int,
+        apply: Optional[Callable[[], None]] = None,
+    ) -> ScheduledAction:
+        action = ScheduledAction(self._next_id, name, track_id, quantize, target_sample, apply)
+        self._next_id += 1
+        self.pending = sorted(self.pending + [action], key=lambda pending: pending.target_sample)
+        return action
+
+    def pop_due(self, chunk_start: int) -> List[ScheduledAction]:
+        """Take actions falling into a chunk starting at a given loop sample"""
+        chunk_end = chunk_start + self.chunk_size
+        due = [action for action in self.pending if chunk_start <= action.target_sample < chunk_end]
+        if due:
+            self.pending = [action for action in self.pending if action not in due]
+        return due
+
+    def cancel(self, action_id: int):
+        remaining = [action for action in self.pending if action.id != action_id]
+        if len(remaining) == len(self.pending):
+            raise RuntimeError(f'scheduled action {action_id} does not exist')
+        self.pending = remaining
+
+    def clear(self):
+        self.pending = []
+
+    def report(self, position: int, loop_samples: int, sampling_rate: int) -> List[Dict]:
+        return [{
+            'id': action.id,
+            'action': action.name,
+            'track_id': action.track_id,
+            'quantize': action.quantize.value,
+            'target_sample': action.target_sample,
+            'time_left_s': ((action.target_sample - position) % loop_samples) / sampling_rate if loop_samples else 0,
+        } for action in self.pending]
+
+
+def _ceil_div(a: int, b: int) -> int:
+    return -(-a // b)
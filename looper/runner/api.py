@@ -1,10 +1,18 @@
-from typing import Dict, Iterable
+import asyncio
+import threading
+from typing import Dict, Iterable, List
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from nuclear.sublog import log
 
+from looper.runner.bounce import bounce_tracks, undo_bounce
+from looper.runner.importer import import_track_audio
+from looper.runner.jobs import JobType
 from looper.runner.looper import Looper
+from looper.runner.recorder import RecorderPhase
 from looper.runner.plot import generate_track_plot
+from looper.runner.profiler import profile_looper
+from looper.runner.render import render_session
 from looper.runner.sessions import SessionManager
 
 
@@ -29,19 +37,29 @@ def setup_looper_endpoints(app: FastAPI, looper: Looper):
 
     @app.post("/api/track/{track_id}/record")
     async def toggle_track_recording(track_id: int):
-        looper.toggle_record(track_id)
+        looper.control('http', looper.toggle_record, track_id)
 
     @app.post("/api/track/{track_id}/play")
     async def toggle_track_playing(track_id: int):
-        looper.toggle_play(track_id)
+        looper.control('http', looper.toggle_play, track_id)
 
     @app.post("/api/track/{track_id}/reset")
     async def reset_track(track_id: int):
-        looper.reset_track(track_id)
+        looper.control('http', looper.reset_track, track_id)
+
+    @app.post("/api/track/{track_id}/length/{multiple}/{division}")
+    async def set_track_length(track_id: int, multiple: int, division: int):
+        """Make track loop a multiple or a fraction of the master loop, eg. 4/1 or 1/2"""
+        looper.set_track_length(track_id, multiple, division)
+
+    @app.post("/api/looper/arm")
+    async def arm_master_recording():
+        """Start recording master loop once input crosses the threshold"""
+        looper.arm_recording_master()
 
     @app.post("/api/track/{track_id}/main")
     async def set_main_track(track_id: int):
-        looper.main_track = track_id
+        looper.set_main_track(track_id)
 
     @app.post("/api/track/add")
     async def add_new_track():
@@ -65,11 +83,13 @@ def setup_looper_endpoints(app: FastAPI, looper: Looper):
 
     @app.post("/api/recorder/stop")
     async def stop_saving_output_to_file():
-        looper.recorder.stop_saving()
+        return _stop_saving_output(looper)
 
     @app.post("/api/recorder/toggle")
     async def toggle_saving_output_to_file():
-        looper.recorder.toggle_saving()
+        if looper.recorder.phase == RecorderPhase.RECORDING:
+            return _stop_saving_output(looper)
+        looper.recorder.start_saving()
 
     # Input Volume
     @app.get("/api/volume/input")
@@ -81,12 +101,11 @@ def setup_looper_endpoints(app: FastAPI, looper: Looper):
 
     @app.post("/api/volume/input/set/{volume}")
     async def set_input_volume(volume: float):
-        looper.input_volume = volume
-        log.info('input volume set', volume=f'{volume}dB')
+        looper.set_input_volume(volume)
 
     @app.post("/api/volume/input/mute")
     async def toggle_mute_input_volume():
-        looper.toggle_input_mute()
+        looper.control('http', looper.toggle_input_mute)
 
     # Output Volume
     @app.get("/api/volume/output")
@@ -98,12 +117,54 @@ def setup_looper_endpoints(app: FastAPI, looper: Looper):
 
     @app.post("/api/volume/output/set/{volume}")
     async def set_output_volume(volume: float):
-        looper.output_volume = volume
-        log.info('output volume set', volume=f'{volume}dB')
+        looper.set_output_volume(volume)
 
     @app.post("/api/volume/output/mute")
     async def toggle_mute_output_volume():
-        looper.toggle_output_mute()
+        looper.control('http', looper.toggle_output_mute)
+
+    # Input channels
+    @app.get("/api/inputs")
+    async def get_inputs_status():
+        return {
+            'inputs': looper.mixer.report(),
+            'routing': {
+                track.index: track.input_gains.tolist() if track.input_gains is not None else None
+                for track in looper.tracks
+            },
+        }
+
+    @app.post("/api/volume/input/{input_id}/set/{volume}")
+    async def set_input_channel_volume(input_id: int, volume: float):
+        looper.set_input_channel_volume(input_id, volume)
+
+    @app.post("/api/track/{track_id}/inputs/{gains}")
+    async def set_track_inputs(track_id: int, gains: str):
+        """Route inputs to a track by comma-separated gains of input channels, eg. "1,0", or "default" """
+        if gains == 'default':
+            looper.set_track_inputs(track_id, None)
+        else:
+            looper.set_track_inputs(track_id, [float(gain) for gain in gains.split(',')])
+
+    @app.post("/api/track/{track_id}/import")
+    async def import_track(track_id: int, request: Request, filename: str = '', mode: str = 'fit'):
+        """Import WAV/MP3/FLAC file sent as a request body, mode: fit (trim or pad) or stretch"""
+        data = await request.body()
+        job = looper.jobs.submit(JobType.IMPORT,
+            lambda job: import_track_audio(looper, track_id, data, filename, mode, job))
+        return job.info()
+
+    @app.post("/api/track/bounce")
+    async def merge_tracks(tracks: str, undo: bool = False):
+        """Merge comma-separated tracks, eg. "1,2,3", into the first one at the loop start, keeping a copy for undo"""
+        track_ids = [int(track_id) for track_id in tracks.split(',')]
+        job = looper.jobs.submit(JobType.BOUNCE, lambda job: bounce_tracks(looper, track_ids, undo, job))
+        return job.info()
+
+    @app.post("/api/track/bounce/undo")
+    async def undo_merge_tracks():
+        job = looper.jobs.submit(JobType.BOUNCE, lambda job: undo_bounce(looper, job))
+        return job.info()
 
     # Tracks Volume
     @app.get("/api/volume/track/{track_id}")
@@ -114,8 +175,18 @@ def setup_looper_endpoints(app: FastAPI, looper: Looper):
 
     @app.post("/api/volume/track/{track_id}/set/{volume}")
     async def set_track_volume(track_id: int, volume: float):
-        looper.tracks[track_id].volume = volume
-        log.info('track volume set', track=track_id, volume=f'{volume}dB')
+        looper.set_track_volume(track_id, volume)
+
+    @app.get("/api/pan/track/{track_id}")
+    async def get_track_pan(track_id: int):
+        return {
+            'pan': looper.tracks[track_id].pan,
+            'channels': looper.config.channels,
+        }
+
+    @app.post("/api/pan/track/{track_id}/set/{pan}")
+    async def set_track_pan(track_id: int, pan: float):
+        looper.set_track_pan(track_id, pan)
 
     @app.get("/api/volume/track/{track_id}/loudness")
     async def compute_track_loudness(track_id: int):
@@ -126,12 +197,15 @@ def setup_looper_endpoints(app: FastAPI, looper: Looper):
     # Track Plots
     @app.get("/api/plot/track/{track_id}")
     async def get_track_plot(track_id: int):
-        return generate_track_plot(looper.tracks[track_id], looper)
+        track = looper.tracks[track_id]
+        job = looper.jobs.submit(JobType.PLOT, lambda job: generate_track_plot(track, looper))
+        return await asyncio.wrap_future(job.future)
 
     # Metronome
     @app.post("/api/metronome/{bpm}/{beats}/{bars}")
     async def set_metronome_track(bpm: float, beats: int, bars: int):
-        looper.set_metronome_tracks(bpm, beats, bars)
+        job = looper.jobs.submit(JobType.METRONOME, lambda job: looper.set_metronome_tracks(bpm, beats, bars))
+        return job.info()
 
     # Rename tracks
     @app.post("/api/track/{track_id}/name/{name}")
@@ -145,16 +219,59 @@ def setup_looper_endpoints(app: FastAPI, looper: Looper):
     # Save/Restore Sessions
     @app.post("/api/session/save/{name}")
     async def save_session(name: str = ''):
-        SessionManager(looper).save_session(name)
+        job = looper.jobs.submit(JobType.SESSION, lambda job: SessionManager(looper).save_session(name, job))
+        return job.info()
 
     @app.post("/api/session/restore/{filename}")
     async def restore_session(filename: str):
-        SessionManager(looper).restore_session(filename)
+        job = looper.jobs.submit(JobType.SESSION, lambda job: SessionManager(looper).restore_session(filename, job))
+        return job.info()
+
+    @app.post("/api/session/render/{filename}")
+    async def render_session_file(filename: str, loops: int = 1):
+        job = looper.jobs.submit(JobType.RENDER, lambda job: render_session(looper.config, filename, loops, job=job))
+        return job.info()
+
+    @app.post("/api/journal/recover")
+    async def recover_journaled_state():
+        job = looper.jobs.submit(JobType.SESSION, lambda job: looper.journal.recover())
+        return job.info()
+
+    @app.post("/api/session/switch/{filename}")
+    async def switch_session(filename: str, quantize: str = 'loop'):
+        """Switch to a session at the next beat, bar or loop start"""
+        job = looper.jobs.submit(JobType.SESSION,
+            lambda job: SessionManager(looper).switch_session(filename, quantize, job))
+        return job.info()
+
+    # Scheduled actions
+    @app.get("/api/actions")
+    async def get_scheduled_actions():
+        return looper.scheduled_actions()
+
+    @app.post("/api/track/{track_id}/schedule/{action}")
+    async def schedule_track_action(track_id: int, action: str, quantize: str = 'bar'):
+        """Record, stop, mute or unmute a track at the next beat, bar, loop start or now"""
+        looper.schedule_action(action, track_id, quantize)
+        return looper.scheduled_actions()
+
+    @app.delete("/api/actions/{action_id}")
+    async def cancel_scheduled_action(action_id: int):
+        looper.cancel_action(action_id)
+
+    # Background Jobs
+    @app.get("/api/jobs")
+    async def get_all_jobs_status() -> List[Dict]:
+        return [job.info() for job in looper.jobs.list_jobs()]
+
+    @app.get("/api/jobs/{job_id}")
+    async def get_job_status(job_id: str) -> Dict:
+        return looper.jobs.get(job_id).info()
 
 
     @app.post("/api/looper/baseline_bias/{baseline_bias}")
     async def set_baseline_bias(baseline_bias: float):
-        looper.baseline_bias = baseline_bias
+        looper.set_baseline_bias(baseline_bias)
 
     @app.get("/api/looper/baseline_bias")
     async def get_baseline_bias():
@@ -162,6 +279,49 @@ def setup_looper_endpoints(app: FastAPI, looper: Looper):
             'input_baseline_bias': looper.baseline_bias,
         }
 
+    @app.post("/api/looper/latency/{latency_samples}")
+    async def set_latency_compensation(latency_samples: int):
+        looper.set_latency_samples(latency_samples)
+
+    @app.get("/api/looper/latency")
+    async def get_latency_compensation():
+        return {
+            'latency_samples': looper.latency_samples,
+            'latency_ms': looper.latency_samples * 1000 / looper.config.sampling_rate,
+        }
+
+    @app.get("/api/metrics")
+    async def get_metrics():
+        return {
+            'callback': looper.callback_stats.report(),
+            'audio_backend': looper.audio_backend.report(),
+            'gc': looper.gc_control.report(),
+            'spill': looper.spill.report(),
+            'journal': looper.journal.report(),
+            'control_latency': looper.control_latency.report(),
+        }
+
+    @app.post("/api/debug/profile")
+    async def profile(seconds: float = 5, target: str = 'audio', mode: str = 'sampling'):
+        """
+        Profile audio callbacks or web server thread and save it to profiles directory,
+        target: audio or web, mode: sampling (collapsed stacks) or cprofile (pstats, audio only)
+        """
+        web_thread_id = threading.get_ident()
+        job = looper.jobs.submit(JobType.PROFILE,
+            lambda job: profile_looper(looper, seconds, target, mode, web_thread_id, job))
+        return await asyncio.wrap_future(job.future)
+
+    @app.get("/api/looper/scheduling")
+    async def get_scheduling_policy():
+        return looper.scheduler.report()
+
+
+def _stop_saving_output(looper: Looper) -> Dict:
+    looper.recorder.stop_saving()
+    job = looper.jobs.submit(JobType.MP3_CONVERSION, looper.recorder.convert_to_mp3)
+    return job.info()
+
 
 async def _get_track_info(looper: Looper, track_id: int) -> Dict:
     return {
@@ -171,6 +331,9 @@ async def _get_track_info(looper: Looper, track_id: int) -> Dict:
         'empty': looper.tracks[track_id].empty,
         'name': looper.tracks[track_id].name,
         'main': looper.main_track == track_id,
+        'spilled': looper.tracks[track_id].spilled,
+        'pan': looper.tracks[track_id].pan,
+        'length': len(looper.tracks[track_id].loop_chunks) / looper.loop_chunks_num if looper.loop_chunks_num else 1,
     }
 
 
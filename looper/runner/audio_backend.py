@@ -1,11 +1,13 @@
 from abc import ABC, abstractmethod
-from typing import Callable, List
+from pathlib import Path
+import subprocess
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
 
-import pyaudio
 from nuclear.sublog import log, log_exception
 from nuclear import CommandError
 import numpy as np
-import jack
 import backoff
 
 from looper.runner.cmd import BackgroundCommand
@@ -13,6 +15,11 @@ from looper.runner.config import AudioBackendType, Config
 from looper.check.devices import find_device_index
 from looper.runner.sample import sample_format_max_amplitude, sample_format_numpy_type
 
+if TYPE_CHECKING:  # pyaudio and jack are imported lazily, only by the selected backend
+    import jack
+
+JACK_CLIENT_NAME = 'raspberry_looper'
+
 
 class AudioBackend(ABC):
     @classmethod
@@ -21,6 +28,8 @@ class AudioBackend(ABC):
             return PyAudioBackend()
         if backend_type == AudioBackendType.JACK:
             return JackBackend()
+        if backend_type == AudioBackendType.SIMULATED:
+            return SimulatedBackend()
         raise ValueError(f"Unknown audio backend: {backend_type}")
         
     @abstractmethod
@@ -31,22 +40,48 @@ class AudioBackend(ABC):
     def close(self):
         raise NotImplemented()
 
+    @property
+    def direct_monitoring(self) -> bool:
+        """Whether input is wired with the output outside of the looper callback"""
+        return False
+
+    def mute_direct_monitoring(self, muted: bool):
+        pass
+
+    def report(self) -> Dict:
+        return {}
+
 
 class PyAudioBackend(AudioBackend):
     def open(self, config: Config, stream_callback: Callable[[np.ndarray], np.ndarray]):
+        import pyaudio
         log.info('Initializing PyAudio for streaming audio...')
         self._pa = pyaudio.PyAudio()
         in_device, out_device = find_device_index(config, self._pa)
         dst_np_type = sample_format_numpy_type(config.sample_format)
+        inputs = config.active_input_channels
+        # PyAudio stream has the same number of input and output channels:
+        # surplus input channels are dropped, surplus output channels are silent
+        stream_channels = max(inputs, config.channels)
 
         def pyaudio_stream_callback(in_data, frame_count, time_info, status_flags):
+            # interleaved samples are frames x channels in row-major order, reshaping doesn't copy
             input_chunk = np.frombuffer(in_data, dtype=dst_np_type)
+            if stream_channels > 1:
+                input_chunk = input_chunk.reshape(-1, stream_channels)
+                if inputs < stream_channels:
+                    input_chunk = input_chunk[:, :inputs]
+                if inputs == 1:
+                    input_chunk = input_chunk[:, 0]
             out_chunk = stream_callback(input_chunk)
-            return out_chunk, pyaudio.paContinue
+            if config.channels < stream_channels:
+                out_chunk = out_chunk.reshape(frame_count, -1)
+                out_chunk = np.pad(out_chunk, ((0, 0), (0, stream_channels - out_chunk.shape[1])))
+            return out_chunk.tobytes(), pyaudio.paContinue
 
         self._loop_stream = self._pa.open(
             format=self.pyaudio_sample_format(config.sample_format),
-            channels=config.channels,
+            channels=stream_channels,
             rate=config.sampling_rate,
             input=True,
             output=True,
@@ -67,6 +102,7 @@ class PyAudioBackend(AudioBackend):
 
     @staticmethod
     def pyaudio_sample_format(sample_format: str):
+        import pyaudio
         if sample_format == 'int16':
             return pyaudio.paInt16
         elif sample_format == 'int32':
@@ -77,52 +113,59 @@ class PyAudioBackend(AudioBackend):
 
 
 class JackBackend(AudioBackend):
+    def __init__(self) -> None:
+        self._direct_monitoring: bool = False
+        self._inputs: int = 1
+        self._channels: int = 1
+        self._capture_ports: List['jack.Port'] = []
+        self._playback_ports: List['jack.Port'] = []
+
     def open(self, config: Config, stream_callback: Callable[[np.ndarray], np.ndarray]):
+        import jack
+        start_time = time.perf_counter()
         log.info('Initializing JACK server for streaming audio...')
-        if config.online:
-            in_device = config.jack_online_in_device
-            out_device = config.jack_online_out_device
-        else:
-            in_device = config.jack_offline_in_device
-            out_device = config.jack_offline_out_device
 
-        # Multiple soundcards with JACK: https://jackaudio.org/faq/multiple_devices.html
-        # ALSA driver options: http://ccrma.stanford.edu/planetccrma/man/man1/jackd.1.html
-        if in_device == out_device:
-            device_line = f' --device {in_device}'
+        self.jackd_cmd: Optional[BackgroundCommand] = None
+        client: Optional['jack.Client'] = self.attach_client()
+        self.reused_server: bool = client is not None
+        if client is None:
+            self.start_server(config)
+            client = self.open_client()
+            log.info('JACK server started')
         else:
-            device_line = f' --capture {in_device} --playback {out_device}'
-        cmdline = f'/usr/bin/jackd -ndefault --realtime -d alsa' \
-                  f'{device_line}' \
-                  f' --period {config.chunk_size}' \
-                  f' --nperiods 2' \
-                  f' --rate {config.sampling_rate}'
-
-        def on_jackd_error(e: CommandError):
-            log.error(f'JACK server failed')
-        
-        def on_next_line(line: str):
-            log.debug(f'JACK output', stdout=line.strip())
-
-        self.jackd_cmd = BackgroundCommand(
-            cmdline, on_error=on_jackd_error, on_next_line=on_next_line, 
-            print_stdout=False, debug=True,
-        )
-
-        client: jack.Client = self.open_client()
-        self.jack_client: jack.Client = client
-        log.info('JACK server started')
+            log.info('attached to already running JACK server')
+        self.jack_client: 'jack.Client' = client
+        self.verify_server(config)
         self.list_ports()
 
-        looper_input = client.inports.register('input_2')
-        looper_output = client.outports.register('output_2')
+        channels = config.channels
+        inputs = config.active_input_channels
+        looper_inputs = [client.inports.register(name) for name in _jack_port_names('input', inputs)]
+        looper_outputs = [client.outports.register(name) for name in _jack_port_names('output', channels)]
 
         capture_ports = self.get_capture_ports(config)
         playback_ports = self.get_playback_ports(config)
 
         capture_names = ', '.join([port.name for port in capture_ports])
         playback_names = ', '.join([port.name for port in playback_ports])
-        log.info('Wiring JACK ports', capture_ports=capture_names, playback_ports=playback_names)
+        log.info('Wiring JACK ports', capture_ports=capture_names, playback_ports=playback_names,
+            inputs=inputs, channels=channels)
+
+        # JACK ports carry separate float32 channels, the looper processes frames x channels
+        if inputs == 1:
+            def read_input() -> np.ndarray:
+                return np.copy(looper_inputs[0].get_array())
+        else:
+            def read_input() -> np.ndarray:
+                return np.stack([port.get_array() for port in looper_inputs], axis=1)
+
+        if channels == 1:
+            def write_output(out_chunk: np.ndarray):
+                looper_outputs[0].get_array()[:] = out_chunk
+        else:
+            def write_output(out_chunk: np.ndarray):
+                for channel, port in enumerate(looper_outputs):
+                    port.get_array()[:] = out_chunk[:, channel]
 
         if config.sample_format in {'int16', 'int32'}:
             dst_max_amp = sample_format_max_amplitude(config.sample_format)
@@ -130,19 +173,15 @@ class JackBackend(AudioBackend):
 
             @client.set_process_callback
             def process(blocksize: int):
-                input_chunk: np.ndarray = looper_input.get_array()  # float32
-                input_chunk = (input_chunk * dst_max_amp).astype(dst_np_type)
+                input_chunk = (read_input() * dst_max_amp).astype(dst_np_type)
                 out_chunk = stream_callback(input_chunk)
-                out_chunk = (out_chunk / dst_max_amp).astype(np.float32)
-                looper_output.get_array()[:] = out_chunk
+                write_output((out_chunk / dst_max_amp).astype(np.float32))
 
         elif config.sample_format == 'float32':
             @client.set_process_callback
             def process(blocksize: int):
-                input_chunk: np.ndarray = looper_input.get_array()  # float32
-                input_copy = np.copy(input_chunk)
-                out_chunk = stream_callback(input_copy)
-                looper_output.get_array()[:] = out_chunk
+                out_chunk = stream_callback(read_input())
+                write_output(out_chunk)
 
         else:
             raise ValueError(f"Unknown sample format: {config.sample_format}")
@@ -152,15 +191,114 @@ class JackBackend(AudioBackend):
             log.info('JACK shutdown', status=status, reason=reason)
 
         client.activate()
-        for capture_port in capture_ports:
-            client.connect(capture_port, looper_input)
-        for playback_port in playback_ports:
-            client.connect(looper_output, playback_port)
+        # N-th physical port is wired with the looper port of the same channel
+        for index, capture_port in enumerate(capture_ports):
+            self._connect(capture_port, looper_inputs[index % inputs])
+        for index, playback_port in enumerate(playback_ports):
+            self._connect(looper_outputs[index % channels], playback_port)
+
+        self._inputs = inputs
+        self._channels = channels
+        self._capture_ports = capture_ports
+        self._playback_ports = playback_ports
+        if config.listen_input and config.jack_direct_monitoring:
+            self._direct_monitoring = True
+            self.mute_direct_monitoring(False)
+
+        self.open_duration_s = time.perf_counter() - start_time
+        log.info('JACK stream started', reused_server=self.reused_server,
+            open_duration=f'{self.open_duration_s:.3f}s')
+
+    def start_server(self, config: Config):
+        if config.online:
+            in_device = config.jack_online_in_device
+            out_device = config.jack_online_out_device
+        else:
+            in_device = config.jack_offline_in_device
+            out_device = config.jack_offline_out_device
 
-        log.info('JACK stream started')
+        # Multiple soundcards with JACK: https://jackaudio.org/faq/multiple_devices.html
+        # ALSA driver options: http://ccrma.stanford.edu/planetccrma/man/man1/jackd.1.html
+        if in_device == out_device:
+            device_line = f' --device {in_device}'
+        else:
+            device_line = f' --capture {in_device} --playback {out_device}'
+        cmdline = f'/usr/bin/jackd -ndefault --realtime -d alsa' \
+                  f'{device_line}' \
+                  f' --period {config.chunk_size}' \
+                  f' --nperiods 2' \
+                  f' --rate {config.sampling_rate}'
+
+        if config.jack_persistent_server:
+            # detached from the looper process, so it survives looper restarts
+            log_path = Path(config.jack_server_log)
+            log_path.parent.mkdir(exist_ok=True, parents=True)
+            with log_path.open('ab') as log_file:
+                subprocess.Popen(cmdline.split(), stdout=log_file, stderr=subprocess.STDOUT,
+                                 stdin=subprocess.DEVNULL, start_new_session=True)
+            log.debug('persistent JACK server spawned', cmd=cmdline, log_file=log_path)
+            return
+
+        def on_jackd_error(e: CommandError):
+            log.error(f'JACK server failed')
+        
+        def on_next_line(line: str):
+            log.debug(f'JACK output', stdout=line.strip())
+
+        self.jackd_cmd = BackgroundCommand(
+            cmdline, on_error=on_jackd_error, on_next_line=on_next_line, 
+            print_stdout=False, debug=True,
+        )
+
+    def verify_server(self, config: Config):
+        """Check whether running server is compatible with the config"""
+        samplerate = self.jack_client.samplerate
+        if samplerate != config.sampling_rate:
+            self.jack_client.close(ignore_errors=True)
+            raise RuntimeError(f'running JACK server has sampling rate {samplerate}Hz, '
+                               f'but {config.sampling_rate}Hz is configured. Stop the server or change the config')
+        blocksize = self.jack_client.blocksize
+        if blocksize != config.chunk_size:
+            log.warn('changing buffer size of the running JACK server', blocksize=blocksize, chunk_size=config.chunk_size)
+            self.jack_client.blocksize = config.chunk_size
+
+    def report(self) -> Dict:
+        return {
+            'backend': 'jack',
+            'reused_server': self.reused_server,
+            'owns_server': self.jackd_cmd is not None,
+            'open_duration_s': self.open_duration_s,
+            'direct_monitoring': self._direct_monitoring,
+            'inputs': self._inputs,
+            'channels': self._channels,
+        }
+
+    @property
+    def direct_monitoring(self) -> bool:
+        return self._direct_monitoring
+
+    def mute_direct_monitoring(self, muted: bool):
+        """Connect capture ports straight to playback ports, so the input is heard at hardware latency"""
+        if not self._direct_monitoring:
+            return
+        for capture_index, capture_port in enumerate(self._capture_ports):
+            connected = {port.name for port in self.jack_client.get_all_connections(capture_port)}
+            for playback_index, playback_port in enumerate(self._playback_ports):
+                # channels are matched when inputs go to the outputs one-to-one, otherwise all are wired
+                if self._inputs == self._channels and capture_index % self._channels != playback_index % self._channels:
+                    continue
+                if muted and playback_port.name in connected:
+                    self.jack_client.disconnect(capture_port, playback_port)
+                elif not muted:
+                    self._connect(capture_port, playback_port)
+        log.info('direct monitoring ' + ('muted' if muted else 'connected'),
+            capture_ports=', '.join([port.name for port in self._capture_ports]),
+            playback_ports=', '.join([port.name for port in self._playback_ports]))
 
     def close(self):
+        import jack
         try:
+            self.mute_direct_monitoring(True)
             self.jack_client.outports.clear()
             self.jack_client.inports.clear()
         except jack.JackErrorCode as e:
@@ -168,13 +306,35 @@ class JackBackend(AudioBackend):
         self.jack_client.deactivate(ignore_errors=True)
         self.jack_client.close(ignore_errors=True)
         log.info('Audio JACK Stream closed')
-        self.jackd_cmd.terminate()
-        log.debug('JACK server closed')
+        if self.jackd_cmd is not None:
+            self.jackd_cmd.terminate()
+            log.debug('JACK server closed')
+        else:
+            log.debug('JACK server left running')
+
+    def _connect(self, source: 'jack.Port', destination: 'jack.Port'):
+        """Connect ports unless they're already connected"""
+        connected = {port.name for port in self.jack_client.get_all_connections(source)}
+        if destination.name not in connected:
+            self.jack_client.connect(source, destination)
+
+    def attach_client(self) -> Optional['jack.Client']:
+        """Connect to JACK server if it's already running"""
+        import jack
+        try:
+            return jack.Client(JACK_CLIENT_NAME, no_start_server=True)
+        except jack.JackOpenError:
+            return None
 
-    @backoff.on_exception(backoff.expo, jack.JackOpenError, factor=0.2, max_value=2, max_time=10, jitter=None)
-    def open_client(self) -> jack.Client:
-        log.debug('Connecting to JACK server...')
-        return jack.Client('raspberry_looper', no_start_server=True)
+    def open_client(self) -> 'jack.Client':
+        import jack
+
+        @backoff.on_exception(backoff.expo, jack.JackOpenError, factor=0.2, max_value=2, max_time=10, jitter=None)
+        def _connect() -> jack.Client:
+            log.debug('Connecting to JACK server...')
+            return jack.Client(JACK_CLIENT_NAME, no_start_server=True)
+
+        return _connect()
 
     def list_ports(self):
         playback_ports = self.jack_client.get_ports(is_input=True)
@@ -185,7 +345,7 @@ class JackBackend(AudioBackend):
         port_names = ', '.join([port.name for port in playback_ports])
         log.debug('found JACK playback ports', playback_ports=port_names)
 
-    def get_capture_ports(self, config: Config) -> List[jack.Port]:
+    def get_capture_ports(self, config: Config) -> List['jack.Port']:
         if config.jack_capture_ports:
             ports = []
             for port_name in config.jack_capture_ports:
@@ -196,9 +356,11 @@ class JackBackend(AudioBackend):
         else:
             capture_ports = self.jack_client.get_ports(is_audio=True, is_physical=True, is_output=True)
             assert capture_ports, 'No jack capture ports found to record from'
-            return [capture_ports[-1]]
+            if config.active_input_channels == 1:
+                return [capture_ports[-1]]
+            return capture_ports[:config.active_input_channels]
 
-    def get_playback_ports(self, config: Config) -> List[jack.Port]:
+    def get_playback_ports(self, config: Config) -> List['jack.Port']:
         if config.jack_playback_ports:
             ports = []
             for port_name in config.jack_playback_ports:
@@ -210,3 +372,36 @@ class JackBackend(AudioBackend):
             playback_ports = self.jack_client.get_ports(is_audio=True, is_physical=True, is_input=True)
             assert playback_ports, 'No jack playback ports found to play to'
             return playback_ports
+
+
+def _jack_port_names(prefix: str, channels: int) -> List[str]:
+    if channels == 1:
+        return [f'{prefix}_2']  # name of mono port kept for existing wiring setups
+    return [f'{prefix}_{channel + 1}' for channel in range(channels)]
+
+
+class SimulatedBackend(AudioBackend):
+    """Stream chunks of silence at real-time pace, without a sound card"""
+
+    def open(self, config: Config, stream_callback: Callable[[np.ndarray], np.ndarray]):
+        log.info('Starting simulated audio stream...')
+        self._running = True
+        input_chunk = np.zeros(config.input_chunk_shape, dtype=sample_format_numpy_type(config.sample_format))
+
+        def stream_loop():
+            next_time = time.perf_counter()
+            while self._running:
+                stream_callback(np.copy(input_chunk))
+                next_time += config.chunk_length_s
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+        self._thread = threading.Thread(target=stream_loop, name='simulated-audio', daemon=True)
+        self._thread.start()
+        log.info('Simulated stream started')
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+        log.info('Simulated stream closed')
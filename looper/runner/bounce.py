@@ -0,0 +1,196 @@
+from dataclasses import dataclass, field
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+from nuclear.sublog import log
+
+from looper.runner.actions import Quantize
+from looper.runner.events import EngineEventType
+from looper.runner.jobs import Job
+from looper.runner.sample import sample_format_max_amplitude, sample_format_numpy_type
+from looper.runner.storage import SampleCodec
+from looper.runner.trace import refuse_while_capturing
+from looper.runner.track import Track, common_loop_length
+
+if TYPE_CHECKING:
+    from looper.runner.looper import Looper
+
+
+@dataclass
+class TrackSnapshot:
+    chunks: List[np.array]  # stored chunks
+    scale: float
+    volume: float
+    pan: float
+    playing: bool
+    empty: bool
+    name: str
+
+    @staticmethod
+    def take(track: Track) -> 'TrackSnapshot':
+        # stored chunks are replaced rather than modified by everything but overdubbing
+        return TrackSnapshot(list(track.loop_chunks), track.scale, track.volume, track.pan,
+                             track.playing or track.pending_play, track.empty, track.name)
+
+
+@dataclass
+class BounceUndo:
+    """Source tracks of the last bounce, kept in int16 regardless of the track storage"""
+    target_id: int
+    loop_chunks_num: int
+    tracks: Dict[int, TrackSnapshot] = field(default_factory=dict)
+
+
+def bounce_tracks(looper: 'Looper', track_ids: List[int], keep_undo: bool = False, job: Optional[Job] = None) -> Dict:
+    """
+    Render tracks at their current volumes and pans into the first of them, freeing the others.
+    Blocking, should be run in a background job. The result is swapped in by the audio callback at the loop start.
+    Muted tracks are rendered as well.
+    """
+    from looper.runner.looper import LoopPhase
+
+    refuse_while_capturing(looper, 'bouncing tracks')
+    start_time = time.perf_counter()
+    track_ids = sorted(set(track_ids))
+    if not track_ids:
+        raise ValueError('no tracks to bounce')
+    with looper._lock:
+        if looper.phase != LoopPhase.LOOP:
+            raise RuntimeError('tracks can be bounced only while looping')
+        for track_id in track_ids:
+            if not 0 <= track_id < len(looper.tracks):
+                raise ValueError(f'track {track_id} does not exist')
+        sources = [looper.tracks[track_id] for track_id in track_ids]
+        for track in sources:
+            if track.recording or track.pending_swap is not None:
+                raise RuntimeError(f'track {track.index} is being recorded or replaced, cannot bounce it')
+        loop_chunks_num = looper.loop_chunks_num
+        # tracks longer than the master loop repeat shorter ones
+        chunks_num = common_loop_length(len(track.loop_chunks) for track in sources)
+        snapshots = {track.index: TrackSnapshot.take(track) for track in sources}
+        # overdubs modify stored chunks in place, touching the track
+        touched = {track.index: track.last_touched for track in sources}
+    target = sources[0]
+
+    mixed = [np.zeros(looper.config.chunk_shape, dtype=np.float32) for _ in range(chunks_num)]
+    for index, track in enumerate(sources):
+        if not snapshots[track.index].empty:
+            _render_track(track, snapshots[track.index], mixed)
+        if job is not None:
+            job.report_progress((index + 1) / (len(sources) + 1))
+    chunks = _to_sample_format(mixed, looper)
+    encoded_chunks, scale = target.encode_chunks(chunks, fade=False)
+
+    undo = None
+    if keep_undo:
+        undo = BounceUndo(target.index, loop_chunks_num)
+        for track in sources:
+            undo.tracks[track.index] = _compact_snapshot(track, snapshots[track.index])
+
+    def swap():
+        if looper.loop_chunks_num != loop_chunks_num or any(track.recording for track in sources):
+            log.warn('loop has changed while bouncing tracks, bounce discarded', tracks=track_ids)
+            return
+        if any(track.last_touched != touched[track.index] for track in sources):
+            log.warn('tracks have changed while bouncing, bounce discarded', tracks=track_ids)
+            return
+        for track in sources[1:]:
+            track.clear()
+            track.volume = 0
+            track.set_pan(0)
+            looper.publish(EngineEventType.TRACK, track.index)
+        target.schedule_swap(encoded_chunks, scale)
+        target.swap_pending()
+        # bounced muted tracks stay muted
+        target.playing = any(snapshot.playing for snapshot in snapshots.values())
+        target.pending_play = False
+        target.volume = 0
+        target.set_pan(0)
+        looper.bounce_undo = undo
+        looper.publish(EngineEventType.TRACK, target.index)
+
+    scheduled = looper.schedule('bounce', Quantize.LOOP, target.index, apply=swap)
+    if job is not None:
+        job.report_progress(1)
+
+    log.info('tracks will be bounced at the loop start', tracks=track_ids, target=target.index, undo=keep_undo,
+        elapsed=f'{time.perf_counter() - start_time:.2f}s')
+    return {
+        'target_id': target.index,
+        'tracks': track_ids,
+        'action_id': scheduled.id,
+    }
+
+
+def undo_bounce(looper: 'Looper', job: Optional[Job] = None) -> Dict:
+    """Restore source tracks of the last bounce at the loop start. Blocking, should be run in a background job."""
+    refuse_while_capturing(looper, 'undoing bounce')
+    undo: Optional[BounceUndo] = looper.bounce_undo
+    if undo is None:
+        raise RuntimeError('there is no bounce to undo')
+    if undo.loop_chunks_num != looper.loop_chunks_num:
+        raise RuntimeError('master loop has changed since the bounce')
+
+    restored = {}
+    for index, (track_id, snapshot) in enumerate(undo.tracks.items()):
+        track = looper.tracks[track_id]
+        chunks = [_compact_codec(track).decode(chunk, snapshot.scale) for chunk in snapshot.chunks]
+        restored[track_id] = track.encode_chunks(chunks, fade=False)
+        if job is not None:
+            job.report_progress((index + 1) / len(undo.tracks))
+
+    def swap():
+        if looper.bounce_undo is not undo or any(looper.tracks[track_id].recording for track_id in undo.tracks):
+            log.warn('tracks have changed, bounce undo discarded', tracks=list(undo.tracks))
+            return
+        for track_id, (encoded_chunks, scale) in restored.items():
+            track = looper.tracks[track_id]
+            snapshot = undo.tracks[track_id]
+            track.schedule_swap(encoded_chunks, scale)
+            track.swap_pending()
+            track.playing = snapshot.playing
+            track.empty = snapshot.empty
+            track.volume = snapshot.volume
+            track.set_pan(snapshot.pan)
+            track.name = snapshot.name
+            looper.publish(EngineEventType.TRACK, track_id)
+        looper.bounce_undo = None
+
+    scheduled = looper.schedule('unbounce', Quantize.LOOP, undo.target_id, apply=swap)
+    log.info('bounce will be undone at the loop start', tracks=list(undo.tracks))
+    return {
+        'target_id': undo.target_id,
+        'tracks': list(undo.tracks),
+        'action_id': scheduled.id,
+    }
+
+
+def _render_track(track: Track, snapshot: TrackSnapshot, mixed: List[np.array]):
+    """Mix stored chunks into the float sum with the gains applied by the mixer"""
+    gain = snapshot.scale * 10 ** (snapshot.volume / 20)
+    if snapshot.pan != 0 and track.config.channels > 1:
+        gain = track.dsp.pan_gains(snapshot.pan) * gain
+    for index in range(len(mixed)):
+        mixed[index] += np.multiply(snapshot.chunks[index % len(snapshot.chunks)], gain, dtype=np.float32)
+
+
+def _to_sample_format(mixed: List[np.array], looper: 'Looper') -> List[np.array]:
+    np_type = sample_format_numpy_type(looper.config.sample_format)
+    if np_type == np.float32:
+        return mixed
+    max_amp = sample_format_max_amplitude(looper.config.sample_format)
+    return [np.clip(np.rint(chunk), -max_amp, max_amp).astype(np_type) for chunk in mixed]
+
+
+def _compact_codec(track: Track) -> SampleCodec:
+    return SampleCodec(track.config.copy(update={'track_storage': 'int16'}))
+
+
+def _compact_snapshot(track: Track, snapshot: TrackSnapshot) -> TrackSnapshot:
+    codec = _compact_codec(track)
+    chunks = [track.codec.decode(chunk, snapshot.scale) for chunk in snapshot.chunks]
+    peak = max((float(np.max(np.abs(chunk))) for chunk in chunks), default=0)
+    scale = codec.fit_scale(peak)
+    return TrackSnapshot([codec.encode(chunk, scale) for chunk in chunks], scale, snapshot.volume, snapshot.pan,
+                         snapshot.playing, snapshot.empty, snapshot.name)
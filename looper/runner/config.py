@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from pydantic import BaseSettings
 
@@ -7,10 +7,11 @@ from pydantic import BaseSettings
 class AudioBackendType(Enum):
     PYAUDIO = 'pyaudio'  # pyAudio backend, not distrupting other apps
     JACK = 'jack'  # JACKd server for real-time, low-latency audio streaming, but disabling other apps
+    SIMULATED = 'simulated'  # streaming silence at real-time pace, without a sound card
 
 
 class Config(BaseSettings):
-    # Backend for streaming audio (on all devices): pyaudio or jack
+    # Backend for streaming audio (on all devices): pyaudio, jack or simulated
     audio_backend: Optional[AudioBackendType] = None
 
     # sampling rate [Hz], eg.: 44100, 48000
@@ -25,6 +26,12 @@ class Config(BaseSettings):
     # - float32 - 32bits, float
     sample_format: str = 'float32'
 
+    # Precision of recorded tracks kept in memory, mixed in sample format anyway
+    # - native - the same as sample format
+    # - int16 - 16bits integer with per-track scale, halves memory of float32
+    # - float16 - 16bits float, halves memory of float32
+    track_storage: str = 'native'
+
     # index of input device, -1 find automatically
     in_device: int = -1
     # index of output device, -1 find automatically
@@ -38,9 +45,21 @@ class Config(BaseSettings):
 
     jack_capture_ports: Optional[List[str]] = None
     jack_playback_ports: Optional[List[str]] = None
-
-    # mono
+    # Wire JACK capture ports directly with playback ports to listen to the input at hardware latency.
+    # Input is monitored at unity gain then, input and output volumes don't apply to it, muting either of them mutes it
+    jack_direct_monitoring: bool = False
+    # Keep JACK server running after looper exits, so the next start attaches to it in a fraction of a second
+    jack_persistent_server: bool = False
+    # Output of the persistent JACK server
+    jack_server_log: str = "out/jackd.log"
+
+    # number of audio channels, 1 - mono, 2 - stereo
     channels: int = 1
+    # number of captured input sources (eg. guitar and mic on separate inputs), 0 - the same as channels
+    input_channels: int = 0
+    # Routing of inputs to tracks: track index -> gains of input channels mixed into the track, eg. {1: [1, 0], 2: [0, 1]}
+    # Tracks without routing record every input channel to the matching output channel, or all inputs mixed together
+    track_inputs: Dict[int, List[float]] = {}
 
     # maximum duration of a track in seconds
     max_loop_duration_s: float = 4 * 60
@@ -54,6 +73,15 @@ class Config(BaseSettings):
     listen_input: bool = True
     # Amplification of the input signal [dB]
     input_volume: float = 6
+    # Round-trip latency compensated when overdubbing [samples], measured by "looper latency cycle"
+    latency_compensation_samples: int = 0
+
+    # Arm master recording to start once input crosses a threshold, instead of starting it right away
+    record_trigger: bool = False
+    # input level starting the armed master recording [dBFS]
+    record_trigger_threshold_db: float = -40
+    # audio before the threshold crossing included at the start of the master loop [s]
+    record_preroll_s: float = 0.05
 
     # Offline mode - without Raspberry Pi pins
     offline: bool = False
@@ -73,8 +101,31 @@ class Config(BaseSettings):
     # Sessions
     output_sessions_dir: str = "out/sessions"
 
+    # Spilling inactive tracks to memory-mapped files on disk
+    # memory budget for tracks kept in RAM [MB], 0 disables spilling
+    tracks_memory_budget_mb: float = 0
+    # muted tracks untouched for that long can be spilled, playing tracks are always kept in RAM [s]
+    spill_idle_s: float = 60
+    # scratch directory for spilled tracks
+    spill_dir: str = "out/spill"
+
+    # Crash-safe journal of loop state, recoverable with "looper run --recover" after power loss or crash
+    journal: bool = True
+    # directory of per-track journal files and state log
+    journal_dir: str = "out/journal"
+    # interval between writing modified chunks to disk [s]
+    journal_interval_s: float = 0.5
+
+    # On-demand profiling with /api/debug/profile
+    # directory of saved profiles: pstats or collapsed stacks for flame graphs
+    output_profiles_dir: str = "out/profiles"
+    # interval between samples of a thread's stack [ms]
+    profile_sampling_interval_ms: float = 2
+
     # Metronome
     metronome_volume: float = -1
+    # beats in a bar, used to quantize scheduled actions unless master loop is a metronome track
+    beats_per_bar: int = 4
 
     # If enabled, pressing spacebar key activates recording like footswitch does
     spacebar_footswitch: bool = True
@@ -82,17 +133,64 @@ class Config(BaseSettings):
     # If enabled, baseline bias will be automatically normalized
     auto_anti_bias: bool = True
 
-    # Enable asynchronous loops controlling buttons and diodes (consumes CPU)
+    # Enable asynchronous loop reading spacebar key presses (LEDs are updated on engine events)
     async_loops: bool = True
 
     # Set higher priority of a process
     prioritize_process: bool = True
+    # Niceness of the whole process (-20 is the most favorable)
+    process_nice: int = -20
+    # Real-time scheduling policy of the audio thread: fifo, rr or none
+    realtime_policy: str = 'fifo'
+    # Real-time priority of the audio thread (1-99)
+    realtime_priority: int = 70
+    # CPU core dedicated to the audio thread, -1 picks the last core
+    audio_cpu_core: int = -1
+    # Lock process memory in RAM to avoid page faults,
+    # later allocations are locked too, unless tracks are spilled or journaled to memory-mapped files
+    lock_memory: bool = True
+
+    # Fraction of chunk length that 99th percentile of callback time may take, when tuning chunk size
+    tune_max_callback_load: float = 0.5
+
+    # Garbage collector control: freeze objects after startup, collect outside of audio callback
+    gc_control: bool = True
+    # automatic collection thresholds of generations 0, 1, 2
+    gc_thresholds: List[int] = [50000, 20, 100]
+    # interval between deliberate collections [s]
+    gc_collect_interval_s: float = 1
+
+    # Background jobs (MP3 conversion, sessions, plots)
+    # number of worker threads running long operations
+    jobs_workers: int = 2
+    # number of finished jobs kept for status queries
+    jobs_history_size: int = 50
 
 
     @property
     def chunk_length_s(self) -> float:
         return self.chunk_size / self.sampling_rate
 
+    @property
+    def chunk_shape(self) -> Tuple[int, ...]:
+        """Shape of an audio chunk: (frames,) for mono, (frames, channels) otherwise"""
+        if self.channels == 1:
+            return (self.chunk_size,)
+        return (self.chunk_size, self.channels)
+
+    @property
+    def active_input_channels(self) -> int:
+        if self.input_channels > 0:
+            return self.input_channels
+        return self.channels
+
+    @property
+    def input_chunk_shape(self) -> Tuple[int, ...]:
+        """Shape of a captured chunk: (frames,) for a single input, (frames, inputs) otherwise"""
+        if self.active_input_channels == 1:
+            return (self.chunk_size,)
+        return (self.chunk_size, self.active_input_channels)
+
     @property
     def max_loop_chunks(self) -> int:
         return self.max_loop_duration_s // self.chunk_length_s
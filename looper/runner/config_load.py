@@ -1,6 +1,7 @@
-from typing import Optional
+from typing import Any, Dict, Optional
 import os
 from pathlib import Path
+import re
 
 import yaml
 from nuclear.sublog import log
@@ -11,6 +12,15 @@ DEFAULT_CONFIG_FILENAME = 'default.config.yaml'
 CONFIG_FILE_ENV = 'CONFIG_FILE'
 
 
+def resolve_config_path(config_file_path: Optional[str] = None) -> Path:
+    """Return path of the config file in use, or the default one to be created"""
+    if not config_file_path:
+        config_file_path = os.environ.get(CONFIG_FILE_ENV)
+    if not config_file_path:
+        return Path(DEFAULT_CONFIG_FILENAME)
+    return Path(config_file_path)
+
+
 def load_config(config_file_path: Optional[str] = None) -> Config:
     if not config_file_path:
         config_file_path = os.environ.get(CONFIG_FILE_ENV)
@@ -43,3 +53,24 @@ def load_config_from_file(path: Path) -> Config:
             return config
     except Exception as e:
         raise RuntimeError('loading config failed') from e
+
+
+def update_config_file(config_file_path: Optional[str], values: Dict[str, Any]):
+    """Set given keys in the YAML config file, keeping the rest of it (including comments) untouched"""
+    path = resolve_config_path(config_file_path)
+    lines = path.read_text().splitlines() if path.is_file() else []
+
+    for key, value in values.items():
+        Config.parse_obj({key: value})  # validate
+        new_line = yaml.safe_dump({key: value}, default_flow_style=True, width=1000).strip()
+        new_line = new_line[1:-1] if new_line.startswith('{') else new_line
+        key_pattern = re.compile(rf'^{re.escape(key)}\s*:')
+        for index, line in enumerate(lines):
+            if key_pattern.match(line):
+                lines[index] = new_line
+                break
+        else:
+            lines.append(new_line)
+
+    path.write_text('\n'.join(lines) + '\n')
+    log.info(f'config file updated', path=path, **values)
@@ -8,8 +8,10 @@ from looper.runner.sample import sample_format_max_amplitude, sample_format_nump
 class SignalProcessor:
     def __init__(self, config: Config) -> None:
         self.config = config
-        self.downramp = np.linspace(1, 0, config.chunk_size)
-        self.upramp = np.linspace(0, 1, config.chunk_size)
+        # ramps as column vectors in multi-channel mode, broadcast over channels
+        ramp_shape = (config.chunk_size,) + (1,) * (len(config.chunk_shape) - 1)
+        self.downramp = np.linspace(1, 0, config.chunk_size).reshape(ramp_shape)
+        self.upramp = np.linspace(0, 1, config.chunk_size).reshape(ramp_shape)
         self.max_amp = sample_format_max_amplitude(config.sample_format)
         self.np_type = sample_format_numpy_type(config.sample_format)
 
@@ -21,13 +23,23 @@ class SignalProcessor:
 
     def sine(self, amplitude: int, frequency: float = 440) -> np.array:
         sine_sample_frequency = frequency / self.config.sampling_rate
-        sine = np.empty(self.config.chunk_size, dtype=self.np_type)
-        for i in range(self.config.chunk_size):
-            sine[i] = np.sin(2 * np.pi * sine_sample_frequency * i) * amplitude
-        return sine
+        sine = np.sin(2 * np.pi * sine_sample_frequency * np.arange(self.config.chunk_size)) * amplitude
+        if self.config.channels > 1:
+            sine = np.repeat(sine[:, np.newaxis], self.config.channels, axis=1)
+        return sine.astype(self.np_type)
 
     def silence(self) -> np.array:
-        return np.zeros(self.config.chunk_size, dtype=self.np_type)
+        return np.zeros(self.config.chunk_shape, dtype=self.np_type)
+
+    def pan_gains(self, pan: float) -> np.array:
+        """
+        Compute gains of channels for a pan position from -1 (first channel) to 1 (last channel).
+        Constant-power law: sum of squared gains is equal to the number of channels, all gains are 1 in the center.
+        """
+        if self.config.channels == 1:
+            return np.ones(1, dtype=np.float32)
+        positions = np.linspace(-1, 1, self.config.channels)
+        return np.sqrt(np.clip(1 + pan * positions, 0, None)).astype(np.float32)
 
     def amplify(self, chunk: np.array, volume: float) -> np.array:
         """Amplify by a given volume in root-power decibels"""
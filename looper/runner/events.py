@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+from enum import Enum
+import queue
+import time
+from typing import List, Optional
+
+
+class EngineEventType(Enum):
+    PHASE = 'phase'  # loop phase has changed
+    TRACK = 'track'  # recording or playing state of a track has changed
+    LOOP_WRAP = 'loop_wrap'  # playback has reached the loop start
+    ACTIONS = 'actions'  # scheduled actions have been dropped
+
+
+@dataclass
+class EngineEvent:
+    type: EngineEventType
+    sample_clock: int  # number of samples streamed before the event
+    loop_position: int  # index of the chunk to be played next
+    time: float  # perf_counter time of publishing
+    track_id: Optional[int] = None
+
+
+class EngineEvents:
+    """
+    Publish engine state changes to the queues of subscribers.
+    Publishing never blocks, so it's safe to do from the audio callback.
+    """
+
+    def __init__(self) -> None:
+        self._subscribers: List[queue.SimpleQueue] = []
+
+    def subscribe(self) -> queue.SimpleQueue:
+        subscriber = queue.SimpleQueue()
+        self._subscribers = self._subscribers + [subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.SimpleQueue):
+        self._subscribers = [other for other in self._subscribers if other is not subscriber]
+
+    def publish(self, event_type: EngineEventType, sample_clock: int, loop_position: int,
+                track_id: Optional[int] = None):
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        event = EngineEvent(event_type, sample_clock, loop_position, time.perf_counter(), track_id)
+        for subscriber in subscribers:
+            subscriber.put(event)
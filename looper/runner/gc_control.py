@@ -0,0 +1,115 @@
+import gc
+import threading
+import time
+from typing import Dict, Optional
+
+from nuclear.sublog import log
+
+from looper.runner.config import Config
+
+# every n-th deliberate collection is a full one (including oldest generation)
+FULL_COLLECTION_EVERY = 60
+
+
+class GcPauseStats:
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.total_s: float = 0
+        self.max_s: float = 0
+        self.last_s: float = 0
+
+    def add(self, duration_s: float):
+        self.count += 1
+        self.total_s += duration_s
+        self.last_s = duration_s
+        if duration_s > self.max_s:
+            self.max_s = duration_s
+
+    def report(self) -> Dict:
+        return {
+            'count': self.count,
+            'total_ms': self.total_s * 1000,
+            'mean_ms': self.total_s * 1000 / self.count if self.count else 0,
+            'max_ms': self.max_s * 1000,
+            'last_ms': self.last_s * 1000,
+        }
+
+
+class GarbageCollectorControl:
+    """
+    Keep cyclic garbage collector away from the audio callback:
+    raise automatic collection thresholds, freeze long-lived objects
+    and collect deliberately from a separate thread right after a callback has completed.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.audio_thread_id: Optional[int] = None
+        self.all_pauses = GcPauseStats()
+        self.audio_thread_pauses = GcPauseStats()  # collections that paused the audio callback itself
+        self.deliberate_collections: int = 0
+        self._pause_start: Optional[float] = None
+        self._callback_done = threading.Event()
+        self._running = False
+
+    def start(self):
+        gc.callbacks.append(self._on_gc_event)
+        if not self.config.gc_control:
+            return
+        gc.set_threshold(*self.config.gc_thresholds)
+        self._running = True
+        threading.Thread(target=self._collect_loop, name='gc-collector', daemon=True).start()
+        log.debug('garbage collector control started', thresholds=gc.get_threshold())
+
+    def freeze(self):
+        """Move all objects created during startup to a permanent generation, ignored by collections"""
+        if not self.config.gc_control:
+            return
+        gc.collect()
+        gc.freeze()
+        log.info('garbage collector frozen', frozen_objects=gc.get_freeze_count())
+
+    def close(self):
+        self._running = False
+        self._callback_done.set()
+        if self._on_gc_event in gc.callbacks:
+            gc.callbacks.remove(self._on_gc_event)
+
+    def on_callback_done(self):
+        """Signal that audio callback has completed, so the collection won't interfere with it"""
+        if self._running and not self._callback_done.is_set():
+            self._callback_done.set()
+
+    def report(self) -> Dict:
+        return {
+            'enabled': self.config.gc_control,
+            'thresholds': gc.get_threshold(),
+            'counts': gc.get_count(),
+            'frozen_objects': gc.get_freeze_count(),
+            'deliberate_collections': self.deliberate_collections,
+            'pauses': self.all_pauses.report(),
+            'audio_thread_pauses': self.audio_thread_pauses.report(),
+        }
+
+    def _collect_loop(self):
+        interval = self.config.gc_collect_interval_s
+        last_collection = time.time()
+        while self._running:
+            self._callback_done.wait(timeout=interval)
+            self._callback_done.clear()
+            if time.time() - last_collection < interval:
+                continue
+            full = self.deliberate_collections % FULL_COLLECTION_EVERY == FULL_COLLECTION_EVERY - 1
+            gc.collect(2 if full else 1)
+            self.deliberate_collections += 1
+            last_collection = time.time()
+
+    def _on_gc_event(self, phase: str, info: Dict):
+        if phase == 'start':
+            self._pause_start = time.perf_counter()
+        elif phase == 'stop' and self._pause_start is not None:
+            duration = time.perf_counter() - self._pause_start
+            self._pause_start = None
+            self.all_pauses.add(duration)
+            if threading.get_ident() == self.audio_thread_id:
+                self.audio_thread_pauses.add(duration)
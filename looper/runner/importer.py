@@ -0,0 +1,143 @@
+from fractions import Fraction
+import io
+from pathlib import Path
+import time
+from typing import TYPE_CHECKING, List, Optional
+
+import numpy as np
+from nuclear.sublog import log
+
+from looper.runner.config import Config
+from looper.runner.events import EngineEventType
+from looper.runner.jobs import Job
+from looper.runner.metronome import adapt_channels
+from looper.runner.sample import sample_format_max_amplitude, sample_format_numpy_type
+from looper.runner.trace import refuse_while_capturing
+
+if TYPE_CHECKING:
+    from looper.runner.looper import Looper
+
+SUPPORTED_FORMATS = {'wav', 'mp3', 'flac'}
+# maximum denominator of a resampling ratio when stretching audio to the loop length
+STRETCH_MAX_DENOMINATOR = 1000
+
+
+def import_track_audio(
+    looper: 'Looper',
+    track_id: int,
+    data: bytes,
+    filename: str = '',
+    mode: str = 'fit',
+    job: Optional[Job] = None,
+):
+    """
+    Decode uploaded audio file and put it on a track. Blocking, should be run in a background job.
+    :param mode: how to match the master loop length: fit - trim or pad with silence, stretch - resample
+    """
+    from looper.runner.looper import LoopPhase
+
+    if mode not in {'fit', 'stretch'}:
+        raise ValueError(f'unknown import mode: {mode}')
+    refuse_while_capturing(looper, 'importing audio')
+    if looper.phase == LoopPhase.RECORDING_MASTER:
+        raise RuntimeError('cannot import audio while recording master loop')
+    if looper.phase != LoopPhase.LOOP and track_id != 0:
+        raise RuntimeError('master loop has to be imported on first track')
+    config = looper.config
+    start_time = time.perf_counter()
+
+    samples = decode_audio(data, filename, config)
+    if job is not None:
+        job.report_progress(0.5)
+
+    if looper.phase == LoopPhase.LOOP:
+        target_length = looper.loop_chunks_num * config.chunk_size
+        if mode == 'stretch':
+            samples = stretch_to_length(samples, target_length)
+        samples = fit_to_length(samples, target_length)
+    else:
+        chunks_num = max(1, round(len(samples) / config.chunk_size))
+        samples = fit_to_length(samples, chunks_num * config.chunk_size)
+
+    chunks = split_to_chunks(samples, config)
+    if job is not None:
+        job.report_progress(0.8)
+    track = looper.tracks[track_id]
+    encoded_chunks, scale = track.encode_chunks(chunks, fade=True)
+
+    with looper._lock:
+        if looper.phase == LoopPhase.LOOP:
+            if len(encoded_chunks) != looper.loop_chunks_num:
+                raise RuntimeError('master loop has changed while importing audio')
+            # swapped in by the audio callback at the loop start
+            track.schedule_swap(encoded_chunks, scale)
+        else:
+            looper.master_chunks = chunks
+            looper.current_position = 0
+            looper.loop_cycle = 0
+            for other_track in looper.tracks:
+                if other_track.index != track_id:
+                    other_track.set_empty(len(chunks))
+            track.schedule_swap(encoded_chunks, scale)
+            track.swap_pending()
+            looper.phase = LoopPhase.LOOP
+    looper.publish(EngineEventType.PHASE)
+    track.name = Path(filename).stem if filename else track.name
+
+    log.info('audio imported to track', track_id=track_id, file=filename, mode=mode,
+        duration=f'{len(samples) / config.sampling_rate:.2f}s', chunks=len(chunks),
+        elapsed=f'{time.perf_counter() - start_time:.2f}s')
+
+
+def decode_audio(data: bytes, filename: str, config: Config) -> np.array:
+    """Decode audio file to float samples in range [-1, 1], resampled to configured rate and channels"""
+    from pydub import AudioSegment
+
+    file_format = Path(filename).suffix.lower().lstrip('.') or None
+    if file_format is not None and file_format not in SUPPORTED_FORMATS:
+        raise ValueError(f'unsupported audio format: {file_format}, expected one of {sorted(SUPPORTED_FORMATS)}')
+    audio = AudioSegment.from_file(io.BytesIO(data), format=file_format)
+
+    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    samples /= 2 ** (8 * audio.sample_width - 1)
+    samples = samples.reshape(-1, audio.channels)
+    log.debug('audio decoded', file=filename, sampling_rate=audio.frame_rate, channels=audio.channels,
+        duration=f'{audio.duration_seconds:.2f}s')
+
+    samples = resample(samples, audio.frame_rate, config.sampling_rate)
+    if config.channels == 1:
+        return np.mean(samples, axis=1, dtype=np.float32)
+    return adapt_channels(samples, config.channels)
+
+
+def resample(samples: np.array, from_rate: int, to_rate: int) -> np.array:
+    if from_rate == to_rate:
+        return samples
+    from scipy.signal import resample_poly
+    ratio = Fraction(to_rate, from_rate)
+    return resample_poly(samples, ratio.numerator, ratio.denominator, axis=0).astype(np.float32)
+
+
+def stretch_to_length(samples: np.array, length: int) -> np.array:
+    """Resample audio to a given number of samples (changes tempo and pitch)"""
+    if len(samples) == length:
+        return samples
+    from scipy.signal import resample_poly
+    ratio = Fraction(length, len(samples)).limit_denominator(STRETCH_MAX_DENOMINATOR)
+    return resample_poly(samples, ratio.numerator, ratio.denominator, axis=0).astype(np.float32)
+
+
+def fit_to_length(samples: np.array, length: int) -> np.array:
+    """Trim or pad audio with silence to a given number of samples"""
+    if len(samples) >= length:
+        return samples[:length]
+    padding = [(0, length - len(samples))] + [(0, 0)] * (samples.ndim - 1)
+    return np.pad(samples, padding)
+
+
+def split_to_chunks(samples: np.array, config: Config) -> List[np.array]:
+    """Convert float samples to the configured sample format and split them to chunks"""
+    max_amp = sample_format_max_amplitude(config.sample_format)
+    np_type = sample_format_numpy_type(config.sample_format)
+    converted = np.clip(samples * max_amp, -max_amp, max_amp).astype(np_type)
+    return list(np.split(converted, len(converted) // config.chunk_size))
@@ -0,0 +1,154 @@
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+import time
+from threading import Lock
+from typing import Any, Callable, Deque, Dict, List, Optional
+import uuid
+
+from nuclear.sublog import log, log_exception
+
+from looper.runner.config import Config
+
+
+class JobType(Enum):
+    MP3_CONVERSION = 'mp3_conversion'
+    SESSION = 'session'
+    METRONOME = 'metronome'
+    PLOT = 'plot'
+    RENDER = 'render'
+    IMPORT = 'import'
+    PROFILE = 'profile'
+    BOUNCE = 'bounce'
+
+
+# maximum number of jobs of the same type running at once
+JOB_TYPE_CONCURRENCY: Dict[JobType, int] = {
+    JobType.MP3_CONVERSION: 1,
+    JobType.SESSION: 1,
+    JobType.METRONOME: 1,
+    JobType.PLOT: 1,  # pyplot is not thread-safe
+    JobType.RENDER: 1,
+    JobType.IMPORT: 1,
+    JobType.PROFILE: 1,
+    JobType.BOUNCE: 1,
+}
+
+
+class JobPhase(Enum):
+    PENDING = 1  # waiting for a free worker
+    RUNNING = 2
+    DONE = 3
+    FAILED = 4
+
+
+@dataclass
+class Job:
+    id: str
+    type: JobType
+    action: Callable[['Job'], Any]
+    phase: JobPhase = JobPhase.PENDING
+    progress: float = 0  # fraction of work done, 0-1
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    future: Future = field(default_factory=Future)
+
+    def report_progress(self, progress: float):
+        self.progress = min(max(progress, 0), 1)
+
+    @property
+    def finished(self) -> bool:
+        return self.phase in {JobPhase.DONE, JobPhase.FAILED}
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        end_time = self.finished_at if self.finished_at is not None else time.time()
+        return end_time - self.started_at
+
+    def info(self) -> Dict:
+        return {
+            'id': self.id,
+            'type': self.type.value,
+            'phase': self.phase.name,
+            'progress': self.progress,
+            'error': self.error,
+            'duration': self.duration,
+        }
+
+
+class JobManager:
+    """Run long, blocking operations in a bounded pool of background threads"""
+
+    def __init__(self, config: Config) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=config.jobs_workers, thread_name_prefix='looper-job')
+        self._history_size = config.jobs_history_size
+        self._jobs: Dict[str, Job] = OrderedDict()
+        self._pending: Dict[JobType, Deque[Job]] = defaultdict(deque)
+        self._running: Dict[JobType, int] = defaultdict(int)
+        self._lock = Lock()
+
+    def submit(self, job_type: JobType, action: Callable[[Job], Any]) -> Job:
+        job = Job(id=uuid.uuid4().hex[:12], type=job_type, action=action)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._pending[job_type].append(job)
+            self._forget_finished_jobs()
+            self._dispatch(job_type)
+        log.debug('job submitted', job_id=job.id, type=job_type.value)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise RuntimeError(f'job {job_id} does not exist')
+        return job
+
+    def list_jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _dispatch(self, job_type: JobType):
+        limit = JOB_TYPE_CONCURRENCY.get(job_type, 1)
+        while self._pending[job_type] and self._running[job_type] < limit:
+            job = self._pending[job_type].popleft()
+            self._running[job_type] += 1
+            self._executor.submit(self._run_job, job)
+
+    def _run_job(self, job: Job):
+        job.phase = JobPhase.RUNNING
+        job.started_at = time.time()
+        result, error = None, None
+        try:
+            result = job.action(job)
+        except Exception as e:
+            log_exception(e)
+            error = e
+
+        job.finished_at = time.time()
+        with self._lock:
+            self._running[job.type] -= 1
+            self._dispatch(job.type)
+
+        if error is None:
+            job.progress = 1
+            job.phase = JobPhase.DONE
+            job.future.set_result(result)
+            log.debug('job done', job_id=job.id, type=job.type.value, duration=f'{job.duration:.2f}s')
+        else:
+            job.error = str(error)
+            job.phase = JobPhase.FAILED
+            job.future.set_exception(error)
+
+    def _forget_finished_jobs(self):
+        finished_ids = [job.id for job in self._jobs.values() if job.finished]
+        excess = len(self._jobs) - self._history_size
+        for job_id in finished_ids[:max(excess, 0)]:
+            del self._jobs[job_id]
@@ -0,0 +1,297 @@
+from collections import deque
+import json
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from nuclear.sublog import log, log_exception
+
+from looper.runner.events import EngineEventType
+from looper.runner.trace import refuse_while_capturing
+from looper.runner.track import Track, repeat_chunks
+
+if TYPE_CHECKING:
+    from looper.runner.looper import Looper
+
+STATE_FILE = 'state.jsonl'
+# journal of the previous run, kept until the next start
+PREVIOUS_DIR = 'previous'
+# state log is compacted to the last entry after that many entries
+STATE_LOG_MAX_ENTRIES = 1000
+# number of recent journal cycles used to compute write bandwidth
+BANDWIDTH_WINDOW = 20
+
+
+class LoopJournal:
+    """
+    Continuously journal loop state to disk, so that it can be recovered after a crash or power loss.
+    Chunks modified by the audio callback are written to memory-mapped per-track files and synced periodically,
+    engine state changes are appended to a small metadata log.
+    """
+
+    def __init__(self, looper: 'Looper') -> None:
+        self.looper = looper
+        self.config = looper.config
+        self.journal_dir = Path(self.config.journal_dir)
+        self.previous_dir = self.journal_dir / PREVIOUS_DIR
+        self._files: Dict[int, Tuple[int, np.memmap]] = {}  # track index -> (id of journaled track, mapped file)
+        self._last_state: Optional[Dict] = None
+        self._state_entries: int = 0
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self.bytes_written: int = 0
+        self.last_sync_s: float = 0
+        self._cycles: Deque[Tuple[float, int]] = deque(maxlen=BANDWIDTH_WINDOW)  # (time, total bytes written)
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.journal
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._rotate_previous()
+        self.journal_dir.mkdir(exist_ok=True, parents=True)
+        self._running = True
+        self._thread = threading.Thread(target=self._worker_loop, name='loop-journal', daemon=True)
+        self._thread.start()
+        log.info('loop journal enabled', journal_dir=self.journal_dir, interval=f'{self.config.journal_interval_s}s')
+        if self.recoverable:
+            log.warn('unsaved loop state of the previous run found, '
+                     'recover it with "looper run --recover" or POST /api/journal/recover',
+                     saved_at=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.previous_state()['time'])))
+
+    def close(self):
+        if not self._running:
+            return
+        self._running = False
+        self._thread.join()
+        self.sync()
+
+    def _worker_loop(self):
+        while self._running:
+            time.sleep(self.config.journal_interval_s)
+            try:
+                self.sync()
+            except Exception as e:
+                log_exception(e)
+
+    def sync(self):
+        """Write modified chunks and flush them to disk, then append changed engine state"""
+        start_time = time.perf_counter()
+        with self.looper._lock:
+            tracks = list(self.looper.tracks)
+            modified: List[Tuple[Track, List[np.array], Optional[List[int]]]] = []
+            for track in tracks:
+                journaled_id = self._files.get(track.index, (None, None))[0]
+                if track.empty:
+                    # empty tracks aren't recovered from their data, file is removed
+                    if track.index in self._files:
+                        modified.append((track, [], None))
+                elif track.modified_chunks is None or journaled_id != id(track):
+                    modified.append((track, list(track.loop_chunks), None))
+                elif track.modified_chunks:
+                    modified.append((track, list(track.loop_chunks), sorted(track.modified_chunks)))
+                track.modified_chunks = set()
+            state = self._engine_state(tracks)
+
+        # chunks modified meanwhile are marked again and written in the next cycle
+        written = 0
+        for track, chunks, indices in modified:
+            written += self._write_track(track, chunks, indices)
+        for index in [index for index in self._files if index >= len(tracks)]:
+            self._remove_track_file(index)
+
+        if state != self._last_state:
+            self._append_state(state)
+            self._last_state = state
+
+        self.bytes_written += written
+        self.last_sync_s = time.perf_counter() - start_time
+        self._cycles.append((time.time(), self.bytes_written))
+
+    def _write_track(self, track: Track, chunks: List[np.array], indices: Optional[List[int]]) -> int:
+        if not chunks:
+            self._remove_track_file(track.index)
+            return 0
+        path = self._track_path(self.journal_dir, track.index)
+        _, mapped = self._files.get(track.index, (None, None))
+        shape = (len(chunks),) + chunks[0].shape
+        if indices is None or mapped is None or mapped.shape != shape or mapped.dtype != chunks[0].dtype:
+            # forgotten until rewritten, so a failed rewrite is retried in the next cycle
+            self._files.pop(track.index, None)
+            mapped = self._rewrite_track_file(path, chunks)
+            self._files[track.index] = (id(track), mapped)
+            return len(chunks) * chunks[0].nbytes
+        for index in indices:
+            mapped[index] = chunks[index]
+        mapped.flush()  # msync
+        self._files[track.index] = (id(track), mapped)
+        return len(indices) * chunks[0].nbytes
+
+    @staticmethod
+    def _rewrite_track_file(path: Path, chunks: List[np.array]) -> np.memmap:
+        """Write whole track to a new file replacing the old one, so a crash meanwhile keeps the previous copy"""
+        tmp_path = path.with_suffix('.tmp')
+        shape = (len(chunks),) + chunks[0].shape
+        mapped = np.memmap(str(tmp_path), dtype=chunks[0].dtype, mode='w+', shape=shape)
+        for index, chunk in enumerate(chunks):
+            mapped[index] = chunk
+        mapped.flush()  # msync
+        with tmp_path.open('rb+') as file:
+            os.fsync(file.fileno())
+        # mapping follows the renamed file
+        os.replace(tmp_path, path)
+        return mapped
+
+    def _remove_track_file(self, index: int):
+        self._files.pop(index, None)
+        self._track_path(self.journal_dir, index).unlink(missing_ok=True)
+
+    def _engine_state(self, tracks: List[Track]) -> Dict:
+        looper = self.looper
+        return {
+            'phase': looper.phase.name,
+            'loop_chunks': looper.loop_chunks_num,
+            'input_volume': looper.input_volume,
+            'output_volume': looper.output_volume,
+            'baseline_bias': looper.baseline_bias,
+            'latency_samples': looper.latency_samples,
+            'tracks': [{
+                'index': track.index,
+                'name': track.name,
+                'volume': track.volume,
+                'pan': track.pan,
+                'playing': track.playing or track.pending_play,
+                'empty': track.empty,
+                'scale': track.scale,
+                'dtype': str(track.loop_chunks[0].dtype) if track.loop_chunks else None,
+                'shape': [len(track.loop_chunks)] + list(track.loop_chunks[0].shape) if track.loop_chunks else None,
+            } for track in tracks],
+        }
+
+    def _append_state(self, state: Dict):
+        path = self.journal_dir / STATE_FILE
+        line = json.dumps({'time': time.time(), **state}) + '\n'
+        if self._state_entries >= STATE_LOG_MAX_ENTRIES:
+            tmp_path = path.with_suffix('.tmp')
+            with tmp_path.open('w') as file:
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, path)
+            self._state_entries = 1
+            return
+        with path.open('a') as file:
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+        self._state_entries += 1
+
+    def _rotate_previous(self):
+        """Keep journal of the previous run aside, unless it has nothing to recover, then an older one is kept"""
+        if not (self.journal_dir / STATE_FILE).is_file():
+            return
+        if _read_last_state(self.journal_dir) is not None:
+            if self.previous_dir.exists():
+                shutil.rmtree(self.previous_dir)
+            self.previous_dir.mkdir(parents=True)
+            for path in self.journal_dir.glob('*'):
+                if path.is_file():
+                    path.rename(self.previous_dir / path.name)
+        for path in self.journal_dir.glob('*'):
+            if path.is_file():
+                path.unlink()
+
+    def previous_state(self) -> Optional[Dict]:
+        return _read_last_state(self.previous_dir)
+
+    @property
+    def recoverable(self) -> bool:
+        return self.previous_state() is not None
+
+    def recover(self):
+        """Restore loop state journaled by the previous run"""
+        from looper.runner.looper import LoopPhase
+        refuse_while_capturing(self.looper, 'recovering journaled state')
+        start_time = time.perf_counter()
+        state = self.previous_state()
+        if state is None:
+            raise RuntimeError('there is no journaled loop state to recover')
+
+        tracks = []
+        for track_state in state['tracks']:
+            index = track_state['index']
+            track = Track(index, self.config, has_gpio=index < self.config.tracks_gpio_num)
+            track.name = track_state['name']
+            track.volume = track_state['volume']
+            track.set_pan(track_state['pan'])
+            track.set_empty(track_state['shape'][0] if track_state['shape'] else state['loop_chunks'])
+            if not track_state['empty']:
+                shape = tuple(track_state['shape'])
+                if shape[1:] != track.codec.empty().shape or track_state['dtype'] != np.dtype(track.codec.store_type).name:
+                    raise RuntimeError(f'journal was recorded in a different audio format: {track_state["dtype"]} {shape}')
+                stored = np.fromfile(str(self._track_path(self.previous_dir, index)), dtype=track_state['dtype'])
+                stored = stored.reshape(shape)
+                track.loop_chunks = [stored[chunk] for chunk in range(shape[0])]
+                track.scale = track_state['scale']
+                track.empty = False
+                track.playing = track_state['playing']
+            tracks.append(track)
+
+        looper = self.looper
+        with looper._lock:
+            looper.tracks = tracks
+            looper.tracks_num = len(tracks)
+            looper.master_chunks = repeat_chunks(tracks[0].loop_chunks, state['loop_chunks'])
+            looper.input_volume = state['input_volume']
+            looper.output_volume = state['output_volume']
+            looper.latency_samples = state['latency_samples']
+            looper.current_position = 0
+            looper.loop_cycle = 0
+            looper.phase = LoopPhase.LOOP
+        looper.baseline_bias = state['baseline_bias']
+        looper.publish(EngineEventType.PHASE)
+        log.info('loop state recovered from journal', tracks=len(tracks), loop_chunks=state['loop_chunks'],
+            elapsed=f'{time.perf_counter() - start_time:.3f}s')
+
+    def report(self) -> Dict:
+        write_bytes_s = 0
+        if len(self._cycles) >= 2:
+            (first_time, first_bytes), (last_time, last_bytes) = self._cycles[0], self._cycles[-1]
+            if last_time > first_time:
+                write_bytes_s = (last_bytes - first_bytes) / (last_time - first_time)
+        return {
+            'enabled': self.enabled,
+            'written_mb': self.bytes_written / 1024 / 1024,
+            'write_kb_s': write_bytes_s / 1024,
+            'last_sync_ms': self.last_sync_s * 1000,
+            'recoverable': self.enabled and self.recoverable,
+        }
+
+    @staticmethod
+    def _track_path(directory: Path, index: int) -> Path:
+        return directory / f'track-{index}.bin'
+
+
+def _read_last_state(directory: Path) -> Optional[Dict]:
+    """Return the last journaled state if it has a loop worth recovering"""
+    path = directory / STATE_FILE
+    if not path.is_file():
+        return None
+    state = None
+    with path.open() as file:
+        for line in file:
+            try:
+                state = json.loads(line)
+            except json.JSONDecodeError:
+                pass  # torn write of the last entry
+    if state is None:
+        return None
+    if state.get('phase') != 'LOOP' or all(track['empty'] for track in state['tracks']):
+        return None
+    return state
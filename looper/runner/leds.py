@@ -0,0 +1,76 @@
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, List, Optional
+
+from nuclear.sublog import log, log_exception
+
+from looper.runner.events import EngineEvent, EngineEventType
+
+if TYPE_CHECKING:
+    from looper.runner.looper import Looper
+
+
+class LedController:
+    """
+    Update LEDs only when the engine publishes a state change, staying idle otherwise.
+    Progress pulse is timed by the audio clock of the loop wrap, so it doesn't drift from the playback.
+    """
+
+    def __init__(self, looper: 'Looper') -> None:
+        self.looper = looper
+        self.config = looper.config
+        self._events: Optional[queue.SimpleQueue] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._events = self.looper.events.subscribe()
+        self._thread = threading.Thread(target=self._worker_loop, name='led-controller', daemon=True)
+        self._thread.start()
+        log.debug('LED controller started')
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._events.put(None)
+        self._thread.join()
+        self._thread = None
+        self.looper.events.unsubscribe(self._events)
+
+    def _worker_loop(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            # handle a burst of events at once
+            events: List[EngineEvent] = [event]
+            while True:
+                try:
+                    event = self._events.get_nowait()
+                except queue.Empty:
+                    break
+                if event is None:
+                    return
+                events.append(event)
+            try:
+                self.handle_events(events)
+            except Exception as e:
+                log_exception(e)
+
+    def handle_events(self, events: List[EngineEvent]):
+        if any(event.type != EngineEventType.LOOP_WRAP for event in events):
+            self.looper.update_leds()
+        progress_events = [event for event in events if event.type != EngineEventType.TRACK]
+        if progress_events:
+            self.pulse_progress(progress_events[-1])
+
+    def pulse_progress(self, event: EngineEvent):
+        """Fade in progress LED until the end of the loop, counting from the event's loop position"""
+        from looper.runner.looper import LoopPhase
+        looper = self.looper
+        if looper.phase != LoopPhase.LOOP:
+            return
+        chunks_left = looper.loop_chunks_num - event.loop_position
+        time_left = chunks_left * self.config.chunk_length_s - (time.perf_counter() - event.time)
+        if time_left > 0:
+            looper.pinout.progress_led.pulse(fade_in_time=time_left, fade_out_time=0, n=1)
@@ -1,26 +1,42 @@
-import asyncio
 from dataclasses import dataclass, field
-from typing import List
+import time
+from typing import Any, Callable, Dict, List, Optional
 from enum import Enum
-from threading import Lock
+from threading import Lock, get_ident
 
 from nuclear.sublog import log
 import numpy as np
+from looper.runner.actions import TRACK_ACTIONS, ActionScheduler, Quantize, ScheduledAction
 from looper.runner.audio_backend import AudioBackend
+from looper.runner.bounce import BounceUndo
 
 from looper.runner.config import Config
 from looper.runner.dsp import SignalProcessor
+from looper.runner.events import EngineEvents, EngineEventType
+from looper.runner.gc_control import GarbageCollectorControl
+from looper.runner.jobs import JobManager
+from looper.runner.journal import LoopJournal
+from looper.runner.leds import LedController
+from looper.runner.metrics import CallbackStats, ControlLatencyStats
 from looper.runner.metronome import Metronome
+from looper.runner.mixer import InputMixer, input_gains_vector
 from looper.runner.pinout import Pinout
+from looper.runner.profiler import CallbackProfiler
 from looper.runner.recorder import OutputRecorder
-from looper.runner.sample import sample_format_bytes, sample_format_max_amplitude
+from looper.runner.sample import sample_format_max_amplitude
+from looper.runner.scheduling import RealtimeScheduler
+from looper.runner.spill import SpillManager
+from looper.runner.storage import storage_bytes
+from looper.runner.trace import TraceWriter, trace_released, traced
 from looper.runner.track import Track
+from looper.runner.trigger import RecordTrigger, align_chunks
 
 
 class LoopPhase(Enum):
     VOID = 1  # not started yet
     RECORDING_MASTER = 2  # recording first, master track
     LOOP = 3  # loop length determined, looping recorded tracks 
+    ARMED = 4  # waiting for input crossing the threshold to start recording master track
 
 
 @dataclass
@@ -30,19 +46,41 @@ class Looper:
 
     phase: LoopPhase = LoopPhase.VOID
     current_position: int = 0  # current buffer (chunk) index
+    loop_cycle: int = 0  # number of master loops played since the loop started
+    sample_clock: int = 0  # number of samples streamed since start
     input_volume: float = 0  # dB
     input_muted: bool = False
     output_volume: float = 0  # dB
     output_muted: bool = False
     _baseline_bias: float = 0  # samples value that input baseline will be moved
+    latency_samples: int = 0  # round-trip latency compensated when overdubbing
     main_track: int = 0  # index of a track controllable by foot switch
+    metronome_beats: int = 0  # beats in a bar of the metronome master loop, 0 if not a metronome
+    metronome_bars: int = 0
     master_chunks: List[np.array] = field(default_factory=list)
+    master_start_sample: int = 0  # sample of the first master chunk the loop starts at
     tracks_num: int = 0
     tracks: List[Track] = field(default_factory=list)
+    bounce_undo: Optional[BounceUndo] = None  # source tracks of the last bounce
 
     audio_backend: AudioBackend = None
     recorder: OutputRecorder = None
     dsp: SignalProcessor = None
+    mixer: InputMixer = None
+    trigger: RecordTrigger = None
+    actions: ActionScheduler = None
+    jobs: JobManager = None
+    scheduler: RealtimeScheduler = None
+    gc_control: GarbageCollectorControl = None
+    spill: SpillManager = None
+    journal: LoopJournal = None
+    events: EngineEvents = field(default_factory=EngineEvents)
+    leds: LedController = None
+    trace: Optional[TraceWriter] = None  # capture of inputs and control events for a replay
+    profiler: Optional[CallbackProfiler] = None  # set only while audio callbacks are being profiled
+    callback_stats: CallbackStats = None
+    control_latency: ControlLatencyStats = None
+    first_callback_time: Optional[float] = None  # epoch time of the first processed audio chunk
     _lock: Lock = Lock()
 
     @property
@@ -62,59 +100,144 @@ class Looper:
             tempo *= 2
         return tempo
 
+    @property
+    def loop_beats(self) -> int:
+        """Number of beats in the loop, set by the metronome or derived from the loop tempo"""
+        if self.metronome_beats:
+            return self.metronome_beats * self.metronome_bars
+        if not self.master_chunks:
+            return 0
+        return max(1, round(self.loop_tempo * self.loop_duration / 60))
+
+    @property
+    def bar_beats(self) -> int:
+        return self.metronome_beats or self.config.beats_per_bar
+
+    @property
+    def chunk_clock(self) -> int:
+        """Number of chunks played since the loop started, positions of longer tracks are derived from it"""
+        return self.loop_cycle * self.loop_chunks_num + self.current_position
+
     @property
     def relative_progress(self) -> float:
         if len(self.master_chunks) == 0:
             return 0
         return self.current_position / len(self.master_chunks)
 
+    @traced
     def reset(self):
         with self._lock:
             self.phase = LoopPhase.VOID
             self.current_position = 0
+            self.loop_cycle = 0
             self.master_chunks = []
             self.tracks = []
             self.tracks_num = self.config.tracks_num
             self.input_volume = self.config.input_volume
             self.main_track = 0
+            self.metronome_beats = 0
+            self.metronome_bars = 0
+            self.bounce_undo = None
+            if self.actions is not None:
+                self.actions.clear()
             for track_id in range(self.tracks_num):
                 has_gpio = track_id < self.config.tracks_gpio_num
                 track = Track(track_id, self.config, has_gpio)
                 self.tracks.append(track)
+        self.publish(EngineEventType.PHASE)
 
-    def run(self) -> None:
+    def run(self, audio_backend: Optional[AudioBackend] = None) -> None:
         self.recorder = OutputRecorder(self.config)
+        self.latency_samples = self.config.latency_compensation_samples
+        self.callback_stats = CallbackStats(self.config.chunk_length_s)
+        self.control_latency = ControlLatencyStats(self.config.chunk_size)
+        self.jobs = JobManager(self.config)
         self.dsp = SignalProcessor(self.config)
+        self.mixer = InputMixer(self.config)
+        self.actions = ActionScheduler(self.config.chunk_size)
+        self.trigger = RecordTrigger(self.config)
         self.reset()
-        self.audio_backend = AudioBackend.make(self.config.active_audio_backend_type)
+        self.scheduler = RealtimeScheduler(self.config)
+        if self.config.prioritize_process:
+            self.scheduler.setup_process()
+        self.gc_control = GarbageCollectorControl(self.config)
+        self.gc_control.start()
+        self.spill = SpillManager(self)
+        self.spill.start()
+        self.journal = LoopJournal(self)
+        self.journal.start()
+        if self.trace is not None:
+            self.trace.start()
+        self.audio_backend = audio_backend or AudioBackend.make(self.config.active_audio_backend_type)
         self.audio_backend.open(self.config, self.stream_audio_chunk)
 
         if self.config.online:
             self.pinout.loopback_led.pulse(fade_in_time=0.5, fade_out_time=0.5)
             self.update_leds()
             self.bind_buttons()
+            self.leds = LedController(self)
+            self.leds.start()
 
     def stream_audio_chunk(self, input_chunk: np.ndarray) -> np.ndarray:
         """Read recorded input and generate playback audio chunk"""
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.enable()
+        if self.trace is not None:
+            # control events are applied between callbacks to be replayable at the same chunk
+            with self.trace.lock:
+                self.trace.on_input(input_chunk)
+                out_chunk = self._stream_audio_chunk(input_chunk)
+                self.trace.on_output(out_chunk)
+        else:
+            out_chunk = self._stream_audio_chunk(input_chunk)
+        if profiler is not None:
+            profiler.disable()
+        return out_chunk
+
+    def _stream_audio_chunk(self, input_chunk: np.ndarray) -> np.ndarray:
+        start_time = time.perf_counter()
+        if self.control_latency.pending:
+            self.control_latency.on_callback(self.callback_stats.count, self.current_position, start_time)
+        if self.first_callback_time is None:
+            self.first_callback_time = time.time()
+            self.gc_control.audio_thread_id = get_ident()
+            if self.config.prioritize_process:
+                self.scheduler.setup_audio_thread()
+        # input frames of all input channels
         if self.input_muted:
-            input_chunk = self.dsp.silence()
+            input_frames = self.mixer.silence()
         else:
-            input_chunk = input_chunk + self._baseline_bias
-            input_chunk = self.dsp.amplify(input_chunk, self.input_volume)
+            input_frames = input_chunk + self._baseline_bias
+            input_frames = self.mixer.process(input_frames, self.input_volume)
 
-        # listening to the input
-        out_chunk = input_chunk if self.config.listen_input else self.dsp.silence()
+        # listening to the input, unless it's wired with the output by the backend
+        if self.config.listen_input and not self.audio_backend.direct_monitoring:
+            out_chunk = self.mixer.route(input_frames)
+        else:
+            out_chunk = self.dsp.silence()
 
         with self._lock:
             # Recording master loop
             if self.phase == LoopPhase.RECORDING_MASTER:
                 if self.loop_chunks_num < self.config.max_loop_chunks:
-                    self.master_chunks.append(input_chunk)
+                    self.master_chunks.append(self.mixer.route(input_frames, self.tracks[0].input_gains))
+
+            # Waiting for the input to start recording master loop
+            elif self.phase == LoopPhase.ARMED:
+                triggered = self.trigger.process(self.mixer.route(input_frames, self.tracks[0].input_gains))
+                if triggered is not None:
+                    self.master_chunks, self.master_start_sample = triggered
+                    self.phase = LoopPhase.RECORDING_MASTER
+                    self.publish(EngineEventType.PHASE)
 
             # Recorded loop playback + Overdub
             if self.phase == LoopPhase.LOOP:
+                if self.actions.pending:
+                    out_chunk = self.execute_scheduled_actions(out_chunk)
                 out_chunk = self.current_playback(out_chunk)
-                self.overdub(input_chunk)
+                self.start_pending_recordings()
+                self.overdub(input_frames)
                 self.next_chunk()
 
         if self.output_muted:
@@ -123,19 +246,22 @@ class Looper:
             out_chunk = self.dsp.amplify(out_chunk, self.output_volume)
 
         self.recorder.transmit(out_chunk)
+        self.sample_clock += self.config.chunk_size
+        self.gc_control.on_callback_done()
+        self.callback_stats.add(time.perf_counter() - start_time)
         return out_chunk
     
     def bind_buttons(self):
         for track in self.tracks:
             if track.has_gpio:
                 def _toggle_record(track_index: int):
-                    return lambda: self.toggle_record(track_index)
+                    return lambda: self.control('gpio', self.toggle_record, track_index)
 
                 def _toggle_play(track_index: int):
-                    return lambda: self.toggle_play(track_index)
+                    return lambda: self.control('gpio', self.toggle_play, track_index)
                     
                 def _reset_track(track_index: int):
-                    return lambda: self.reset_track(track_index)
+                    return lambda: self.control('gpio', self.reset_track, track_index)
 
                 self.pinout.on_button_click(
                     self.pinout.record_buttons[track.index],
@@ -148,11 +274,17 @@ class Looper:
                 )
         self.pinout.on_button_click(
             self.pinout.foot_switch,
-            on_click=self.on_footswitch_press,
+            on_click=lambda: self.control('gpio', self.on_footswitch_press),
         )
 
+    def control(self, source: str, action: Callable, *args) -> Any:
+        """Run control action, measuring its latency from the source (gpio, spacebar, http) to the audio callback"""
+        with self.control_latency.event(source, action.__name__):
+            return action(*args)
+
     def current_playback(self, input_chunk: np.array) -> np.array:
-        active_chunks = [track.current_playback(self.current_position)
+        chunk_clock = self.chunk_clock
+        active_chunks = [track.current_playback(track.position(chunk_clock))
                          for track in self.tracks
                          if track.playing]
         if len(active_chunks) == 0:
@@ -161,23 +293,63 @@ class Looper:
             return active_chunks[0] + input_chunk
         return sum(active_chunks) + input_chunk
 
-    def overdub(self, input_chunk: np.array):
+    def overdub(self, input_frames: np.array):
+        # more than one track is recording only while a scheduled recording is handed over to another track
         for track in self.tracks:
             if track.recording:
-                track.overdub(input_chunk, self.current_position)
-                break
+                input_chunk = self.mixer.route(input_frames, track.input_gains)
+                was_playing = track.playing
+                track.overdub(input_chunk, track.position(self.chunk_clock), self.latency_samples)
+                if track.playing != was_playing or not track.recording:
+                    self.publish(EngineEventType.TRACK, track.index)
 
     def next_chunk(self):
         self.current_position += 1
         if self.current_position >= self.loop_chunks_num:
             self.current_position = 0
+            self.loop_cycle += 1
+            self.swap_pending_tracks()
+            self.start_pending_tracks()
+            self.publish(EngineEventType.LOOP_WRAP)
+
+    def swap_pending_tracks(self):
+        """Replace loops of tracks with the ones prepared in the background"""
+        for track in self.tracks:
+            if track.swap_pending():
+                self.publish(EngineEventType.TRACK, track.index)
 
+    def start_pending_tracks(self):
+        """Unmute tracks waiting for the loop start, once they are loaded back from disk"""
+        for track in self.tracks:
+            if track.pending_play and not track.spilled:
+                track.pending_play = False
+                track.playing = True
+                self.publish(EngineEventType.TRACK, track.index)
+
+    def start_pending_recordings(self):
+        """Start overdubbing tracks waiting to be loaded back from disk"""
+        for track in self.tracks:
+            if track.pending_record and not track.spilled:
+                track.pending_record = False
+                track.start_recording(track.position(self.chunk_clock))
+                self.publish(EngineEventType.TRACK, track.index)
+
+    @traced
     def toggle_record(self, track_id: int):
         if self.phase == LoopPhase.VOID:
             if track_id != 0:
                 log.warn('master loop has to be recorded on first track', track_id=track_id)
                 return
-            self.start_recording_master()
+            if self.config.record_trigger:
+                self.arm_recording_master()
+            else:
+                self.start_recording_master()
+
+        elif self.phase == LoopPhase.ARMED:
+            if track_id != 0:
+                log.warn('master loop has to be disarmed on first track', track_id=track_id)
+                return
+            self.disarm_recording_master()
 
         elif self.phase == LoopPhase.RECORDING_MASTER:
             if track_id != 0:
@@ -187,91 +359,157 @@ class Looper:
 
         elif self.phase == LoopPhase.LOOP:
             self.main_track = track_id
-            if self.tracks[track_id].recording:
+            if self.tracks[track_id].recording or self.tracks[track_id].pending_record:
                 self.stop_recording(track_id)
             else:
                 self.start_recording(track_id)
-        
-        self.update_leds()
+
+    @traced
+    def arm_recording_master(self):
+        """Start recording master loop once input crosses the threshold, including the pre-roll"""
+        with self._lock:
+            if self.phase not in {LoopPhase.VOID, LoopPhase.ARMED}:
+                raise RuntimeError('loop has to be empty to arm master recording')
+            self.trigger.reset()
+            self.master_chunks = []
+            self.main_track = 0
+            self.phase = LoopPhase.ARMED
+        self.publish(EngineEventType.PHASE)
+        log.debug('master recording armed', threshold=f'{self.config.record_trigger_threshold_db}dB',
+            preroll=f'{self.config.record_preroll_s}s')
+
+    def disarm_recording_master(self):
+        with self._lock:
+            if self.phase != LoopPhase.ARMED:
+                return
+            self.phase = LoopPhase.VOID
+        self.publish(EngineEventType.PHASE)
+        log.debug('master recording disarmed')
 
     def start_recording_master(self):
         with self._lock:
             self.master_chunks = []
+            self.master_start_sample = 0
             self.main_track = 0
             self.phase = LoopPhase.RECORDING_MASTER
+        self.publish(EngineEventType.PHASE)
         log.debug('recording master loop...')
 
     def stop_recording_master(self):
         with self._lock:
-            if self.config.auto_anti_bias:
-
-                chunks_bias = self.dsp.calculate_baseline_bias(self.master_chunks)
-                chunks_bias = self.dsp.amplify_sample(chunks_bias, -self.input_volume)
-                self.dsp.move_by_offset(self.master_chunks, -chunks_bias)
-                self._baseline_bias -= chunks_bias
-
-                chunks_bias_fraction = chunks_bias / sample_format_max_amplitude(self.config.sample_format)
-                log.info(f'input baseline bias has been automatically compensated', 
-                    bias=f'{round(chunks_bias, 6)}',
-                    total_bias=f'{round(self._baseline_bias, 6)}',
-                    bias_of_full_scale=f'{round(chunks_bias_fraction, 6)}',
-                )
-
-            self.current_position = 0
-            for track in self.tracks:
-                if track.index == 0:
-                    track.set_track(self.master_chunks, fade=True)
-                    track.playing = True
-                else:
-                    track.set_empty(self.loop_chunks_num)
-            self.phase = LoopPhase.LOOP
+            # loop triggered by the input starts in the middle of the first chunk
+            self.master_chunks = align_chunks(self.master_chunks, self.master_start_sample, self.config.chunk_size)
+            self.master_start_sample = 0
+            if not self.master_chunks:
+                self.phase = LoopPhase.VOID
+            else:
+                self._start_master_loop()
+        self.publish(EngineEventType.PHASE)
+        if self.phase == LoopPhase.VOID:
+            log.warn('master loop is too short, recording discarded')
+            return
 
         loudness = self.dsp.compute_loudness(self.master_chunks)  # should be below 0
         samples_num = self.loop_chunks_num * self.config.chunk_size
-        track_kb = samples_num * sample_format_bytes(self.config.sample_format) / 1024
+        track_kb = samples_num * self.config.channels * storage_bytes(self.config) / 1024
         log.info(f'master loop has been recorded', 
             loop_duration=f'{round(self.loop_duration, 2)}s',
             loop_tempo=f'{round(self.loop_tempo, 2)} BPM',
             loudness=f'{round(loudness, 2)}dB',
             chunks=self.loop_chunks_num,
             samples=samples_num,
+            channels=self.config.channels,
             track_memory=f'{track_kb} kiB',
         )
         if loudness > 0:
             log.warn('master loop is too loud', loudness=f'{round(loudness, 2)}dB')
 
+    def _start_master_loop(self):
+        """Turn recorded master chunks into the loop, looper lock has to be held"""
+        if self.config.auto_anti_bias:
+            chunks_bias = self.dsp.calculate_baseline_bias(self.master_chunks)
+            chunks_bias = self.dsp.amplify_sample(chunks_bias, -self.input_volume)
+            self.dsp.move_by_offset(self.master_chunks, -chunks_bias)
+            self._baseline_bias -= chunks_bias
+
+            chunks_bias_fraction = chunks_bias / sample_format_max_amplitude(self.config.sample_format)
+            log.info(f'input baseline bias has been automatically compensated', 
+                bias=f'{round(chunks_bias, 6)}',
+                total_bias=f'{round(self._baseline_bias, 6)}',
+                bias_of_full_scale=f'{round(chunks_bias_fraction, 6)}',
+            )
+
+        self.current_position = 0
+        self.loop_cycle = 0
+        for track in self.tracks:
+            if track.index == 0:
+                track.set_track(self.master_chunks, fade=True)
+                track.playing = True
+            else:
+                track.set_empty(self.loop_chunks_num)
+        self.phase = LoopPhase.LOOP
+
     def start_recording(self, track_id: int):
         if self.phase != LoopPhase.LOOP:
             return
         for track in self.tracks:
             if track.index != track_id:
                 track.recording = False
+                track.pending_record = False
         with self._lock:
-            self.tracks[track_id].start_recording(self.current_position)
+            track = self.tracks[track_id]
+            if track.spilled:
+                # overdubbing shouldn't write to the spilled file, it's loaded back in the background first
+                track.pending_record = True
+            else:
+                track.start_recording(track.position(self.chunk_clock))
+        if track.pending_record:
+            self.spill.prefetch(track)
+            log.debug('track will be overdubbed once loaded back to memory', track_id=track_id)
+        self.publish(EngineEventType.TRACK, track_id)
 
     def stop_recording(self, track_id: int):
         if self.phase != LoopPhase.LOOP:
             return
         with self._lock:
-            self.tracks[track_id].stop_recording()
+            track = self.tracks[track_id]
+            if track.pending_record:
+                track.pending_record = False
+            else:
+                track.stop_recording()
+        self.publish(EngineEventType.TRACK, track_id)
 
+    @traced
     def toggle_play(self, track_id: int):
         self.tracks[track_id].toggle_play()
-        self.update_leds()
+        if self.tracks[track_id].pending_play:
+            self.spill.prefetch(self.tracks[track_id])
+        self.publish(EngineEventType.TRACK, track_id)
 
     def reset_track(self, track_id: int):
-        self.main_track = track_id
-        self.tracks[track_id].clear()
+        """Clear track, confirmed by blinking its LED"""
+        self.clear_track(track_id)
         if self.tracks[track_id].has_gpio and self.config.online:
             self.pinout.record_leds[track_id].blink(on_time=0.1, off_time=0.1, n=2, background=False)
+
+    @traced
+    def clear_track(self, track_id: int):
+        self.main_track = track_id
+        self.tracks[track_id].clear()
         log.info('track cleared', track=track_id)
         if all(track.empty for track in self.tracks):
             with self._lock:
                 self.phase = LoopPhase.VOID
                 self.master_chunks = []
                 self.current_position = 0
+                self.loop_cycle = 0
+                self.metronome_beats = 0
+                self.metronome_bars = 0
+                self.actions.clear()
+            self.publish(EngineEventType.PHASE)
             log.info('all tracks reset, looper void')
-        self.update_leds()
+        else:
+            self.publish(EngineEventType.TRACK, track_id)
 
     def update_leds(self):
         if self.config.online:
@@ -293,12 +531,16 @@ class Looper:
                     if self.is_recording(track.index):
                         self.pinout.last_record_led().on()
 
+            if self.phase == LoopPhase.ARMED:
+                self.pinout.record_leds[0].blink(on_time=0.1, off_time=0.1)
+
             if self.phase != LoopPhase.LOOP:
                 self.pinout.progress_led.off()
 
     def is_recording(self, track_id: int) -> bool:
         return self.tracks[track_id].recording or (self.phase == LoopPhase.RECORDING_MASTER and track_id == 0)
 
+    @traced
     def add_track(self):
         track_id = self.tracks_num
         self.tracks_num += 1
@@ -308,8 +550,10 @@ class Looper:
             self.tracks.append(track)
             if self.phase == LoopPhase.LOOP:
                 track.set_empty(self.loop_chunks_num)
+        self.publish(EngineEventType.TRACK, track_id)
         log.info('new track added', tracks_num=self.tracks_num)
 
+    @traced
     def remove_track(self, track_id: int):
         if self.tracks_num == 1:
             raise RuntimeError('can not remove last track')
@@ -319,17 +563,49 @@ class Looper:
         with self._lock:
             self.tracks_num -= 1
             self.tracks.pop(track_id)
-            for track_id in range(self.tracks_num):
-                self.tracks[track_id].index = track_id
+            for index in range(self.tracks_num):
+                self.tracks[index].index = index
+        self.publish(EngineEventType.TRACK, track_id)
         log.info('track has been removed', track_id=track_id)
 
+    @traced
+    def set_track_inputs(self, track_id: int, gains: Optional[List[float]]):
+        """Route inputs to a track, None restores default routing"""
+        input_gains = input_gains_vector(self.config, gains)
+        with self._lock:
+            self.tracks[track_id].input_gains = input_gains
+        log.info('track inputs routed', track_id=track_id, input_gains=gains)
+
+    @traced
+    def set_track_length(self, track_id: int, multiple: int = 1, division: int = 1):
+        """Make track loop a multiple or a fraction of the master loop, repeating or cutting its content"""
+        if multiple < 1 or division < 1:
+            raise ValueError(f'track length should be a positive multiple or fraction, got {multiple}/{division}')
+        with self._lock:
+            if self.phase != LoopPhase.LOOP:
+                raise RuntimeError('track length can be changed only while looping')
+            chunks_num, remainder = divmod(self.loop_chunks_num * multiple, division)
+            if remainder or chunks_num == 0:
+                raise ValueError(f'master loop of {self.loop_chunks_num} chunks can not be divided by {division}')
+            track = self.tracks[track_id]
+            if track.recording or track.pending_swap is not None:
+                raise RuntimeError('track is being recorded or replaced, cannot change its length')
+            track.set_length(chunks_num)
+        self.publish(EngineEventType.TRACK, track_id)
+        log.info('track length set', track_id=track_id, length=f'{multiple}/{division}', chunks=chunks_num,
+            track_memory=f'{track.resident_bytes() / 1024:.3f} kiB')
+
+    @traced
     def set_metronome_tracks(self, bpm: float, beats: int = 4, bars: int = 1):
         if self.phase != LoopPhase.VOID:
             raise RuntimeError('loop has to be empty to add metronome track')
 
+        with trace_released(self):
+            master_chunks = Metronome(self.config).generate_beat(bpm, beats, bars)
         with self._lock:
-            self.master_chunks = Metronome(self.config).generate_beat(bpm, beats, bars)
+            self.master_chunks = master_chunks
             self.current_position = 0
+            self.loop_cycle = 0
             for track in self.tracks:
                 if track.index == 0:
                     track.set_track(self.master_chunks, fade=False)
@@ -338,6 +614,9 @@ class Looper:
                 else:
                     track.set_empty(self.loop_chunks_num)
             self.phase = LoopPhase.LOOP
+            self.metronome_beats = beats
+            self.metronome_bars = bars
+        self.publish(EngineEventType.PHASE)
 
         log.info(f'master loop has been set to metronome beats', 
             bpm=bpm,
@@ -347,23 +626,178 @@ class Looper:
             samples=self.loop_chunks_num*self.config.chunk_size,
         )
     
+    @traced
+    def schedule_action(self, action: str, track_id: int, quantize: str = 'bar') -> Optional[ScheduledAction]:
+        """
+        Record, stop, mute or unmute a track at the next beat, bar or loop start.
+        Executed right away if the loop is not playing yet.
+        """
+        if action not in TRACK_ACTIONS:
+            raise ValueError(f'unknown action: {action}, expected one of {sorted(TRACK_ACTIONS)}')
+        if not 0 <= track_id < self.tracks_num:
+            raise RuntimeError(f'track {track_id} does not exist')
+        quantize_to = Quantize(quantize)
+        if self.phase != LoopPhase.LOOP:
+            self._execute_action_now(action, track_id)
+            return None
+        scheduled = self.schedule(action, quantize_to, track_id)
+        if action in ('record', 'unmute'):
+            self.spill.prefetch(self.tracks[track_id])
+        log.info('action scheduled', action=action, track_id=track_id, quantize=quantize,
+            target_sample=scheduled.target_sample)
+        return scheduled
+
+    def schedule(
+        self,
+        action: str,
+        quantize: Quantize,
+        track_id: Optional[int] = None,
+        apply: Optional[Callable[[], None]] = None,
+    ) -> ScheduledAction:
+        """Queue action to be executed by the audio callback at a quantized loop position"""
+        with self._lock:
+            if self.phase != LoopPhase.LOOP:
+                raise RuntimeError('actions can be scheduled only while looping')
+            chunk_size = self.config.chunk_size
+            loop_samples = self.loop_chunks_num * chunk_size
+            target = self.actions.target_sample(quantize, self.current_position * chunk_size,
+                                                loop_samples, self.loop_beats, self.bar_beats)
+            if apply is not None:
+                # other actions take effect at the start of a chunk
+                target = -(-target // chunk_size) * chunk_size % loop_samples
+            return self.actions.add(action, track_id, quantize, target, apply)
+
+    def cancel_action(self, action_id: int):
+        with self._lock:
+            self.actions.cancel(action_id)
+
+    def scheduled_actions(self) -> List[Dict]:
+        chunk_size = self.config.chunk_size
+        return self.actions.report(self.current_position * chunk_size, self.loop_chunks_num * chunk_size,
+                                   self.config.sampling_rate)
+
+    def _execute_action_now(self, action: str, track_id: int):
+        if action == 'record' and not self.is_recording(track_id):
+            self.toggle_record(track_id)
+        elif action == 'stop' and self.is_recording(track_id):
+            self.toggle_record(track_id)
+        elif action == 'mute' and (self.tracks[track_id].playing or self.tracks[track_id].pending_play):
+            self.toggle_play(track_id)
+        elif action == 'unmute' and not (self.tracks[track_id].playing or self.tracks[track_id].pending_play):
+            self.toggle_play(track_id)
+
+    def execute_scheduled_actions(self, out_chunk: np.array) -> np.array:
+        """
+        Execute actions falling into the current chunk at their exact samples, called by the audio callback
+        before the tracks are mixed into the output chunk.
+        """
+        chunk_start = self.current_position * self.config.chunk_size
+        chunk_clock = self.chunk_clock
+        due = self.actions.pop_due(chunk_start)
+        while due:
+            action = due.pop(0)
+            offset = action.target_sample - chunk_start
+            if action.apply is not None:
+                # actions due along with it stay pending while it's applied, so it can drop them
+                self.actions.pending = due + self.actions.pending
+                action.apply()
+                due = self.actions.pop_due(chunk_start)
+                continue
+            if action.track_id >= len(self.tracks):
+                continue
+            track = self.tracks[action.track_id]
+            if action.name == 'record' and not track.recording:
+                for other in self.tracks:
+                    if other.recording:
+                        other.stop_recording_at(offset)
+                if track.spilled:
+                    # overdubbed once loaded back from disk
+                    track.pending_record = True
+                    self.spill.prefetch(track)
+                else:
+                    track.start_recording(track.position(chunk_clock), offset)
+                self.main_track = track.index
+            elif action.name == 'stop' and track.recording:
+                track.stop_recording_at(offset)
+            elif action.name == 'mute' and track.playing:
+                # track is still heard up to the action sample
+                out_chunk = np.copy(out_chunk)
+                out_chunk[:offset] += track.current_playback(track.position(chunk_clock))[:offset]
+                track.playing = False
+            elif action.name == 'unmute' and not track.playing and not track.empty and track.spilled:
+                # unmuted at the next loop start, once loaded back from disk
+                track.pending_play = True
+                self.spill.prefetch(track)
+            elif action.name == 'unmute' and not track.playing and not track.empty:
+                # track is mixed from the action sample on
+                out_chunk = np.copy(out_chunk)
+                out_chunk[:offset] -= track.current_playback(track.position(chunk_clock))[:offset]
+                track.playing = True
+                track.pending_play = False
+            else:
+                continue
+            self.publish(EngineEventType.TRACK, track.index)
+        return out_chunk
+
     def on_footswitch_press(self):
         self.toggle_record(self.main_track)
 
+    @traced
     def toggle_input_mute(self):
         self.input_muted = not self.input_muted
+        self.audio_backend.mute_direct_monitoring(self.input_muted or self.output_muted)
         if self.input_muted:
             log.info('input muted')
         else:
             log.info('input unmuted')
 
+    @traced
     def toggle_output_mute(self):
         self.output_muted = not self.output_muted
+        self.audio_backend.mute_direct_monitoring(self.input_muted or self.output_muted)
         if self.output_muted:
             log.info('output muted')
         else:
             log.info('output unmuted')
 
+    @traced
+    def set_main_track(self, track_id: int):
+        self.main_track = track_id
+
+    @traced
+    def set_input_volume(self, volume: float):
+        self.input_volume = volume
+        log.info('input volume set', volume=f'{volume}dB')
+
+    @traced
+    def set_output_volume(self, volume: float):
+        self.output_volume = volume
+        log.info('output volume set', volume=f'{volume}dB')
+
+    @traced
+    def set_input_channel_volume(self, input_id: int, volume: float):
+        self.mixer.set_volume(input_id, volume)
+        log.info('input channel volume set', input=input_id, volume=f'{volume}dB')
+
+    @traced
+    def set_track_volume(self, track_id: int, volume: float):
+        self.tracks[track_id].volume = volume
+        log.info('track volume set', track=track_id, volume=f'{volume}dB')
+
+    @traced
+    def set_track_pan(self, track_id: int, pan: float):
+        self.tracks[track_id].set_pan(pan)
+        log.info('track pan set', track=track_id, pan=pan)
+
+    @traced
+    def set_latency_samples(self, latency_samples: int):
+        self.latency_samples = latency_samples
+        log.info('latency compensation set', latency_samples=latency_samples)
+
+    @traced
+    def set_baseline_bias(self, bias_fraction: float):
+        self.baseline_bias = bias_fraction
+
     @property
     def baseline_bias(self) -> float:
         """Return fraction of full-scale that input baseline is moved"""
@@ -374,18 +808,20 @@ class Looper:
         self._baseline_bias = bias_fraction * sample_format_max_amplitude(self.config.sample_format)
         log.info('baseline bias set', bias_value=self._baseline_bias, bias_fraction=bias_fraction)
 
-    async def update_progress(self):
-        if self.phase != LoopPhase.LOOP:
-            await asyncio.sleep(0.5)
-            return
+    def publish(self, event_type: EngineEventType, track_id: Optional[int] = None):
+        """Notify subscribers about a state change, stamped with the audio sample clock"""
+        self.events.publish(event_type, self.sample_clock, self.current_position, track_id)
 
-        chunks_left = self.loop_chunks_num - self.current_position
-        chunks_left_s = chunks_left * self.config.chunk_length_s
-        self.pinout.progress_led.pulse(fade_in_time=chunks_left_s, fade_out_time=0, n=1)
-        await asyncio.sleep(chunks_left_s)
-    
     def close(self):
         log.debug('closing looper...')
+        if self.leds is not None:
+            self.leds.close()
         if self.config.online:
             self.pinout.tear_down()
         self.audio_backend.close()
+        self.jobs.close()
+        self.gc_control.close()
+        self.spill.close()
+        self.journal.close()
+        if self.trace is not None:
+            self.trace.close()
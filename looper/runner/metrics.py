@@ -0,0 +1,147 @@
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+import time
+from typing import Deque, Dict, Iterator, List
+
+import numpy as np
+
+# number of the most recent callbacks kept for statistics
+CALLBACK_HISTORY = 4096
+# upper edges of buckets of control latency histograms [ms]
+CONTROL_LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# number of the most recent control events kept per source for percentiles
+CONTROL_LATENCY_HISTORY = 256
+
+
+class CallbackStats:
+    """Durations of the recent audio callbacks, recorded without allocations"""
+
+    def __init__(self, chunk_length_s: float, history: int = CALLBACK_HISTORY) -> None:
+        self.chunk_length_s = chunk_length_s
+        self.durations = np.zeros(history)
+        self.count: int = 0
+        self.late_count: int = 0  # callbacks longer than a chunk, causing xruns
+
+    def add(self, duration_s: float):
+        self.durations[self.count % len(self.durations)] = duration_s
+        self.count += 1
+        if duration_s > self.chunk_length_s:
+            self.late_count += 1
+
+    def reset(self):
+        self.count = 0
+        self.late_count = 0
+
+    def percentile(self, q: float) -> float:
+        recent = self.durations[:min(self.count, len(self.durations))]
+        if recent.size == 0:
+            return 0
+        return float(np.percentile(recent, q))
+
+    def report(self) -> Dict:
+        recent = self.durations[:min(self.count, len(self.durations))]
+        p99 = self.percentile(99)
+        return {
+            'count': self.count,
+            'late_count': self.late_count,
+            'mean_ms': float(np.mean(recent)) * 1000 if recent.size else 0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p99_ms': p99 * 1000,
+            'max_ms': float(np.max(recent)) * 1000 if recent.size else 0,
+            'chunk_length_ms': self.chunk_length_s * 1000,
+            'p99_load': p99 / self.chunk_length_s,
+        }
+
+
+@dataclass
+class ControlEvent:
+    source: str  # gpio, spacebar or http
+    action: str
+    source_time: float  # perf_counter time when the event was received from its source
+    applied_time: float = 0  # when the action has changed engine state
+    effect_time: float = 0  # start of the first audio callback processing the changed state
+    effect_sample: int = 0  # sample clock of the audio stream at which the event took effect
+    effect_position: int = 0  # sample within the loop at which the event took effect
+    failed: bool = False  # action raised an error, event is not measured
+
+
+class ControlLatencyStats:
+    """
+    Latency of control events from their source (GPIO button, spacebar, HTTP request) to the audio callback.
+    Audio callback only stamps events pending in a queue, histograms are aggregated when reported.
+    """
+
+    def __init__(self, chunk_size: int) -> None:
+        self.chunk_size = chunk_size
+        self.pending: Deque[ControlEvent] = deque()
+        self._completed: Deque[ControlEvent] = deque()
+        self.histograms: Dict[str, List[int]] = {}
+        self.recent: Dict[str, Deque[ControlEvent]] = {}
+
+    @contextmanager
+    def event(self, source: str, action: str) -> Iterator[None]:
+        event = ControlEvent(source, action, time.perf_counter())
+        self.pending.append(event)
+        try:
+            yield
+        except BaseException:
+            # dropped by the callback if it's being stamped meanwhile
+            event.failed = True
+            try:
+                self.pending.remove(event)
+            except ValueError:
+                pass
+            raise
+        event.applied_time = time.perf_counter()
+
+    def on_callback(self, callback_index: int, loop_position: int, start_time: float):
+        """Stamp events applied before the callback with the audio clock, keeping the ones still being applied"""
+        for _ in range(len(self.pending)):
+            event = self.pending.popleft()
+            if event.failed:
+                continue
+            if not event.applied_time or event.applied_time > start_time:
+                self.pending.append(event)
+                continue
+            event.effect_time = start_time
+            event.effect_sample = callback_index * self.chunk_size
+            event.effect_position = loop_position * self.chunk_size
+            self._completed.append(event)
+
+    def _aggregate(self):
+        while self._completed:
+            event = self._completed.popleft()
+            if event.source not in self.histograms:
+                self.histograms[event.source] = [0] * (len(CONTROL_LATENCY_BUCKETS_MS) + 1)
+                self.recent[event.source] = deque(maxlen=CONTROL_LATENCY_HISTORY)
+            latency_ms = (event.effect_time - event.source_time) * 1000
+            self.histograms[event.source][bisect_left(CONTROL_LATENCY_BUCKETS_MS, latency_ms)] += 1
+            self.recent[event.source].append(event)
+
+    def report(self) -> Dict:
+        self._aggregate()
+        report = {}
+        for source, counts in self.histograms.items():
+            events = self.recent[source]
+            apply_ms = np.array([event.applied_time - event.source_time for event in events]) * 1000
+            effect_ms = np.array([event.effect_time - event.source_time for event in events]) * 1000
+            labels = [f'<={edge}ms' for edge in CONTROL_LATENCY_BUCKETS_MS] + [f'>{CONTROL_LATENCY_BUCKETS_MS[-1]}ms']
+            last = events[-1]
+            report[source] = {
+                'count': sum(counts),
+                'histogram': dict(zip(labels, counts)),
+                'apply_p50_ms': float(np.percentile(apply_ms, 50)),
+                'effect_p50_ms': float(np.percentile(effect_ms, 50)),
+                'effect_p99_ms': float(np.percentile(effect_ms, 99)),
+                'effect_max_ms': float(np.max(effect_ms)),
+                'effect_jitter_ms': float(np.std(effect_ms)),
+                'last': {
+                    'action': last.action,
+                    'effect_ms': (last.effect_time - last.source_time) * 1000,
+                    'effect_sample': last.effect_sample,
+                    'effect_position': last.effect_position,
+                },
+            }
+        return report
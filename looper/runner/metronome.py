@@ -2,7 +2,6 @@ from typing import List
 from pathlib import Path
 
 import numpy as np
-from scipy.io import wavfile
 
 from looper.runner.config import Config
 from looper.runner.dsp import SignalProcessor
@@ -24,7 +23,7 @@ class Metronome:
         beat_low = self.load_wav_array(Path('sfx') / f'metronome-beat-low-{self.config.sampling_rate}.wav')
 
         np_type = sample_format_numpy_type(self.config.sample_format)
-        track = np.zeros(samples_num, dtype=np_type)
+        track = np.zeros((samples_num,) + self.config.chunk_shape[1:], dtype=np_type)
 
         for beat in range(beats):
             if beat == 0:  # high beat
@@ -38,17 +37,26 @@ class Metronome:
         return np.split(track, chunks_num) * bars
 
     def load_wav_array(self, path: Path) -> np.array:
+        from scipy.io import wavfile
         samplerate, data = wavfile.read(str(path))
         assert samplerate == self.config.sampling_rate, \
             f'Sampling rate of metronome beat {samplerate} doesn\'t match {self.config.sampling_rate}'
-        channels = data.shape[1]
-        if channels > 1:
-            left = data[:, 0]
-            return left
-        return data
+        return adapt_channels(data, self.config.channels)
+
+
+def adapt_channels(data: np.array, channels: int) -> np.array:
+    """Convert samples (frames or frames x channels) to the shape used by the engine"""
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    if channels == 1:
+        return data[:, 0]
+    if data.shape[1] >= channels:
+        return data[:, :channels]
+    # repeat the last channel to the missing ones
+    missing = np.repeat(data[:, -1:], channels - data.shape[1], axis=1)
+    return np.concatenate([data, missing], axis=1)
 
 
 def _add_track_at_offset(track: np.array, sound: np.array, offset: int):
-    for sound_index in range(len(sound)):
-        if sound_index + offset < len(track):
-            track[offset + sound_index] += sound[sound_index]
+    length = max(0, min(len(sound), len(track) - offset))
+    track[offset:offset + length] += sound[:length]
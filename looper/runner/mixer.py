@@ -0,0 +1,78 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.sample import sample_format_max_amplitude, sample_format_numpy_type
+
+
+class InputMixer:
+    """
+    Apply per-input volumes and meter all input channels in one vectorized pass,
+    then route the inputs to the channels of a track.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.inputs_num: int = config.active_input_channels
+        self.channels: int = config.channels
+        self.np_type = sample_format_numpy_type(config.sample_format)
+        self.max_amp = sample_format_max_amplitude(config.sample_format)
+        self.volumes: List[float] = [0] * self.inputs_num  # dB
+        self._gains = np.ones(self.inputs_num, dtype=np.float32)
+        self._peaks = np.zeros(self.inputs_num, dtype=np.float32)  # held until read by a meter
+        # inputs matching output channels are passed through, otherwise every input goes to every channel
+        self._passthrough: bool = self.inputs_num == self.channels
+
+    def silence(self) -> np.array:
+        return np.zeros(self.config.input_chunk_shape, dtype=self.np_type)
+
+    def set_volume(self, input_id: int, volume: float):
+        if not 0 <= input_id < self.inputs_num:
+            raise RuntimeError(f'input {input_id} does not exist')
+        self.volumes[input_id] = volume
+        self._gains[input_id] = 10 ** (volume / 20)
+
+    def process(self, frames: np.array, volume: float) -> np.array:
+        """Amplify input channels by their volumes and a common volume [dB], update peak meters"""
+        amplified = (frames * (self._gains * 10 ** (volume / 20))).astype(self.np_type, copy=False)
+        peaks = np.max(np.abs(amplified.reshape(-1, self.inputs_num)), axis=0)
+        np.maximum(self._peaks, peaks, out=self._peaks)
+        return amplified
+
+    def route(self, frames: np.array, input_gains: Optional[np.array] = None) -> np.array:
+        """
+        Convert input frames to a chunk of output channels.
+        :param input_gains: gains of input channels mixed into a track, None for default routing
+        """
+        if input_gains is None:
+            if self._passthrough:
+                return frames
+            mono = np.sum(frames.reshape(-1, self.inputs_num), axis=1, dtype=np.float32)
+        else:
+            mono = frames.reshape(-1, self.inputs_num) @ input_gains
+        if self.channels > 1:
+            mono = np.repeat(mono[:, np.newaxis], self.channels, axis=1)
+        return mono.astype(self.np_type, copy=False)
+
+    def read_levels(self) -> List[float]:
+        """Return peak levels of inputs [dBFS] since the last read and reset them"""
+        peaks = self._peaks / self.max_amp
+        self._peaks[:] = 0
+        return [float(20 * np.log10(peak)) if peak > 0 else -100 for peak in peaks]
+
+    def report(self) -> List[Dict]:
+        levels = self.read_levels()
+        return [
+            {'index': index, 'volume': self.volumes[index], 'level': levels[index]}
+            for index in range(self.inputs_num)
+        ]
+
+
+def input_gains_vector(config: Config, gains: Optional[List[float]]) -> Optional[np.array]:
+    """Validate routing of inputs to a track"""
+    if gains is None:
+        return None
+    if len(gains) != config.active_input_channels:
+        raise ValueError(f'routing should have gains of {config.active_input_channels} inputs, got {len(gains)}')
+    return np.array(gains, dtype=np.float32)
@@ -1,8 +1,6 @@
 import io
 import random
 
-import matplotlib.pyplot as plt
-import matplotlib
 import numpy as np
 from starlette.responses import StreamingResponse
 
@@ -12,6 +10,8 @@ from looper.runner.track import Track
 
 
 def generate_track_plot(track: Track, looper: Looper) -> StreamingResponse:
+    import matplotlib
+    import matplotlib.pyplot as plt
     matplotlib.rcParams["agg.path.chunksize"] = 10_000
     matplotlib.rcParams['path.simplify'] = True
     matplotlib.rcParams['path.simplify_threshold'] = 1.0
@@ -21,7 +21,7 @@ def generate_track_plot(track: Track, looper: Looper) -> StreamingResponse:
     if len(track.loop_chunks) == 0:
         all_chunks = looper.dsp.silence()
     else:
-        all_chunks = np.concatenate(track.loop_chunks)
+        all_chunks = np.concatenate(track.decoded_chunks())
         all_chunks = all_chunks / max_amp
 
     figure = plt.figure(dpi=100)
@@ -36,11 +36,15 @@ def generate_track_plot(track: Track, looper: Looper) -> StreamingResponse:
     plt.savefig(img_buffer, format="png", dpi=100, bbox_inches="tight",
                 pad_inches=0, transparent=False)
 
+    plt.close(figure)
+
     img_buffer.seek(0)
     return StreamingResponse(img_buffer, media_type="image/png")
 
 
 def plot_series(series: np.array):
+    import matplotlib
+    import matplotlib.pyplot as plt
     matplotlib.rcParams["agg.path.chunksize"] = 10_000
     matplotlib.style.use("fast")
     figure = plt.figure()
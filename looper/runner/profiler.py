@@ -0,0 +1,165 @@
+from collections import Counter
+import cProfile
+from pathlib import Path
+import sys
+import threading
+import time
+from types import FrameType
+from typing import TYPE_CHECKING, Dict, Optional
+
+from nuclear.sublog import log
+
+from looper.runner.config import Config
+from looper.runner.jobs import Job
+
+if TYPE_CHECKING:
+    from looper.runner.looper import Looper
+
+PROFILE_TARGETS = {'audio', 'web'}
+PROFILE_MODES = {'sampling', 'cprofile'}
+# collapsed stack of samples taken while a thread was not running Python code
+IDLE_STACK = '(idle)'
+
+
+class ThreadStackSampler:
+    """
+    Periodically sample Python stack of a thread from another thread, counting collapsed stacks.
+    Sampled thread is not instrumented at all, so it runs at full speed.
+    """
+
+    def __init__(self, thread_id: int, interval_s: float) -> None:
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.stacks: Counter = Counter()
+        self.samples: int = 0
+
+    def run(self, seconds: float, job: Optional[Job] = None):
+        start_time = time.perf_counter()
+        next_time = start_time
+        while True:
+            now = time.perf_counter()
+            if now - start_time >= seconds:
+                break
+            frame = sys._current_frames().get(self.thread_id)
+            self.stacks[_collapse_stack(frame) if frame is not None else IDLE_STACK] += 1
+            self.samples += 1
+            if job is not None:
+                job.report_progress((now - start_time) / seconds)
+            next_time += self.interval_s
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+
+    @property
+    def busy_fraction(self) -> float:
+        if not self.samples:
+            return 0
+        return 1 - self.stacks[IDLE_STACK] / self.samples
+
+    def save_collapsed(self, path: Path):
+        """Save stacks in collapsed format: frames separated by semicolons, followed by a number of samples"""
+        with path.open('w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+
+def _collapse_stack(frame: FrameType) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f'{Path(code.co_filename).name}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+class CallbackProfiler:
+    """Deterministic profile of whole audio callbacks, enabled by the callback itself in the audio thread"""
+
+    def __init__(self) -> None:
+        self.profile = cProfile.Profile()
+        self.callbacks: int = 0
+
+    def enable(self):
+        self.profile.enable()
+
+    def disable(self):
+        self.profile.disable()
+        self.callbacks += 1
+
+
+def profile_looper(
+    looper: 'Looper',
+    seconds: float,
+    target: str = 'audio',
+    mode: str = 'sampling',
+    web_thread_id: Optional[int] = None,
+    job: Optional[Job] = None,
+) -> Dict:
+    """
+    Collect a profile of the audio callback or the web server thread for a number of seconds
+    and save it to the profiles directory. Blocking, should be run in a background job.
+    :param target: audio - thread running audio callbacks, web - thread of the HTTP server
+    :param mode: sampling - stack samples saved as collapsed stacks,
+        cprofile - deterministic profile of audio callbacks saved as pstats
+    """
+    if target not in PROFILE_TARGETS:
+        raise ValueError(f'unknown profile target: {target}, expected one of {sorted(PROFILE_TARGETS)}')
+    if mode not in PROFILE_MODES:
+        raise ValueError(f'unknown profile mode: {mode}, expected one of {sorted(PROFILE_MODES)}')
+    if seconds <= 0:
+        raise ValueError('profile duration should be positive')
+    config: Config = looper.config
+    profiles_dir = Path(config.output_profiles_dir)
+    profiles_dir.mkdir(exist_ok=True, parents=True)
+    basename = f'{time.strftime("%Y-%m-%d_%H-%M-%S")}-{target}'
+
+    if mode == 'cprofile':
+        if target != 'audio':
+            raise ValueError('cprofile mode is only supported for audio target')
+        return _profile_callbacks(looper, seconds, profiles_dir / f'{basename}.pstats', job)
+
+    if target == 'audio':
+        thread_id = looper.gc_control.audio_thread_id
+        if thread_id is None:
+            raise RuntimeError('audio callback has not been called yet')
+    else:
+        thread_id = web_thread_id
+        if thread_id is None:
+            raise RuntimeError('web server thread is unknown')
+
+    sampler = ThreadStackSampler(thread_id, config.profile_sampling_interval_ms / 1000)
+    sampler.run(seconds, job)
+    path = profiles_dir / f'{basename}.folded'
+    sampler.save_collapsed(path)
+    log.info('thread profile saved', file=path, target=target, samples=sampler.samples,
+        busy=f'{sampler.busy_fraction * 100:.1f}%')
+    return {
+        'file': str(path),
+        'format': 'collapsed',
+        'samples': sampler.samples,
+        'busy_fraction': sampler.busy_fraction,
+    }
+
+
+def _profile_callbacks(looper: 'Looper', seconds: float, path: Path, job: Optional[Job]) -> Dict:
+    if looper.profiler is not None:
+        raise RuntimeError('audio callbacks are being profiled already')
+    profiler = CallbackProfiler()
+    looper.profiler = profiler
+    start_time = time.perf_counter()
+    try:
+        while time.perf_counter() - start_time < seconds:
+            time.sleep(min(0.1, seconds))
+            if job is not None:
+                job.report_progress((time.perf_counter() - start_time) / seconds)
+    finally:
+        looper.profiler = None
+    # let the callback in progress finish its profile
+    time.sleep(looper.config.chunk_length_s)
+    if not profiler.callbacks:
+        raise RuntimeError('no audio callbacks were called while profiling')
+    profiler.profile.dump_stats(str(path))
+    log.info('audio callback profile saved', file=path, callbacks=profiler.callbacks)
+    return {
+        'file': str(path),
+        'format': 'pstats',
+        'callbacks': profiler.callbacks,
+    }
@@ -2,18 +2,21 @@ from dataclasses import dataclass
 import datetime
 from enum import Enum
 import os
-from typing import Callable, List, Optional
+from typing import TYPE_CHECKING, Callable, List, Optional
 from pathlib import Path
 from threading import Lock
 
 import wave
 import numpy as np
-from pydub import AudioSegment
 from nuclear.sublog import log
 
 from looper.runner.config import Config
+from looper.runner.jobs import Job
 from looper.runner.sample import sample_format_bytes
 
+if TYPE_CHECKING:
+    from pydub import AudioSegment
+
 
 @dataclass
 class Recording:
@@ -60,6 +63,7 @@ class OutputRecorder:
         log.info('Started saving output to a file')
 
     def stop_saving(self):
+        """Close the WAV file, leaving it for the conversion to MP3"""
         if self.phase != RecorderPhase.RECORDING:
             raise RuntimeError('Recorder is not RECORDING')
         self.phase = RecorderPhase.BUSY
@@ -67,42 +71,46 @@ class OutputRecorder:
         with self._lock:
             self.wav.close()
             self.wav = None
-            duration = self.chunks_written * self.config.chunk_length_s
+        duration = self.chunks_written * self.config.chunk_length_s
+        wav_filesize_mb = os.path.getsize(self.wav_path) / 1024 / 1024
+        log.debug('WAV file saved', 
+            filename=self.wav_path, 
+            chunks_saved=self.chunks_written,
+            duration=f'{duration:.2f}s',
+            size=f'{wav_filesize_mb:.2f}MB')
+
+    def convert_to_mp3(self, job: Optional[Job] = None):
+        """Convert closed WAV file to MP3. Blocking, should be run in a background job"""
+        from pydub import AudioSegment
+        try:
             wav_filesize_mb = os.path.getsize(self.wav_path) / 1024 / 1024
-            log.debug('WAV file saved', 
-                filename=self.wav_path, 
-                chunks_saved=self.chunks_written,
-                duration=f'{duration:.2f}s',
-                size=f'{wav_filesize_mb:.2f}MB')
-
             mp3_path = Path(self.config.output_recordings_dir) / f'{self.filestem}.mp3'
 
             audio = AudioSegment.from_wav(str(self.wav_path))
+            if job is not None:
+                job.report_progress(0.2)
             audio = normalize_recording(audio, self.config)
+            if job is not None:
+                job.report_progress(0.4)
             audio.export(str(mp3_path), format='mp3')
 
             if self.config.leave_wav_recordings:
                 log.warn('leaving raw WAV file', file=self.wav_path, size=f'{wav_filesize_mb:.2f}MB')
             else:
                 self.wav_path.unlink()
+        finally:
+            self.phase = RecorderPhase.IDLE
 
-        self.phase = RecorderPhase.IDLE
         mp3_filesize_mb = os.path.getsize(mp3_path) / 1024 / 1024
         log.info('output converted to MP3', 
             filename=mp3_path, duration=f'{audio.duration_seconds:.2f}s', 
             wav_size=f'{wav_filesize_mb:.2f}MB', mp3_size=f'{mp3_filesize_mb:.2f}MB')
 
-    def toggle_saving(self):
-        if self.phase == RecorderPhase.RECORDING:
-            self.stop_saving()
-        else:
-            self.start_saving()
-
     def transmit(self, chunk: np.array):
         if self.phase == RecorderPhase.RECORDING:
             with self._lock:
                 if self.wav is not None:
-                    self.wav.writeframes(b''.join(chunk))
+                    self.wav.writeframes(chunk.tobytes())  # frames x channels is interleaved already
                     self.chunks_written += 1
 
     @property
@@ -121,18 +129,23 @@ class OutputRecorder:
         return sorted(recordings, key=lambda r: r.name)
 
 
-def normalize_recording(audio: AudioSegment, config: Config) -> AudioSegment:
+def normalize_recording(audio: 'AudioSegment', config: Config) -> 'AudioSegment':
     if config.recorder_max_gain <= 0:
         return audio
     volume = audio.max_dBFS
-    gain = -volume
-    if gain > config.recorder_max_gain:
-        gain = config.recorder_max_gain
+    gain = normalization_gain(volume, config)
     audio = audio.apply_gain(gain)
     log.info('Volume normalized', volume=f'{volume:.2f}dB', gain=f'{gain:.2f}dB')
     return audio
 
 
+def normalization_gain(volume: float, config: Config) -> float:
+    """Return gain [dB] bringing peak volume [dBFS] to full scale, limited by max gain"""
+    if config.recorder_max_gain <= 0:
+        return 0
+    return min(-volume, config.recorder_max_gain)
+
+
 def save_wav(filename: str, frames_channel: Callable[[], Optional[np.array]], config: Config):
     log.debug('Saving frames to WAV file', filename=filename)
 
@@ -149,7 +162,7 @@ def save_wav(filename: str, frames_channel: Callable[[], Optional[np.array]], co
         frame = frames_channel()
         if frame is None:
             break
-        wav.writeframes(b''.join(frame))
+        wav.writeframes(frame.tobytes())
         frames_written += 1
 
     wav.close()
@@ -160,6 +173,7 @@ def save_wav(filename: str, frames_channel: Callable[[], Optional[np.array]], co
 
 
 def save_mp3(filename: str, frames_channel: Callable, config: Config):
+    from pydub import AudioSegment
     tmp_wav_file = Path(filename).with_suffix('.wav')
     save_wav(str(tmp_wav_file), frames_channel, config)
 
@@ -0,0 +1,143 @@
+import os
+from pathlib import Path
+import subprocess
+import time
+from typing import Iterable, List, Optional
+import wave
+
+import numpy as np
+from nuclear.sublog import log
+
+from looper.runner.config import Config
+from looper.runner.jobs import Job
+from looper.runner.recorder import normalization_gain
+from looper.runner.sample import sample_format_max_amplitude
+from looper.runner.sessions import Session, load_session
+from looper.runner.track import Track, common_loop_length
+
+# duration of audio mixed at once, bounding memory usage [s]
+RENDER_BLOCK_S = 10
+# rendered loop is reused for the next repetitions if it's not bigger than that [bytes]
+RENDER_CACHE_BYTES = 64 * 1024 * 1024
+INT16_MAX = 32767
+
+
+def render_session(
+    config: Config,
+    session_file: str,
+    loops: int = 1,
+    out_file: Optional[str] = None,
+    job: Optional[Job] = None,
+) -> Path:
+    """
+    Mix playing tracks of a saved session for a number of loop repetitions and save it to WAV or MP3 file.
+    Mixing is done on whole blocks of chunks, way faster than real time.
+    """
+    if loops < 1:
+        raise ValueError('number of loops should be positive')
+    session_path = Path(session_file)
+    if not session_path.is_file():
+        session_path = Path(config.output_sessions_dir) / session_file
+    if not session_path.is_file():
+        raise FileNotFoundError(f"session file {session_file} doesn't exist")
+    if out_file is None:
+        out_path = Path(config.output_recordings_dir) / f'{session_path.stem}-render.mp3'
+    else:
+        out_path = Path(out_file)
+    if out_path.suffix not in {'.wav', '.mp3'}:
+        raise ValueError(f'unsupported output format: {out_path.name}, expected .wav or .mp3 file')
+
+    start_time = time.perf_counter()
+    session = load_session(session_path)
+    tracks = [track for track in session.tracks if (track.playing or track.pending_play) and not track.empty]
+    if not tracks:
+        raise RuntimeError('session has no playing tracks to render')
+    session_config = session.tracks[0].config
+    renderer = SessionRenderer(session, tracks, session_config)
+
+    peak = renderer.find_peak()
+    volume = 20 * np.log10(peak) if peak > 0 else -100
+    gain_db = normalization_gain(volume, config)
+    log.info('rendering session', session=session_path.name, tracks=[track.index for track in tracks],
+        loops=loops, loop_duration=f'{renderer.loop_duration_s:.2f}s', volume=f'{volume:.2f}dB', gain=f'{gain_db:.2f}dB')
+
+    out_path.parent.mkdir(exist_ok=True, parents=True)
+    wav_path = out_path if out_path.suffix == '.wav' else out_path.with_suffix('.wav')
+    with wave.open(str(wav_path), 'w') as wav:
+        wav.setnchannels(session_config.channels)
+        wav.setsampwidth(2)
+        wav.setframerate(session_config.sampling_rate)
+        for fraction in renderer.write_loops(wav, loops, 10 ** (gain_db / 20)):
+            if job is not None:
+                job.report_progress(fraction * 0.9)
+
+    if out_path.suffix == '.mp3':
+        _convert_to_mp3(wav_path, out_path)
+        wav_path.unlink()
+
+    elapsed = time.perf_counter() - start_time
+    duration = renderer.loop_duration_s * loops
+    filesize_mb = os.path.getsize(out_path) / 1024 / 1024
+    log.info('session rendered', file=out_path, duration=f'{duration:.2f}s', elapsed=f'{elapsed:.2f}s',
+        speed=f'{duration / elapsed:.1f}x real time', size=f'{filesize_mb:.2f}MB')
+    return out_path
+
+
+class SessionRenderer:
+    def __init__(self, session: Session, tracks: List[Track], config: Config) -> None:
+        self.config = config
+        self.tracks = tracks
+        self.output_gain = 10 ** (session.output_volume / 20)
+        self.max_amp = sample_format_max_amplitude(config.sample_format)
+        # tracks longer than the master loop play shorter ones repeatedly, until they all meet at the start
+        self.loop_chunks_num = common_loop_length(len(track.loop_chunks) for track in tracks)
+        self.block_chunks = max(1, int(RENDER_BLOCK_S / config.chunk_length_s))
+
+    @property
+    def loop_duration_s(self) -> float:
+        return self.loop_chunks_num * self.config.chunk_length_s
+
+    def mix_blocks(self) -> Iterable[np.array]:
+        """Yield blocks of one loop mixed down, in full-scale float range [-1, 1]"""
+        for start in range(0, self.loop_chunks_num, self.block_chunks):
+            end = min(start + self.block_chunks, self.loop_chunks_num)
+            mixed = None
+            for track in self.tracks:
+                gain = track.scale * 10 ** (track.volume / 20) * self.output_gain / self.max_amp
+                if self.config.channels > 1 and track.pan != 0:
+                    gain = track.dsp.pan_gains(track.pan) * gain
+                chunks_num = len(track.loop_chunks)
+                block = np.concatenate([track.loop_chunks[index % chunks_num] for index in range(start, end)])
+                if mixed is None:
+                    mixed = np.multiply(block, gain, dtype=np.float32)
+                else:
+                    mixed += np.multiply(block, gain, dtype=np.float32)
+            yield mixed
+
+    def find_peak(self) -> float:
+        return max(float(np.max(np.abs(block))) for block in self.mix_blocks())
+
+    def write_loops(self, wav: wave.Wave_write, loops: int, gain: float) -> Iterable[float]:
+        """Write loop repetitions as 16-bit PCM, yielding progress"""
+        loop_bytes = self.loop_chunks_num * self.config.chunk_size * self.config.channels * 2
+        cached: Optional[List[bytes]] = [] if loop_bytes <= RENDER_CACHE_BYTES else None
+        for loop in range(loops):
+            if loop > 0 and cached is not None:
+                for frames in cached:
+                    wav.writeframes(frames)
+            else:
+                for block in self.mix_blocks():
+                    block *= gain * INT16_MAX
+                    np.clip(block, -INT16_MAX - 1, INT16_MAX, out=block)
+                    frames = block.astype(np.int16).tobytes()
+                    wav.writeframes(frames)
+                    if cached is not None:
+                        cached.append(frames)
+            yield (loop + 1) / loops
+
+
+def _convert_to_mp3(wav_path: Path, mp3_path: Path):
+    """Encode WAV file to MP3 by streaming it through ffmpeg, without loading it to memory"""
+    from pydub.utils import get_encoder_name
+    cmd = [get_encoder_name(), '-y', '-loglevel', 'error', '-i', str(wav_path), str(mp3_path)]
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL)
@@ -2,24 +2,34 @@ import asyncio
 import os
 import time
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 import warnings
 from threading import Thread
 
+import psutil
 from nuclear.sublog import log
-from nuclear.utils.shell import shell, shell_output
+from nuclear.utils.shell import shell
 from gpiozero import BadPinFactory, PinFactoryFallback
-from getkey import getkey, keys
 
-from looper.runner.server import Server, start_api_in_background
 from looper.runner.config import AudioBackendType
 from looper.runner.config_load import load_config
 from looper.runner.pinout import Pinout
 from looper.runner.looper import Looper
+from looper.runner.trace import TraceWriter
 
+if TYPE_CHECKING:
+    from looper.runner.server import Server
 
-def run_looper(config_path: Optional[str], audio_backend_type: Optional[str]):
+
+def run_looper(
+    config_path: Optional[str],
+    audio_backend_type: Optional[str],
+    recover: bool = False,
+    capture: Optional[str] = None,
+):
     log.info('Starting looper...')
+    if recover and capture:
+        raise ValueError('recovered loop state can not be replayed, capture a trace without recovering')
     config = load_config(config_path)
     if audio_backend_type:
         config.audio_backend = AudioBackendType(audio_backend_type)
@@ -53,18 +63,22 @@ def run_looper(config_path: Optional[str], audio_backend_type: Optional[str]):
     
     _change_workdir(config.workdir)
 
-    if config.prioritize_process:
-        prioritize_process()
-
     looper = Looper(pinout, config)
+    if capture:
+        looper.trace = TraceWriter(capture, config)
     looper.run()
+    if recover:
+        looper.journal.recover()
 
     if config.online:
         pinout.shutdown_button.when_held = lambda: shutdown(looper)
 
-    server: Server = start_api_in_background(looper)
+    # web server (and its heavy dependencies) comes up once the audio is already streaming
+    from looper.runner.server import start_api_in_background
+    server: 'Server' = start_api_in_background(looper)
+    looper.gc_control.freeze()
 
-    log.info('Ready to work')
+    log.info('Ready to work', time_to_first_audio_callback=_time_to_first_audio_callback(looper))
     try:
         if looper.config.async_loops:
             asyncio.run(main_async_loop(looper, server))
@@ -76,6 +90,13 @@ def run_looper(config_path: Optional[str], audio_backend_type: Optional[str]):
     log.debug('Off I go then')
 
 
+def _time_to_first_audio_callback(looper: Looper) -> str:
+    if looper.first_callback_time is None:
+        return 'not called yet'
+    startup_time = looper.first_callback_time - psutil.Process().create_time()
+    return f'{startup_time:.3f}s'
+
+
 def _change_workdir(workdir: str):
     if Path(workdir).is_dir():
         os.chdir(workdir)
@@ -83,52 +104,28 @@ def _change_workdir(workdir: str):
         log.warn(f"can't change working directory to {workdir}, running in {os.getcwd()}")
 
 
-async def main_async_loop(looper: Looper, server: Server):
+async def main_async_loop(looper: Looper, server: 'Server'):
+    # LEDs and progress are updated by the engine events, see LedController
     await asyncio.wait([
-            progress_loop(looper),
-            update_leds_loop(looper),
             handle_key_press(looper),
         ], return_when=asyncio.FIRST_EXCEPTION)
 
 
-async def progress_loop(looper: Looper):
-    if looper.config.online:
-        while True:
-            await looper.update_progress()
-
-
-async def update_leds_loop(looper: Looper):
-    while True:
-        if looper.config.online:
-            looper.update_leds()
-        await asyncio.sleep(1)
-
-
 async def handle_key_press(looper: Looper):
     if looper.config.spacebar_footswitch:
 
+        from getkey import getkey, keys
+
         def read_keys_endless(looper):
             while True:
                 key = getkey()
                 if key == keys.SPACE:
                     log.debug('Space key pressed, simulating footswitch')
-                    looper.on_footswitch_press()
+                    looper.control('spacebar', looper.on_footswitch_press)
 
         Thread(target=read_keys_endless, args=(looper,), daemon=True).start()
 
 
-def prioritize_process():
-    pids = shell_output('pgrep -f "looper run"').strip().splitlines()[:-1]
-    if not pids:
-        log.warn('looper process was not found')
-        return
-    if len(pids) > 1:
-        log.warn('multiple looper process found', pids=pids)
-    priority = -20
-    shell(f'sudo renice -n {priority} -p {" ".join(pids)}')
-    log.info('process reniced with favorable priority', pid=pids[0], priority=priority)
-
-
 def shutdown(looper: Looper):
     log.info('shutting down...')
     looper.close()
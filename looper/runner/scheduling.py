@@ -0,0 +1,178 @@
+from dataclasses import dataclass, field
+import ctypes
+import ctypes.util
+import os
+import resource
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from nuclear.sublog import log
+from nuclear import shell
+
+from looper.runner.config import Config
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+REALTIME_POLICIES: Dict[str, str] = {
+    'fifo': 'SCHED_FIFO',
+    'rr': 'SCHED_RR',
+}
+
+
+@dataclass
+class ThreadScheduling:
+    thread_name: str = ''
+    native_id: Optional[int] = None
+    policy: str = 'SCHED_OTHER'
+    priority: int = 0
+    cpu_affinity: List[int] = field(default_factory=list)
+
+
+@dataclass
+class RealtimeScheduler:
+    """Give the audio thread real-time priority and a dedicated CPU core, keeping other threads away from it"""
+    config: Config
+
+    process_nice: Optional[int] = None
+    memory_locked: bool = False
+    audio_cpu_core: Optional[int] = None
+    other_cpu_cores: List[int] = field(default_factory=list)
+    audio_thread: ThreadScheduling = field(default_factory=ThreadScheduling)
+    warnings: List[str] = field(default_factory=list)
+
+    def setup_process(self):
+        """
+        Prioritize the whole process and move the calling thread away from the audio core.
+        Should be called from the main thread before any other thread is started,
+        so that web server, GPIO and job threads inherit the affinity.
+        """
+        self._renice_process()
+        if self.config.lock_memory:
+            self._lock_memory()
+        self._choose_cpu_cores()
+        if self.other_cpu_cores:
+            self._set_thread_affinity(self.other_cpu_cores)
+
+    def setup_audio_thread(self):
+        """Apply real-time policy and dedicated core to the calling (audio callback) thread"""
+        thread = threading.current_thread()
+        self.audio_thread.thread_name = thread.name
+        self.audio_thread.native_id = threading.get_native_id()
+
+        if self.audio_cpu_core is not None:
+            self._set_thread_affinity([self.audio_cpu_core])
+        policy_name = self.config.realtime_policy
+        if policy_name in REALTIME_POLICIES:
+            self._set_thread_policy(REALTIME_POLICIES[policy_name], self.config.realtime_priority)
+        elif policy_name != 'none':
+            self._warn(f'unknown real-time policy: {policy_name}')
+
+        self.audio_thread.policy, self.audio_thread.priority = _current_thread_policy()
+        self.audio_thread.cpu_affinity = sorted(_get_affinity())
+        log.info('audio thread scheduling set',
+            policy=self.audio_thread.policy,
+            priority=self.audio_thread.priority,
+            cpu_affinity=self.audio_thread.cpu_affinity,
+            native_id=self.audio_thread.native_id,
+        )
+
+    def report(self) -> Dict:
+        return {
+            'process_nice': self.process_nice,
+            'memory_locked': self.memory_locked,
+            'audio_cpu_core': self.audio_cpu_core,
+            'other_cpu_cores': self.other_cpu_cores,
+            'audio_thread': {
+                'name': self.audio_thread.thread_name,
+                'native_id': self.audio_thread.native_id,
+                'policy': self.audio_thread.policy,
+                'priority': self.audio_thread.priority,
+                'cpu_affinity': self.audio_thread.cpu_affinity,
+            },
+            'warnings': self.warnings,
+        }
+
+    def _renice_process(self):
+        priority = self.config.process_nice
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, priority)
+        except PermissionError:
+            try:
+                shell(f'sudo -n renice -n {priority} -p {os.getpid()}')
+            except Exception:
+                self._warn('no permission to renice the process')
+        self.process_nice = os.getpriority(os.PRIO_PROCESS, 0)
+        log.info('process reniced', pid=os.getpid(), nice=self.process_nice)
+
+    def _lock_memory(self):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            self._warn('libc not found, memory can not be locked')
+            return
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        # locking future allocations with a limited quota would make them fail later on,
+        # spilled tracks and journal are memory-mapped files, which wouldn't be able to free any RAM once locked
+        soft_limit, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+        memory_mapped = self.config.tracks_memory_budget_mb > 0 or self.config.journal
+        lock_future = soft_limit == resource.RLIM_INFINITY and not memory_mapped
+        flags = MCL_CURRENT | MCL_FUTURE if lock_future else MCL_CURRENT
+        if libc.mlockall(flags) != 0:
+            errno = ctypes.get_errno()
+            self._warn(f'mlockall failed: {os.strerror(errno)}')
+            return
+        self.memory_locked = True
+        log.info('process memory locked', future_allocations=bool(flags & MCL_FUTURE))
+
+    def _choose_cpu_cores(self):
+        available = sorted(_get_affinity())
+        if len(available) < 2:
+            log.debug('not enough CPU cores to dedicate one to audio', cores=available)
+            return
+        audio_core = self.config.audio_cpu_core
+        if audio_core < 0:
+            audio_core = available[-1]
+        if audio_core not in available:
+            self._warn(f'CPU core {audio_core} is not available for audio thread')
+            return
+        self.audio_cpu_core = audio_core
+        self.other_cpu_cores = [core for core in available if core != audio_core]
+
+    def _set_thread_affinity(self, cores: List[int]):
+        try:
+            os.sched_setaffinity(0, cores)  # 0 is the calling thread on Linux
+        except (OSError, AttributeError) as e:
+            self._warn(f'setting CPU affinity failed: {e}')
+
+    def _set_thread_policy(self, policy_name: str, priority: int):
+        try:
+            policy = getattr(os, policy_name)
+            os.sched_setscheduler(0, policy, os.sched_param(priority))
+        except (OSError, AttributeError) as e:
+            self._warn(f'setting {policy_name} policy failed: {e}')
+
+    def _warn(self, message: str):
+        self.warnings.append(message)
+        log.warn(message)
+
+
+def _get_affinity() -> List[int]:
+    try:
+        return list(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def _current_thread_policy() -> Tuple[str, int]:
+    try:
+        policy = os.sched_getscheduler(0)
+        priority = os.sched_getparam(0).sched_priority
+    except (OSError, AttributeError):
+        return 'unknown', 0
+    names = {
+        getattr(os, name): name
+        for name in ['SCHED_OTHER', 'SCHED_FIFO', 'SCHED_RR', 'SCHED_BATCH', 'SCHED_IDLE']
+        if hasattr(os, name)
+    }
+    return names.get(policy, str(policy)), priority
@@ -2,14 +2,27 @@ from dataclasses import dataclass
 import datetime
 from enum import Enum
 import os
-from typing import List
+from typing import List, Optional, Tuple
 from pathlib import Path
 import pickle
+import time
 
 from nuclear.sublog import log
+import numpy as np
 
+from looper.runner.actions import Quantize
+from looper.runner.config import Config
+from looper.runner.events import EngineEventType
+from looper.runner.importer import fit_to_length, resample, split_to_chunks
+from looper.runner.jobs import Job
 from looper.runner.looper import LoopPhase, Looper
-from looper.runner.track import Track
+from looper.runner.metronome import adapt_channels
+from looper.runner.sample import sample_format_max_amplitude
+from looper.runner.trace import refuse_while_capturing
+from looper.runner.track import Track, protect_repeated_chunks, repeat_chunks
+
+# subdirectory of sessions directory keeping sessions converted to other audio formats
+SESSION_CACHE_DIR = '.converted'
 
 
 @dataclass
@@ -24,6 +37,28 @@ class Session:
     input_volume: float
     output_volume: float
     tracks: List[Track]
+    # audio format the tracks were recorded in, missing in older sessions
+    sampling_rate: Optional[int] = None
+    chunk_size: Optional[int] = None
+    channels: Optional[int] = None
+    sample_format: Optional[str] = None
+    track_storage: Optional[str] = None
+    # master loop length, tracks may be its multiples or fractions, missing in older sessions
+    loop_chunks: Optional[int] = None
+
+    @property
+    def loop_chunks_num(self) -> int:
+        return self.loop_chunks or len(self.tracks[0].loop_chunks)
+
+    def audio_format(self) -> Tuple:
+        saved_config = self.tracks[0].config
+        return (
+            self.sampling_rate or saved_config.sampling_rate,
+            self.chunk_size or saved_config.chunk_size,
+            self.channels or saved_config.channels,
+            self.sample_format or saved_config.sample_format,
+            self.track_storage or getattr(saved_config, 'track_storage', 'native'),
+        )
 
 
 class SessionManagerPhase(Enum):
@@ -36,7 +71,7 @@ class SessionManager:
     looper: Looper
     phase: SessionManagerPhase = SessionManagerPhase.IDLE
 
-    def save_session(self, name: str):
+    def save_session(self, name: str, job: Optional[Job] = None):
         if self.phase == SessionManagerPhase.BUSY:
             raise RuntimeError('Recorder is BUSY')
         self.phase = SessionManagerPhase.BUSY
@@ -54,8 +89,16 @@ class SessionManager:
             input_volume=self.looper.input_volume,
             output_volume=self.looper.output_volume,
             tracks=self.looper.tracks,
+            sampling_rate=config.sampling_rate,
+            chunk_size=config.chunk_size,
+            channels=config.channels,
+            sample_format=config.sample_format,
+            track_storage=config.track_storage,
+            loop_chunks=self.looper.loop_chunks_num,
         )
 
+        if job is not None:
+            job.report_progress(0.1)
         with open(session_path, 'wb') as handle:
             pickle.dump(session, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
@@ -64,48 +107,209 @@ class SessionManager:
         log.info('Session saved', file=session_path, size=f'{filesize_mb:.2f}MB')
 
 
-    def restore_session(self, filename: str):
+    def restore_session(self, filename: str, job: Optional[Job] = None):
+        session, session_path = self._load(filename, job)
+        looper = self.looper
+        looper.reset()
+        master_chunks = self._prepare_session(session, playing=False)
+        with looper._lock:
+            self._apply_session(session, master_chunks)
+
+        self.phase = SessionManagerPhase.IDLE
+        filesize_mb = os.path.getsize(str(session_path)) / 1024 / 1024
+        log.info('Session restored', file=session_path, size=f'{filesize_mb:.2f}MB')
+
+    def switch_session(self, filename: str, quantize: str = 'loop', job: Optional[Job] = None):
+        """
+        Load session in the background and switch to it at the next beat, bar or loop start,
+        keeping its tracks playing. Restored right away if the loop is not playing yet.
+        """
+        quantize_to = Quantize(quantize)
+        session, session_path = self._load(filename, job)
+        self.phase = SessionManagerPhase.IDLE
+        master_chunks = self._prepare_session(session, playing=True)
+        if self.looper.phase != LoopPhase.LOOP:
+            self.looper.reset()
+            with self.looper._lock:
+                self._apply_session(session, master_chunks)
+            log.info('Session restored', file=session_path)
+            return
+        self.looper.schedule('session', quantize_to, apply=lambda: self._apply_session(session, master_chunks))
+        log.info('Session switch scheduled, other scheduled actions will be dropped', file=session_path,
+            quantize=quantize)
+
+    def _load(self, filename: str, job: Optional[Job]) -> Tuple[Session, Path]:
+        refuse_while_capturing(self.looper, 'loading session')
         if self.phase == SessionManagerPhase.BUSY:
             raise RuntimeError('Recorder is BUSY')
         self.phase = SessionManagerPhase.BUSY
 
         config = self.looper.config
-        looper = self.looper
         session_path = Path(config.output_sessions_dir) / filename
-        assert session_path.is_file(), 'session file doesnt exist'
-
-        log.debug('restoring session', file=session_path)
-
-        with open(session_path, 'rb') as handle:
-            session: Session = pickle.load(handle)
-
-        looper.reset()
-
-        with looper._lock:
-            looper.input_volume = session.input_volume
-            looper.output_volume = session.output_volume
-            looper.tracks = session.tracks
-            for track in looper.tracks:
-                track.recording = False
-                track.playing = False
-
-            looper.tracks_num = len(looper.tracks)
-            looper.master_chunks = session.tracks[0].loop_chunks
+        try:
+            assert session_path.is_file(), 'session file doesnt exist'
+            log.debug('restoring session', file=session_path)
+            session = load_converted_session(session_path, config, job)
+        except BaseException:
+            self.phase = SessionManagerPhase.IDLE
+            raise
+        if job is not None:
+            job.report_progress(0.8)
+        return session, session_path
 
-            looper.current_position = 0
-            looper.phase = LoopPhase.LOOP
+    @staticmethod
+    def _prepare_session(session: Session, playing: bool) -> List[np.array]:
+        """Reset transient state of the session tracks and return its master loop chunks"""
+        touched = time.time()
+        for track in session.tracks:
+            track.recording = False
+            track.playing = playing and track.playing and not track.empty
+            track.pending_play = False
+            track.pending_record = False
+            track.spill_path = None
+            track.modified_chunks = None
+            track.last_touched = touched
+        return repeat_chunks(session.tracks[0].loop_chunks, session.loop_chunks_num)
 
-        self.phase = SessionManagerPhase.IDLE
-        filesize_mb = os.path.getsize(str(session_path)) / 1024 / 1024
-        log.info('Session restored', file=session_path, size=f'{filesize_mb:.2f}MB')
+    def _apply_session(self, session: Session, master_chunks: List[np.array]):
+        """
+        Replace engine state with the prepared session, looper lock has to be held.
+        Executed by the audio callback when scheduled, so it only swaps references.
+        """
+        looper = self.looper
+        looper.input_volume = session.input_volume
+        looper.output_volume = session.output_volume
+        looper.tracks = session.tracks
+        looper.tracks_num = len(session.tracks)
+        looper.master_chunks = master_chunks
+        looper.main_track = 0
+        looper.metronome_beats = 0
+        looper.metronome_bars = 0
+        # actions were scheduled at positions of the replaced loop
+        actions_dropped = looper.actions is not None and bool(looper.actions.pending)
+        if actions_dropped:
+            looper.actions.clear()
 
+        looper.current_position = 0
+        looper.loop_cycle = 0
+        looper.phase = LoopPhase.LOOP
+        looper.publish(EngineEventType.PHASE)
+        if actions_dropped:
+            looper.publish(EngineEventType.ACTIONS)
 
     def list_sessions(self) -> List[SessionMetadata]:
         sessions = []
         dirpath = Path(self.looper.config.output_sessions_dir)
         dirpath.mkdir(exist_ok=True, parents=True)
         for path in dirpath.glob('*'):
+            if not path.is_file():
+                continue
             filesize_mb = os.path.getsize(path) / 1024 / 1024
             filename = path.name
             sessions.append(SessionMetadata(filename, filesize_mb))
         return sorted(sessions, key=lambda r: r.filename)
+
+
+def load_session(session_path: Path) -> Session:
+    with open(session_path, 'rb') as handle:
+        session: Session = pickle.load(handle)
+    session.tracks = [_migrate_track(track) if 'codec' not in track.__dict__ else track for track in session.tracks]
+    # references of repeated chunks are kept by pickle, but not their flags
+    for track in session.tracks:
+        protect_repeated_chunks(track.loop_chunks)
+    return session
+
+
+def _migrate_track(saved_track: Track) -> Track:
+    """Rebuild track pickled before track storage, routing and panning were added, re-encoding its chunks"""
+    saved_config = saved_track.config
+    config = Config(**{key: value for key, value in saved_config.__dict__.items() if key in Config.__fields__})
+    track = Track(saved_track.index, config, has_gpio=saved_track.has_gpio)
+    track.name = saved_track.name
+    track.volume = saved_track.volume
+    if saved_track.empty or not saved_track.loop_chunks:
+        track.set_empty(len(saved_track.loop_chunks))
+    else:
+        track.set_track(list(saved_track.loop_chunks), fade=False)
+        track.playing = saved_track.playing
+    log.debug('track of an older session migrated', track_id=track.index)
+    return track
+
+
+def audio_format(config: Config) -> Tuple:
+    return config.sampling_rate, config.chunk_size, config.channels, config.sample_format, config.track_storage
+
+
+def load_converted_session(session_path: Path, config: Config, job: Optional[Job] = None) -> Session:
+    """
+    Load session converted to the current audio format.
+    Converted version is cached next to the original, so that the next load doesn't repeat the conversion.
+    """
+    target_format = audio_format(config)
+    cache_name = f'{session_path.stem}.' + '-'.join(str(value) for value in target_format) + '.pickle'
+    cache_path = session_path.parent / SESSION_CACHE_DIR / cache_name
+    if cache_path.is_file() and cache_path.stat().st_mtime >= session_path.stat().st_mtime:
+        log.debug('loading converted session from cache', file=cache_path)
+        return load_session(cache_path)
+
+    session = load_session(session_path)
+    if session.audio_format() == target_format:
+        return session
+    if job is not None:
+        job.report_progress(0.2)
+
+    converted = convert_session(session, config)
+    cache_path.parent.mkdir(exist_ok=True, parents=True)
+    with open(cache_path, 'wb') as handle:
+        pickle.dump(converted, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    log.debug('converted session cached', file=cache_path)
+    return converted
+
+
+def convert_session(session: Session, config: Config) -> Session:
+    """Resample and rechunk tracks of a session recorded in a different audio format"""
+    sampling_rate, chunk_size, channels, sample_format, _ = session.audio_format()
+    src_max_amp = sample_format_max_amplitude(sample_format)
+    loop_samples = session.loop_chunks_num * chunk_size
+    target_chunks = max(1, round(loop_samples * config.sampling_rate / sampling_rate / config.chunk_size))
+
+    tracks = []
+    for saved_track in session.tracks:
+        track = Track(saved_track.index, config, has_gpio=saved_track.index < config.tracks_gpio_num)
+        track.name = saved_track.name
+        track.volume = saved_track.volume
+        track.playing = saved_track.playing
+        track.set_pan(saved_track.pan)
+        # tracks keep their length relative to the master loop
+        track_chunks = max(1, round(len(saved_track.loop_chunks) * target_chunks / session.loop_chunks_num))
+        if saved_track.empty:
+            track.set_empty(track_chunks)
+        else:
+            samples = np.concatenate(saved_track.decoded_chunks()).astype(np.float32) / src_max_amp
+            if samples.ndim == 1:
+                samples = samples[:, np.newaxis]
+            samples = resample(samples, sampling_rate, config.sampling_rate)
+            samples = fit_to_length(samples, track_chunks * config.chunk_size)
+            if config.channels == 1:
+                samples = np.mean(samples, axis=1, dtype=np.float32)
+            else:
+                samples = adapt_channels(samples, config.channels)
+            track.set_track(split_to_chunks(samples, config), fade=False)
+        tracks.append(track)
+
+    log.info('session converted',
+        from_format=f'{sampling_rate}Hz, {chunk_size} chunk, {channels} channels, {sample_format}',
+        to_format=f'{config.sampling_rate}Hz, {config.chunk_size} chunk, {config.channels} channels, {config.sample_format}',
+        tracks=len(tracks))
+    return Session(
+        name=session.name,
+        input_volume=session.input_volume,
+        output_volume=session.output_volume,
+        tracks=tracks,
+        sampling_rate=config.sampling_rate,
+        chunk_size=config.chunk_size,
+        channels=config.channels,
+        sample_format=config.sample_format,
+        track_storage=config.track_storage,
+        loop_chunks=target_chunks,
+    )
@@ -0,0 +1,147 @@
+from pathlib import Path
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+import uuid
+
+import numpy as np
+from nuclear.sublog import log, log_exception
+
+from looper.runner.track import Track
+
+if TYPE_CHECKING:
+    from looper.runner.looper import Looper
+
+# how often the memory budget is enforced [s]
+ENFORCE_INTERVAL_S = 1
+
+
+class SpillManager:
+    """
+    Keep track memory within a budget by moving least recently used, inactive tracks
+    to memory-mapped files on disk and loading them back before they start playing.
+    """
+
+    def __init__(self, looper: 'Looper') -> None:
+        self.looper = looper
+        self.config = looper.config
+        self.spill_dir = Path(self.config.spill_dir)
+        self.budget_bytes: int = int(self.config.tracks_memory_budget_mb * 1024 * 1024)
+        self._prefetch_queue: 'queue.Queue[Track]' = queue.Queue()
+        self._running = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.spill_dir.mkdir(exist_ok=True, parents=True)
+        self._remove_orphan_files()
+        self._running = True
+        threading.Thread(target=self._worker_loop, name='track-spill', daemon=True).start()
+        log.info('track spilling enabled', memory_budget=f'{self.config.tracks_memory_budget_mb}MB', spill_dir=self.spill_dir)
+
+    def close(self):
+        self._running = False
+
+    def prefetch(self, track: Track):
+        """Load spilled track back to RAM in the background"""
+        if self.enabled and track.spilled:
+            self._prefetch_queue.put(track)
+
+    def resident_bytes(self) -> int:
+        return sum(track.resident_bytes() for track in self.looper.tracks)
+
+    def report(self) -> Dict:
+        tracks = list(self.looper.tracks)
+        spilled = [track for track in tracks if track.spilled]
+        return {
+            'enabled': self.enabled,
+            'memory_budget_mb': self.config.tracks_memory_budget_mb,
+            'resident_mb': sum(track.resident_bytes() for track in tracks) / 1024 / 1024,
+            'spilled_tracks': [track.index for track in spilled],
+            'spilled_mb': sum(track.spill_path.stat().st_size for track in spilled if track.spill_path.exists()) / 1024 / 1024,
+        }
+
+    def _worker_loop(self):
+        while self._running:
+            try:
+                track = self._prefetch_queue.get(timeout=ENFORCE_INTERVAL_S)
+            except queue.Empty:
+                track = None
+            try:
+                if track is not None:
+                    self.load_track(track)
+                else:
+                    self._enforce_budget()
+                    self._remove_orphan_files()
+            except Exception as e:
+                log_exception(e)
+
+    def _enforce_budget(self):
+        resident = self.resident_bytes()
+        if resident <= self.budget_bytes:
+            return
+        for track in self._spill_candidates():
+            track_bytes = track.resident_bytes()
+            if self.spill_track(track):
+                resident -= track_bytes
+            if resident <= self.budget_bytes:
+                return
+        log.warn('tracks exceed memory budget, but no more tracks can be spilled',
+            resident=f'{resident / 1024 / 1024:.2f}MB')
+
+    def _spill_candidates(self) -> List[Track]:
+        """Return tracks muted for a while, least recently used first"""
+        # playing tracks would make the audio callback page in the spilled file
+        now = time.time()
+        candidates = [
+            track for track in self.looper.tracks
+            if not track.spilled and not track.recording and not track.pending_play and not track.pending_record
+            and not track.playing and track.loop_chunks
+            and now - track.last_touched > self.config.spill_idle_s
+        ]
+        return sorted(candidates, key=lambda track: track.last_touched)
+
+    def spill_track(self, track: Track) -> bool:
+        with self.looper._lock:
+            chunks = list(track.loop_chunks)
+            # overdubs modify chunks in place, touching the track
+            touched = track.last_touched
+        path = self.spill_dir / f'track-{uuid.uuid4().hex}.bin'
+        mapped = np.memmap(str(path), dtype=chunks[0].dtype, mode='w+', shape=(len(chunks),) + chunks[0].shape)
+        for index, chunk in enumerate(chunks):
+            mapped[index] = chunk
+        mapped.flush()
+
+        with self.looper._lock:
+            unchanged = track.last_touched == touched and len(track.loop_chunks) == len(chunks) \
+                and all(a is b for a, b in zip(track.loop_chunks, chunks))
+            if unchanged and not track.recording and not track.playing:
+                track.loop_chunks = [mapped[index] for index in range(len(chunks))]
+                track.spill_path = path
+        if track.spill_path != path:
+            path.unlink()
+            return False
+        log.debug('track spilled to disk', track_id=track.index, file=path)
+        return True
+
+    def load_track(self, track: Track):
+        path: Optional[Path] = track.spill_path
+        if path is None:
+            return
+        resident = np.array(track.loop_chunks)
+        with self.looper._lock:
+            if track.spill_path == path:
+                track.loop_chunks = [resident[index] for index in range(len(resident))]
+                track.spill_path = None
+        log.debug('spilled track loaded back to memory', track_id=track.index)
+
+    def _remove_orphan_files(self):
+        referenced = {track.spill_path for track in self.looper.tracks}
+        for path in self.spill_dir.glob('track-*.bin'):
+            if path not in referenced:
+                path.unlink()
@@ -0,0 +1,116 @@
+from typing import Union
+
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.sample import sample_format_bytes, sample_format_max_amplitude, sample_format_numpy_type
+
+# headroom above full scale kept in compact storage for louder overdubs (x2 = ~6 dB)
+STORAGE_HEADROOM = 2
+INT16_MAX = 32767
+# number of chunks of precomputed dither noise
+DITHER_CHUNKS = 64
+# fixed seed keeps stored tracks reproducible, so that replayed traces are bit-exact
+DITHER_SEED = 0
+
+
+def storage_numpy_type(config: Config):
+    if config.track_storage == 'native':
+        return sample_format_numpy_type(config.sample_format)
+    elif config.track_storage == 'int16':
+        return np.int16
+    elif config.track_storage == 'float16':
+        return np.float16
+    raise ValueError(f"Unknown track storage: {config.track_storage}")
+
+
+def storage_bytes(config: Config) -> int:
+    if config.track_storage == 'native':
+        return sample_format_bytes(config.sample_format)
+    elif config.track_storage in {'int16', 'float16'}:
+        return 2
+    raise ValueError(f"Unknown track storage: {config.track_storage}")
+
+
+class SampleCodec:
+    """
+    Convert audio chunks between sample format used for mixing and a track storage format.
+    Stored value multiplied by a track's scale gives the sample value.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.native: bool = config.track_storage == 'native'
+        self.store_type = storage_numpy_type(config)
+        self.np_type = sample_format_numpy_type(config.sample_format)
+        self.max_amp = sample_format_max_amplitude(config.sample_format)
+        self.bytes_per_sample = storage_bytes(config)
+
+        self._dither_offset = 0
+        self._dither = None
+        if config.track_storage == 'int16':
+            # triangular (TPDF) dither of +-1 LSB, precomputed to avoid generating noise in audio callback
+            rng = np.random.default_rng(DITHER_SEED)
+            size = DITHER_CHUNKS * config.chunk_size * config.channels
+            self._dither = (rng.random(size) - rng.random(size)).astype(np.float32)
+
+    def default_scale(self) -> float:
+        if self.config.track_storage == 'int16':
+            return self.max_amp * STORAGE_HEADROOM / INT16_MAX
+        if self.config.track_storage == 'float16':
+            return self.max_amp
+        return 1
+
+    def fit_scale(self, peak: float) -> float:
+        """Choose scale so that a track with given peak amplitude fits in the storage"""
+        if self.config.track_storage == 'int16':
+            return max(peak, self.max_amp) * STORAGE_HEADROOM / INT16_MAX
+        if self.config.track_storage == 'float16':
+            # normalized to full scale, float16 keeps relative precision with plenty of range for overdubs
+            return max(peak, self.max_amp)
+        return 1
+
+    def empty(self) -> np.array:
+        return np.zeros(self.config.chunk_shape, dtype=self.store_type)
+
+    def encode(self, chunk: np.array, scale: float) -> np.array:
+        if self.native:
+            return chunk
+        if self.store_type == np.float16:
+            return np.multiply(chunk, 1 / scale, dtype=np.float32).astype(np.float16)
+
+        quantized = np.multiply(chunk, 1 / scale, dtype=np.float32)
+        quantized += self._next_dither(quantized.size).reshape(quantized.shape)
+        np.rint(quantized, out=quantized)
+        np.clip(quantized, -INT16_MAX - 1, INT16_MAX, out=quantized)
+        return quantized.astype(np.int16)
+
+    def decode(self, stored: np.array, gain: Union[float, np.array] = 1) -> np.array:
+        """
+        Convert stored chunk to the mixing sample format, multiplied by gain (including track's scale).
+        Gain may be a vector of per-channel gains.
+        """
+        if self.native:
+            if np.isscalar(gain) and gain == 1:
+                return stored
+            return (stored * gain).astype(self.np_type)
+        result = np.multiply(stored, gain, dtype=np.float32)
+        if self.np_type == np.float32:
+            return result
+        return result.astype(self.np_type)
+
+    def add(self, stored: np.array, chunk: np.array, scale: float):
+        """Overdub chunk onto a stored one (or its slice) in place, requantizing the sum"""
+        if self.native:
+            stored += chunk
+            return
+        mixed = np.multiply(stored, scale, dtype=np.float32)
+        mixed += chunk
+        stored[:] = self.encode(mixed, scale)
+
+    def _next_dither(self, size: int) -> np.array:
+        if self._dither_offset + size > len(self._dither):
+            self._dither_offset = 0
+        noise = self._dither[self._dither_offset:self._dither_offset + size]
+        self._dither_offset += size
+        return noise
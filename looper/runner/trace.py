@@ -0,0 +1,241 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import functools
+import hashlib
+import json
+from pathlib import Path
+import queue
+import struct
+import threading
+import time
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from nuclear.sublog import log
+
+from looper.runner.audio_backend import AudioBackend
+from looper.runner.config import Config
+from looper.runner.sample import sample_format_numpy_type
+
+if TYPE_CHECKING:
+    from looper.runner.looper import Looper
+
+TRACE_MAGIC = b'LOOPTRC1'
+# record: type, index of the chunk it precedes, payload length
+RECORD_HEADER = struct.Struct('<BII')
+RECORD_INPUT = 1  # raw input chunk
+RECORD_EVENT = 2  # control event as JSON: [method name, arguments]
+RECORD_OUTPUT_HASH = 3  # SHA-256 of all output chunks, written at the end
+
+
+# depth of traced control calls made by the current thread, only the outermost one is recorded
+_call_depth = threading.local()
+
+
+def traced(method: Callable) -> Callable:
+    """
+    Record a call of the looper's control method in the trace, if capturing.
+    While capturing, the call doesn't overlap with an audio callback, so it's replayed before the same chunk.
+    Control calls made by a traced call are not recorded, they are repeated by replaying the outer one.
+    """
+    @functools.wraps(method)
+    def wrapper(looper: 'Looper', *args):
+        trace = looper.trace
+        if trace is None or getattr(_call_depth, 'value', 0) > 0:
+            return method(looper, *args)
+        _call_depth.value = 1
+        try:
+            with trace.lock:
+                result = method(looper, *args)
+                trace.event(method.__name__, args)
+        finally:
+            _call_depth.value = 0
+        return result
+    return wrapper
+
+
+@contextmanager
+def trace_released(looper: 'Looper') -> Iterator[None]:
+    """
+    Let audio callbacks run during slow work of a traced control call, eg. generating audio.
+    The work must not change engine state and has to precede the changes, as the call is recorded when it ends.
+    """
+    trace = looper.trace
+    if trace is None or getattr(_call_depth, 'value', 0) == 0:
+        yield
+        return
+    trace.lock.release()
+    try:
+        yield
+    finally:
+        trace.lock.acquire()
+
+
+def refuse_while_capturing(looper: 'Looper', operation: str):
+    """Reject operation replacing engine state with data the trace doesn't capture, so replay would diverge"""
+    if looper.trace is not None:
+        raise RuntimeError(f'{operation} can not be replayed, it is not available while capturing a trace')
+
+
+class TraceWriter:
+    """
+    Capture raw input chunks and control events with the index of the chunk they precede into a binary trace.
+    Audio callback only enqueues references, the file is written by a background thread.
+    """
+
+    def __init__(self, path: str, config: Config) -> None:
+        self.path = Path(path)
+        self.config = config
+        self.chunk_index: int = 0
+        self.lock = threading.RLock()  # held by audio callback and traced control calls
+        self._queue: 'queue.Queue[Optional[Tuple[int, int, Any]]]' = queue.Queue()
+        self._output_hash = hashlib.sha256()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self._file: BinaryIO = self.path.open('wb')
+        header = json.dumps({'config': json.loads(self.config.json())}).encode()
+        self._file.write(TRACE_MAGIC + struct.pack('<I', len(header)) + header)
+        self._thread = threading.Thread(target=self._writer_loop, name='trace-writer', daemon=True)
+        self._thread.start()
+        log.info('capturing engine trace', file=self.path)
+
+    def on_input(self, input_chunk: np.ndarray):
+        self._queue.put((RECORD_INPUT, self.chunk_index, input_chunk))
+
+    def on_output(self, out_chunk: np.ndarray):
+        self._queue.put((RECORD_OUTPUT_HASH, self.chunk_index, out_chunk))
+        self.chunk_index += 1
+
+    def event(self, name: str, args: tuple):
+        self._queue.put((RECORD_EVENT, self.chunk_index, [name, list(args)]))
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        digest = self._output_hash.hexdigest().encode()
+        self._file.write(RECORD_HEADER.pack(RECORD_OUTPUT_HASH, self.chunk_index, len(digest)) + digest)
+        self._file.close()
+        log.info('engine trace saved', file=self.path, chunks=self.chunk_index,
+            size=f'{self.path.stat().st_size / 1024 / 1024:.2f}MB')
+
+    def _writer_loop(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            record_type, index, payload = record
+            if record_type == RECORD_OUTPUT_HASH:
+                self._output_hash.update(payload.tobytes())
+                continue
+            if record_type == RECORD_INPUT:
+                data = payload.tobytes()
+            else:
+                data = json.dumps(payload).encode()
+            self._file.write(RECORD_HEADER.pack(record_type, index, len(data)) + data)
+
+
+@dataclass
+class Trace:
+    config: Config
+    inputs: List[np.ndarray] = field(default_factory=list)
+    events: Dict[int, List[Tuple[str, list]]] = field(default_factory=lambda: defaultdict(list))
+    output_hash: Optional[str] = None
+
+
+def read_trace(path: Path) -> Trace:
+    with path.open('rb') as file:
+        if file.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f'{path} is not an engine trace')
+        header_length, = struct.unpack('<I', file.read(4))
+        header = json.loads(file.read(header_length))
+        trace = Trace(config=Config(**header['config']))
+        np_type = sample_format_numpy_type(trace.config.sample_format)
+        frame_shape = (-1,) + trace.config.input_chunk_shape[1:]
+        while True:
+            record_header = file.read(RECORD_HEADER.size)
+            if len(record_header) < RECORD_HEADER.size:
+                break
+            record_type, index, length = RECORD_HEADER.unpack(record_header)
+            data = file.read(length)
+            if record_type == RECORD_INPUT:
+                trace.inputs.append(np.frombuffer(data, dtype=np_type).reshape(frame_shape))
+            elif record_type == RECORD_EVENT:
+                name, args = json.loads(data)
+                trace.events[index].append((name, args))
+            elif record_type == RECORD_OUTPUT_HASH:
+                trace.output_hash = data.decode()
+    return trace
+
+
+class TraceBackend(AudioBackend):
+    """Backend without a stream, callback is driven by the trace replay"""
+
+    def open(self, config: Config, stream_callback: Callable[[np.ndarray], np.ndarray]):
+        self.stream_callback = stream_callback
+
+    def close(self):
+        pass
+
+
+def replay_trace(trace_file: str, update: bool = False):
+    """
+    Feed captured input chunks and control events through the engine faster than real time,
+    verify output hash and report callback timings.
+    :param update: store hash of the replayed output in the trace, accepting it as the expected one
+    """
+    from looper.runner.looper import Looper
+    path = Path(trace_file)
+    trace = read_trace(path)
+    config = trace.config.copy(update={
+        'offline': True,
+        'prioritize_process': False,
+        'journal': False,
+        'tracks_memory_budget_mb': 0,
+    })
+    log.info('replaying engine trace', file=path, chunks=len(trace.inputs),
+        events=sum(len(events) for events in trace.events.values()))
+
+    backend = TraceBackend()
+    looper = Looper(None, config)
+    looper.run(backend)
+    output_hash = hashlib.sha256()
+    start_time = time.perf_counter()
+    try:
+        for index, input_chunk in enumerate(trace.inputs):
+            for name, args in trace.events.get(index, []):
+                getattr(looper, name)(*args)
+            out_chunk = backend.stream_callback(np.copy(input_chunk))
+            output_hash.update(out_chunk.tobytes())
+        stats = looper.callback_stats.report()
+    finally:
+        looper.close()
+    elapsed = time.perf_counter() - start_time
+
+    digest = output_hash.hexdigest()
+    duration = len(trace.inputs) * config.chunk_length_s
+    log.info('trace replayed',
+        audio_duration=f'{duration:.2f}s',
+        elapsed=f'{elapsed:.2f}s',
+        speed=f'{duration / elapsed:.1f}x real time' if elapsed > 0 else None,
+        p50=f"{stats['p50_ms']:.3f}ms",
+        p99=f"{stats['p99_ms']:.3f}ms",
+        max=f"{stats['max_ms']:.3f}ms",
+        p99_load=f"{stats['p99_load'] * 100:.1f}%",
+        late_callbacks=stats['late_count'],
+    )
+
+    if update:
+        with path.open('ab') as file:
+            data = digest.encode()
+            file.write(RECORD_HEADER.pack(RECORD_OUTPUT_HASH, len(trace.inputs), len(data)) + data)
+        log.info('expected output hash updated', output_hash=digest)
+    elif digest != trace.output_hash:
+        raise RuntimeError(f'replayed output differs from the expected one: {digest} != {trace.output_hash}')
+    else:
+        log.info('replayed output is bit-exact', output_hash=digest)
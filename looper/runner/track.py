@@ -1,11 +1,17 @@
 from dataclasses import dataclass, field
-from typing import List, Optional
+import functools
+import math
+from pathlib import Path
+import time
+from typing import Iterable, List, Optional, Set, Tuple
 
 import numpy as np
 from nuclear.sublog import log
 
 from looper.runner.config import Config
 from looper.runner.dsp import SignalProcessor
+from looper.runner.mixer import input_gains_vector
+from looper.runner.storage import SampleCodec
 
 
 @dataclass
@@ -18,44 +24,153 @@ class Track:
     playing: bool = False
     empty: bool = True
     volume: float = 0  # dB
+    pan: float = 0  # from -1 (first channel) to 1 (last channel), multi-channel only
+    input_gains: Optional[np.array] = None  # gains of input channels recorded on the track, None for default routing
     name: str = ''
-    loop_chunks: List[np.array] = field(default_factory=list)
+    loop_chunks: List[np.array] = field(default_factory=list)  # chunks in track storage format
+    scale: float = 1  # stored value multiplied by scale gives the sample value
     recording_from: int = -1
+    recording_offset: int = 0  # sample of the first recorded chunk at which recording starts
+    stop_offset: Optional[int] = None  # sample of the current chunk at which scheduled recording stops
     dsp: SignalProcessor = None
+    codec: SampleCodec = None
+    spill_path: Optional[Path] = None  # memory-mapped file keeping the chunks, if spilled to disk
+    pending_play: bool = False  # start playing at the next loop start, once loaded back to memory
+    pending_record: bool = False  # start overdubbing once loaded back to memory
+    pending_swap: Optional[Tuple[List[np.array], float]] = None  # encoded chunks and scale replacing the loop at its start
+    last_touched: float = field(default_factory=time.time)
+    modified_chunks: Optional[Set[int]] = None  # chunks changed since journaled, None if the whole loop was replaced
 
+    _pan_gains: Optional[np.array] = None  # per-channel gains of the pan position
     _last_recorded_chunk: Optional[np.array] = None
-    _last_recorded_position: int = -1
+    _last_recorded_sample: int = -1
 
     def __post_init__(self):
         self.dsp = SignalProcessor(self.config)
+        self.codec = SampleCodec(self.config)
+        self.scale = self.codec.default_scale()
+        self.input_gains = input_gains_vector(self.config, self.config.track_inputs.get(self.index))
 
     def set_empty(self, chunks_num: int):
-        self.loop_chunks = [self.dsp.silence() for i in range(chunks_num)]
+        self.last_touched = time.time()
+        self.spill_path = None
+        self.modified_chunks = None
+        self.scale = self.codec.default_scale()
+        # all chunks reference the same silence until they are overdubbed
+        silence = self.codec.empty()
+        silence.flags.writeable = False
+        self.loop_chunks = [silence] * chunks_num
         self.empty = True
     
     def set_track(self, chunks: List[np.array], fade: bool):
+        self.loop_chunks, self.scale = self.encode_chunks(chunks, fade)
+        self.modified_chunks = None
+        self.empty = False
+        self.last_touched = time.time()
+        self.spill_path = None
+
+    def encode_chunks(self, chunks: List[np.array], fade: bool) -> Tuple[List[np.array], float]:
+        """Convert chunks to the track storage, return them with the scale fitting them"""
         if fade:
             self.dsp.fade_in(chunks[0])
             self.dsp.fade_out(chunks[-1])
-        self.loop_chunks = chunks
+        scale = self.scale
+        if not self.codec.native:
+            peak = max((np.max(np.abs(chunk)) for chunk in chunks), default=0)
+            scale = self.codec.fit_scale(peak)
+        return [self.codec.encode(chunk, scale) for chunk in chunks], scale
+
+    def set_length(self, chunks_num: int):
+        """
+        Repeat or cut the loop to a number of chunks.
+        Repeated chunks reference the existing ones, they are copied once overdubbed.
+        """
+        self.loop_chunks = repeat_chunks(self.loop_chunks, chunks_num)
+        protect_repeated_chunks(self.loop_chunks)
+        self.modified_chunks = None
+        self.last_touched = time.time()
+
+    def position(self, chunk_clock: int) -> int:
+        """Return index of the chunk played at a number of chunks since the loop start"""
+        return chunk_clock % len(self.loop_chunks)
+
+    def schedule_swap(self, encoded_chunks: List[np.array], scale: float):
+        """Replace the chunks with encoded ones at the next loop start, without stopping the playback"""
+        self.pending_swap = (encoded_chunks, scale)
+
+    def swap_pending(self) -> bool:
+        if self.pending_swap is None:
+            return False
+        self.loop_chunks, self.scale = self.pending_swap
+        self.pending_swap = None
+        self.modified_chunks = None
+        self.recording = False
+        self.recording_from = -1
         self.empty = False
+        self.spill_path = None
+        self.playing = True
+        self.last_touched = time.time()
+        return True
 
-    def overdub(self, input_chunk: np.array, position: int):
+    def overdub(self, input_chunk: np.array, position: int, latency: int = 0):
+        """
+        Mix input chunk into the loop.
+        :param position: index of the chunk being played while input was recorded
+        :param latency: round-trip latency in samples, input is moved back by it
+        """
         # fade in first chunk
         if position == self.recording_from:
-            self.dsp.fade_in(input_chunk)
-        self.loop_chunks[position] += input_chunk
+            if self.recording_offset > 0:
+                input_chunk = np.copy(input_chunk)
+                _fade_from(input_chunk, self.recording_offset, fade_in=True)
+            else:
+                self.dsp.fade_in(input_chunk)
+        if self.stop_offset is not None:
+            input_chunk = np.copy(input_chunk)
+            _fade_from(input_chunk, self.stop_offset, fade_in=False)
+        sample_position = position * self.config.chunk_size - latency
+        self._add_at_sample(sample_position, input_chunk)
         self.empty = False
+        self.last_touched = time.time()
         self._last_recorded_chunk = input_chunk
-        self._last_recorded_position = position
+        self._last_recorded_sample = sample_position
         # start playing after reaching a full cycle
         if self.recording_from >= 0 and position == shift_loop_position(self.recording_from, -1, len(self.loop_chunks)):
             self.playing = True
             self.recording_from = -1
+        if self.stop_offset is not None:
+            self.stop_offset = None
+            self.recording = False
+            self.playing = True
+
+    def _add_at_sample(self, sample_position: int, chunk: np.array):
+        """Mix chunk into the loop starting at a given sample, wrapping around the loop end"""
+        chunk_size = self.config.chunk_size
+        sample_position %= len(self.loop_chunks) * chunk_size
+        index, offset = divmod(sample_position, chunk_size)
+        head_size = chunk_size - offset
+        self.codec.add(self._writable_chunk(index)[offset:], chunk[:head_size], self.scale)
+        if self.modified_chunks is not None:
+            self.modified_chunks.add(index)
+        if offset > 0:
+            next_index = (index + 1) % len(self.loop_chunks)
+            self.codec.add(self._writable_chunk(next_index)[:offset], chunk[head_size:], self.scale)
+            if self.modified_chunks is not None:
+                self.modified_chunks.add(next_index)
 
-    def start_recording(self, at_position: int):
+    def _writable_chunk(self, index: int) -> np.array:
+        """Return chunk to be modified in place, copying it first if it's referenced by other positions"""
+        chunk = self.loop_chunks[index]
+        if not chunk.flags.writeable:
+            chunk = np.copy(chunk)
+            self.loop_chunks[index] = chunk
+        return chunk
+
+    def start_recording(self, at_position: int, at_offset: int = 0):
         self.recording = True
         self.recording_from = at_position
+        self.recording_offset = at_offset
+        self.stop_offset = None
         self._last_recorded_chunk = None
         log.debug('overdubbing track...', track_id=self.index)
 
@@ -64,35 +179,108 @@ class Track:
         self.playing = True
         # fade out last chunk
         if self._last_recorded_chunk is not None:
-            self.loop_chunks[self._last_recorded_position] -= self._last_recorded_chunk
-            self.dsp.fade_out(self._last_recorded_chunk)
-            self.loop_chunks[self._last_recorded_position] += self._last_recorded_chunk
+            faded_chunk = np.copy(self._last_recorded_chunk)
+            self.dsp.fade_out(faded_chunk)
+            self._add_at_sample(self._last_recorded_sample, faded_chunk - self._last_recorded_chunk)
         log.info('overdub stopped', track_id=self.index)
 
+    def stop_recording_at(self, offset: int):
+        """Stop recording at a sample of the chunk about to be overdubbed, fading out up to it"""
+        if offset == 0:
+            self.stop_recording()
+        else:
+            self.stop_offset = offset
+
     def toggle_play(self):
-        if self.playing:
+        self.last_touched = time.time()
+        if self.playing or self.pending_play:
             self.playing = False
+            self.pending_play = False
             log.debug('track muted', track_id=self.index)
         else:
             if self.empty:
                 log.warn('cannot start playing empty track', track_id=self.index)
+            elif self.spilled:
+                self.pending_play = True
+                log.debug('track will be unmuted at the next loop start', track_id=self.index)
             else:
                 self.playing = True
                 log.debug('track unmuted', track_id=self.index)
 
+    @property
+    def spilled(self) -> bool:
+        return self.spill_path is not None
+
+    def resident_bytes(self) -> int:
+        """Return size of the chunks kept in RAM, not backed by a file"""
+        unique_chunks = {id(chunk): chunk for chunk in self.loop_chunks if not isinstance(chunk, np.memmap)}
+        return sum(chunk.nbytes for chunk in unique_chunks.values())
+
+    def set_pan(self, pan: float):
+        if not -1 <= pan <= 1:
+            raise ValueError(f'pan should be in range [-1, 1], got {pan}')
+        self.pan = pan
+        if pan == 0 or self.config.channels == 1:
+            self._pan_gains = None
+        else:
+            self._pan_gains = self.dsp.pan_gains(pan)
+
     def current_playback(self, position: int) -> np.array:
         chunk = self.loop_chunks[position]
-        return self.dsp.amplify(chunk, self.volume)
+        gain = self.scale * 10 ** (self.volume / 20)
+        if self._pan_gains is not None:
+            gain = self._pan_gains * gain
+        return self.codec.decode(chunk, gain)
+
+    def decoded_chunks(self) -> List[np.array]:
+        """Return track chunks in the mixing sample format"""
+        return [self.codec.decode(chunk, self.scale) for chunk in self.loop_chunks]
 
     def compute_loudness(self) -> float:
-        return self.dsp.compute_loudness(self.loop_chunks)
+        return self.dsp.compute_loudness(self.decoded_chunks())
 
     def clear(self):
         self.recording = False
+        self.stop_offset = None
         self.playing = False
+        self.pending_play = False
+        self.pending_record = False
+        self.pending_swap = None
         self.set_empty(len(self.loop_chunks))
 
 
+def _fade_from(chunk: np.array, offset: int, fade_in: bool):
+    """Silence chunk before (fade in) or after (fade out) a sample, ramping the rest of it"""
+    if fade_in:
+        ramp = np.linspace(0, 1, len(chunk) - offset)
+        chunk[:offset] = 0
+        segment = chunk[offset:]
+    else:
+        ramp = np.linspace(1, 0, offset)
+        chunk[offset:] = 0
+        segment = chunk[:offset]
+    np.multiply(segment, ramp.reshape((-1,) + (1,) * (chunk.ndim - 1)), out=segment, casting='unsafe')
+
+
+def repeat_chunks(chunks: List[np.array], chunks_num: int) -> List[np.array]:
+    """Repeat or cut chunks to a number of chunks, referencing the same arrays instead of copying them"""
+    return [chunks[index % len(chunks)] for index in range(chunks_num)]
+
+
+def common_loop_length(lengths: Iterable[int]) -> int:
+    """Return the least common multiple of track lengths, after which all of them meet at the loop start"""
+    return functools.reduce(lambda a, b: a * b // math.gcd(a, b), lengths, 1)
+
+
+def protect_repeated_chunks(chunks: List[np.array]):
+    """Make chunks referenced at more than one position read-only, so that they are copied before overdubbing"""
+    seen = set()
+    for chunk in chunks:
+        if id(chunk) in seen:
+            chunk.flags.writeable = False
+        seen.add(id(chunk))
+
+
 def shift_loop_position(position: int, shift: int, loop_length: int) -> int:
     if loop_length == 0:
         return 0
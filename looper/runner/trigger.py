@@ -0,0 +1,63 @@
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.sample import sample_format_max_amplitude, sample_format_numpy_type
+
+
+class RecordTrigger:
+    """
+    Detect the onset of playing in the input, keeping the recent chunks as a pre-roll.
+    Buffers are preallocated, so processing a chunk in the audio callback doesn't allocate arrays.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.chunk_size = config.chunk_size
+        self.preroll_samples = round(config.record_preroll_s * config.sampling_rate)
+        self.threshold = sample_format_max_amplitude(config.sample_format) * 10 ** (config.record_trigger_threshold_db / 20)
+        preroll_chunks = max(1, math.ceil(self.preroll_samples / config.chunk_size))
+        self._ring = np.zeros((preroll_chunks,) + config.chunk_shape, dtype=sample_format_numpy_type(config.sample_format))
+        self._head: int = 0  # slot of the next chunk
+        self._filled: int = 0
+        self._abs = np.zeros(config.chunk_shape, dtype=np.float32)
+        self._above = np.zeros(config.chunk_shape, dtype=bool)
+
+    def reset(self):
+        self._head = 0
+        self._filled = 0
+
+    def process(self, chunk: np.array) -> Optional[Tuple[List[np.array], int]]:
+        """
+        Check chunk for the threshold crossing.
+        Return chunks starting with the pre-roll and the sample of the first one the master loop starts at,
+        or buffer the chunk as a pre-roll if the threshold is not crossed.
+        """
+        np.abs(chunk, out=self._abs)
+        np.greater_equal(self._abs, self.threshold, out=self._above)
+        above = self._above.reshape(-1)
+        first = int(above.argmax())
+        if not above[first]:
+            self._ring[self._head] = chunk
+            self._head = (self._head + 1) % len(self._ring)
+            self._filled = min(self._filled + 1, len(self._ring))
+            return None
+
+        onset = first // self.config.channels
+        start = max(0, self._filled * self.chunk_size + onset - self.preroll_samples)
+        first_chunk, start_sample = divmod(start, self.chunk_size)
+        preroll = [np.copy(self._ring[(self._head - self._filled + index) % len(self._ring)])
+                   for index in range(first_chunk, self._filled)]
+        self.reset()
+        return preroll + [np.copy(chunk)], start_sample
+
+
+def align_chunks(chunks: List[np.array], start_sample: int, chunk_size: int) -> List[np.array]:
+    """Split chunks again so that the first one begins at a given sample, dropping the incomplete tail"""
+    if start_sample == 0:
+        return chunks
+    samples = np.concatenate(chunks)[start_sample:]
+    chunks_num = len(samples) // chunk_size
+    return list(np.split(samples[:chunks_num * chunk_size], chunks_num)) if chunks_num else []
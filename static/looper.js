@@ -34,6 +34,11 @@ function bindRecorderButtons() {
     $("#btn-save-output").click(function () {
         ajaxRequest('post', '/api/recorder/toggle', function(data) {
             refreshOutputRecorderStatus()
+            if (data && data.hasOwnProperty('id')) {
+                waitForJob(data.id, function(job) {
+                    refreshOutputRecorderStatus()
+                })
+            }
         })
     })
 }
@@ -169,6 +174,30 @@ function ajaxRequest(type, url, onSuccess) {
     })
 }
 
+function ajaxJobRequest(type, url, onDone) {
+    ajaxRequest(type, url, function(data) {
+        if (data && data.hasOwnProperty('id') && data.hasOwnProperty('phase')) {
+            waitForJob(data.id, onDone)
+        } else {
+            onDone(data)
+        }
+    })
+}
+
+function waitForJob(jobId, onDone) {
+    ajaxRequest('get', `/api/jobs/${jobId}`, function(job) {
+        if (job.phase == 'DONE') {
+            onDone(job)
+        } else if (job.phase == 'FAILED') {
+            showAlert('Error: ' + job.error, 'danger')
+        } else {
+            setTimeout(function() {
+                waitForJob(jobId, onDone)
+            }, 500)
+        }
+    })
+}
+
 function updateElementClass(elementId, condition, onClass, offClass) {
     if (condition) {
         $(elementId).addClass(onClass)
@@ -0,0 +1,31 @@
+from typing import Callable, List, Optional
+
+import pytest
+
+from looper.runner.audio_backend import AudioBackend
+from looper.runner.config import Config
+from looper.runner.looper import Looper
+from looper.runner.trace import TraceBackend, TraceWriter
+
+
+@pytest.fixture
+def offline_looper() -> Callable[..., Looper]:
+    """
+    Create loopers streaming through a trace backend, driven by calling its stream callback.
+    Keyword arguments override the config, loopers are closed after the test.
+    """
+    loopers: List[Looper] = []
+
+    def create(trace_path=None, backend: Optional[AudioBackend] = None, **config_overrides) -> Looper:
+        settings = dict(chunk_size=8, offline=True, journal=False, prioritize_process=False)
+        config = Config(**{**settings, **config_overrides})
+        looper = Looper(None, config)
+        if trace_path is not None:
+            looper.trace = TraceWriter(str(trace_path), config)
+        looper.run(backend or TraceBackend())
+        loopers.append(looper)
+        return looper
+
+    yield create
+    for looper in loopers:
+        looper.close()
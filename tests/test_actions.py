@@ -0,0 +1,94 @@
+import numpy as np
+
+from looper.runner.actions import ActionScheduler, Quantize
+from looper.runner.looper import LoopPhase, Looper
+from looper.runner.spill import SpillManager
+
+
+def test_quantized_targets_are_sample_exact():
+    scheduler = ActionScheduler(chunk_size=8)
+    # loop of 100 samples with 3 beats in a bar of 3 beats
+    assert scheduler.target_sample(Quantize.BEAT, 0, 100, 3, 3) == 0
+    assert scheduler.target_sample(Quantize.BEAT, 1, 100, 3, 3) == 34
+    assert scheduler.target_sample(Quantize.BEAT, 34, 100, 3, 3) == 34
+    assert scheduler.target_sample(Quantize.BEAT, 67, 100, 3, 3) == 67
+    assert scheduler.target_sample(Quantize.BEAT, 68, 100, 3, 3) == 0
+    assert scheduler.target_sample(Quantize.BAR, 10, 100, 6, 3) == 50
+    assert scheduler.target_sample(Quantize.LOOP, 10, 100, 6, 3) == 0
+    assert scheduler.target_sample(Quantize.NOW, 16, 100, 6, 3) == 16
+
+    late = scheduler.add('mute', 0, Quantize.BEAT, 67)
+    early = scheduler.add('record', 1, Quantize.BEAT, 34)
+    assert scheduler.pending == [early, late]
+    assert scheduler.pop_due(32) == [early]
+    assert scheduler.pending == [late]
+
+
+def _looper(offline_looper) -> Looper:
+    looper = offline_looper(tracks_num=2)
+    looper.master_chunks = [np.zeros(8, dtype=np.float32) for _ in range(10)]
+    looper.tracks[0].set_track(looper.master_chunks, fade=False)
+    looper.tracks[1].set_empty(10)
+    looper.metronome_beats = 8
+    looper.metronome_bars = 1
+    looper.phase = LoopPhase.LOOP
+    return looper
+
+
+def test_scheduled_recording_starts_and_stops_at_exact_samples(offline_looper):
+    looper = _looper(offline_looper)
+    callback = looper.audio_backend.stream_callback
+    for _ in range(3):
+        callback(np.ones(8, dtype=np.float32))
+
+    looper.schedule_action('record', 1, 'beat')
+    assert looper.scheduled_actions()[0]['target_sample'] == 30
+    callback(np.ones(8, dtype=np.float32))
+    assert looper.tracks[1].recording
+    chunk = looper.tracks[1].loop_chunks[3]
+    assert chunk[:7].tolist() == [0] * 7
+    assert np.all(chunk[7:] > 0)
+
+    looper.schedule_action('stop', 1, 'beat')
+    assert looper.scheduled_actions()[0]['target_sample'] == 40
+    callback(np.ones(8, dtype=np.float32))
+    assert looper.tracks[1].recording
+    callback(np.ones(8, dtype=np.float32))
+    assert not looper.tracks[1].recording
+    assert looper.tracks[1].playing
+    assert not looper.scheduled_actions()
+
+
+def test_scheduled_mute_cuts_playback_at_exact_sample(offline_looper):
+    looper = _looper(offline_looper)
+    looper.tracks[0].set_track([np.ones(8, dtype=np.float32) for _ in range(10)], fade=False)
+    looper.tracks[0].playing = True
+    looper.config.listen_input = False
+    callback = looper.audio_backend.stream_callback
+    for _ in range(2):
+        callback(np.zeros(8, dtype=np.float32))
+
+    looper.schedule_action('mute', 0, 'beat')
+    out_chunk = callback(np.zeros(8, dtype=np.float32))
+    assert out_chunk.tolist() == [1] * 4 + [0] * 4
+    assert not looper.tracks[0].playing
+
+
+def test_scheduled_unmute_of_spilled_track_waits_for_loading(offline_looper, tmp_path):
+    looper = _looper(offline_looper)
+    track = looper.tracks[0]
+    track.set_track([np.ones(8, dtype=np.float32) for _ in range(10)], fade=False)
+    spill = SpillManager(looper)
+    spill.spill_dir = tmp_path
+    assert spill.spill_track(track)
+    callback = looper.audio_backend.stream_callback
+
+    looper.schedule_action('unmute', 0, 'beat')
+    for _ in range(5):
+        callback(np.zeros(8, dtype=np.float32))
+    assert track.pending_play and not track.playing
+
+    spill.load_track(track)
+    for _ in range(5):
+        callback(np.zeros(8, dtype=np.float32))
+    assert track.playing and not track.pending_play
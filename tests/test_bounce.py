@@ -0,0 +1,79 @@
+import numpy as np
+
+from looper.runner.bounce import bounce_tracks, undo_bounce
+from looper.runner.looper import LoopPhase, Looper
+
+
+def _looper(offline_looper, **kwargs) -> Looper:
+    looper = offline_looper(tracks_num=3, listen_input=False, **kwargs)
+    looper.master_chunks = [np.full(8, 0.1, dtype=np.float32) for _ in range(4)]
+    looper.tracks[0].set_track(looper.master_chunks, fade=False)
+    looper.tracks[1].set_track([np.full(8, 0.2, dtype=np.float32) for _ in range(4)], fade=False)
+    looper.tracks[2].set_track([np.full(8, 0.3, dtype=np.float32) for _ in range(4)], fade=False)
+    for track in looper.tracks:
+        track.playing = True
+    looper.tracks[2].volume = -6
+    looper.phase = LoopPhase.LOOP
+    return looper
+
+
+def _stream_loop(looper: Looper) -> np.array:
+    return np.concatenate([looper.audio_backend.stream_callback(np.zeros(8, dtype=np.float32))
+                           for _ in range(looper.loop_chunks_num)])
+
+
+def test_bounced_tracks_sound_the_same_and_free_sources(offline_looper):
+    looper = _looper(offline_looper)
+    callback = looper.audio_backend.stream_callback
+    before = _stream_loop(looper)
+    callback(np.zeros(8, dtype=np.float32))
+
+    bounce_tracks(looper, [2, 1], keep_undo=True)
+    for _ in range(3):
+        callback(np.zeros(8, dtype=np.float32))
+    assert not looper.tracks[2].empty
+    assert looper.bounce_undo is None
+
+    # swapped at the loop start
+    after = _stream_loop(looper)
+    assert np.allclose(after, before, atol=1e-6)
+    assert looper.tracks[2].empty and not looper.tracks[2].playing
+    assert looper.tracks[1].volume == 0
+    assert looper.bounce_undo.target_id == 1
+    assert looper.bounce_undo.tracks[2].chunks[0].dtype == np.int16
+
+
+def test_bounce_undo_restores_source_tracks(offline_looper):
+    looper = _looper(offline_looper, track_storage='int16')
+    bounce_tracks(looper, [1, 2], keep_undo=True)
+    _stream_loop(looper)
+
+    undo_bounce(looper)
+    _stream_loop(looper)
+    assert looper.bounce_undo is None
+    assert looper.tracks[2].playing and looper.tracks[2].volume == -6
+    assert np.allclose(looper.tracks[2].decoded_chunks()[0], 0.3, atol=1e-3)
+    assert np.allclose(looper.tracks[1].decoded_chunks()[0], 0.2, atol=1e-3)
+
+
+def test_bounce_discarded_when_source_overdubbed_meanwhile(offline_looper):
+    looper = _looper(offline_looper)
+    looper.tracks[2].last_touched = 0
+    bounce_tracks(looper, [1, 2])
+    looper.tracks[2].overdub(np.full(8, 0.5, dtype=np.float32), 1)
+    _stream_loop(looper)
+
+    assert not looper.tracks[2].empty
+    assert looper.tracks[2].volume == -6
+    assert np.allclose(looper.tracks[1].decoded_chunks()[0], 0.2, atol=1e-6)
+
+
+def test_bounced_muted_tracks_stay_muted(offline_looper):
+    looper = _looper(offline_looper)
+    looper.tracks[1].playing = False
+    looper.tracks[2].playing = False
+    bounce_tracks(looper, [1, 2])
+    _stream_loop(looper)
+
+    assert not looper.tracks[1].empty
+    assert not looper.tracks[1].playing
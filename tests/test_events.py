@@ -0,0 +1,54 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.events import EngineEventType
+from looper.runner.leds import LedController
+from looper.runner.looper import LoopPhase, Looper
+
+
+def _drain(events):
+    drained = []
+    while not events.empty():
+        drained.append(events.get())
+    return drained
+
+
+def test_state_changes_are_stamped_with_sample_clock(offline_looper):
+    looper = offline_looper(tracks_num=2)
+    backend = looper.audio_backend
+    events = looper.events.subscribe()
+
+    looper.toggle_record(0)
+    for _ in range(4):
+        backend.stream_callback(np.ones(8, dtype=np.float32))
+    looper.toggle_record(0)
+    phase_events = _drain(events)
+    assert [event.type for event in phase_events] == [EngineEventType.PHASE, EngineEventType.PHASE]
+    assert phase_events[1].sample_clock == 32
+    assert looper.phase == LoopPhase.LOOP
+
+    for _ in range(4):
+        backend.stream_callback(np.ones(8, dtype=np.float32))
+    wrap_events = _drain(events)
+    assert [event.type for event in wrap_events] == [EngineEventType.LOOP_WRAP]
+    assert wrap_events[0].sample_clock == 56
+    assert wrap_events[0].loop_position == 0
+
+    looper.events.unsubscribe(events)
+
+
+def test_progress_pulse_is_timed_from_loop_position():
+    config = Config(chunk_size=441, offline=True, journal=False, prioritize_process=False)
+    looper = Looper(MagicMock(), config)
+    looper.reset()
+    looper.master_chunks = [np.zeros(441, dtype=np.float32) for _ in range(100)]
+    looper.phase = LoopPhase.LOOP
+    events = looper.events.subscribe()
+    looper.current_position = 60
+    looper.publish(EngineEventType.LOOP_WRAP)
+
+    LedController(looper).handle_events(_drain(events))
+    fade_in_time = looper.pinout.progress_led.pulse.call_args.kwargs['fade_in_time']
+    assert 0.39 < fade_in_time <= 0.4
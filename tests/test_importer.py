@@ -0,0 +1,43 @@
+import io
+import wave
+
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.importer import import_track_audio
+from looper.runner.looper import LoopPhase, Looper
+
+
+def _wav_bytes(samples: np.array, sampling_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'w') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(sampling_rate)
+        stereo = np.repeat(samples[:, np.newaxis], 2, axis=1)
+        wav.writeframes((stereo * 32767).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def test_import_resamples_and_swaps_at_loop_start():
+    config = Config(chunk_size=100, sampling_rate=8000, tracks_num=2)
+    looper = Looper(None, config)
+    looper.reset()
+    looper.master_chunks = [np.zeros(100, dtype=np.float32) for _ in range(8)]
+    looper.phase = LoopPhase.LOOP
+    for track in looper.tracks:
+        track.set_empty(8)
+
+    data = _wav_bytes(np.full(1200, 0.5), sampling_rate=16000)
+    import_track_audio(looper, 1, data, 'backing.wav', mode='fit')
+
+    track = looper.tracks[1]
+    assert track.empty and track.pending_swap is not None
+    looper.current_position = 7
+    looper.next_chunk()
+    assert not track.empty and track.playing
+    assert track.name == 'backing'
+    assert len(track.loop_chunks) == 8
+    # 1200 samples at 16kHz give 6 chunks at 8kHz, the rest is padded with silence
+    assert abs(track.loop_chunks[3][50] - 0.5) < 0.01
+    assert track.loop_chunks[7][50] == 0
@@ -0,0 +1,39 @@
+import threading
+
+from looper.runner.config import Config
+from looper.runner.jobs import JobManager, JobPhase, JobType
+
+
+def test_job_reports_result_and_failure():
+    jobs = JobManager(Config())
+
+    job = jobs.submit(JobType.SESSION, lambda job: 42)
+    assert job.future.result(timeout=5) == 42
+    assert jobs.get(job.id).phase == JobPhase.DONE
+    assert job.progress == 1
+
+    def fail(job):
+        raise RuntimeError('broken')
+
+    failed = jobs.submit(JobType.SESSION, fail)
+    assert failed.future.exception(timeout=5) is not None
+    assert failed.phase == JobPhase.FAILED
+    assert failed.error == 'broken'
+    jobs.close()
+
+
+def test_jobs_of_the_same_type_run_one_at_a_time():
+    jobs = JobManager(Config(jobs_workers=4))
+    release = threading.Event()
+
+    first = jobs.submit(JobType.MP3_CONVERSION, lambda job: release.wait(5))
+    second = jobs.submit(JobType.MP3_CONVERSION, lambda job: None)
+    other = jobs.submit(JobType.PLOT, lambda job: None)
+
+    other.future.result(timeout=5)
+    assert second.phase == JobPhase.PENDING
+
+    release.set()
+    second.future.result(timeout=5)
+    assert first.phase == JobPhase.DONE
+    jobs.close()
@@ -0,0 +1,106 @@
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.journal import LoopJournal
+from looper.runner.looper import LoopPhase, Looper
+
+
+def _looper(tmp_path) -> Looper:
+    config = Config(chunk_size=4, tracks_num=2, journal_dir=str(tmp_path))
+    looper = Looper(None, config)
+    looper.reset()
+    return looper
+
+
+def test_journal_recovers_overdubbed_loop(tmp_path):
+    looper = _looper(tmp_path)
+    looper.master_chunks = [np.full(4, i, dtype=np.float32) for i in range(5)]
+    looper.tracks[0].set_track(looper.master_chunks, fade=False)
+    looper.tracks[0].playing = True
+    looper.tracks[1].set_empty(5)
+    looper.tracks[1].volume = -3
+    looper.phase = LoopPhase.LOOP
+    journal = LoopJournal(looper)
+    journal.start()
+    journal.close()
+
+    looper.tracks[1].overdub(np.ones(4, dtype=np.float32), position=2)
+    journal.sync()
+    # whole first track, empty track is written once overdubbed
+    assert journal.bytes_written == (5 + 5) * 4 * 4
+    assert (tmp_path / 'track-1.bin').is_file()
+
+    restarted = _looper(tmp_path)
+    journal = LoopJournal(restarted)
+    journal.start()
+    assert journal.recoverable
+    journal.recover()
+    journal.close()
+
+    assert restarted.phase == LoopPhase.LOOP
+    assert restarted.loop_chunks_num == 5
+    assert restarted.tracks[0].playing
+    assert restarted.tracks[1].volume == -3
+    assert restarted.tracks[0].loop_chunks[3].tolist() == [3, 3, 3, 3]
+    assert restarted.tracks[1].loop_chunks[2].tolist() == [1, 1, 1, 1]
+    assert restarted.tracks[1].loop_chunks[1].tolist() == [0, 0, 0, 0]
+
+
+def test_journal_rewrites_track_without_truncating_previous_copy(tmp_path, monkeypatch):
+    looper = _looper(tmp_path)
+    looper.master_chunks = [np.full(4, i, dtype=np.float32) for i in range(5)]
+    looper.tracks[0].set_track(looper.master_chunks, fade=False)
+    looper.phase = LoopPhase.LOOP
+    journal = LoopJournal(looper)
+    journal.sync()
+    path = tmp_path / 'track-0.bin'
+    journaled = path.read_bytes()
+
+    def crash(*args):
+        raise OSError('power loss')
+
+    looper.tracks[0].set_track([np.ones(4, dtype=np.float32)] * 5, fade=False)
+    monkeypatch.setattr('looper.runner.journal.os.replace', crash)
+    try:
+        journal.sync()
+    except OSError:
+        pass
+    assert path.read_bytes() == journaled
+
+    monkeypatch.undo()
+    journal.sync()
+    assert np.fromfile(str(path), dtype=np.float32).tolist() == [1] * 20
+
+
+def test_journal_removes_file_of_cleared_track(tmp_path):
+    looper = _looper(tmp_path)
+    looper.master_chunks = [np.full(4, i, dtype=np.float32) for i in range(5)]
+    looper.tracks[0].set_track(looper.master_chunks, fade=False)
+    looper.tracks[1].set_track(looper.master_chunks, fade=False)
+    looper.phase = LoopPhase.LOOP
+    journal = LoopJournal(looper)
+    journal.sync()
+    assert (tmp_path / 'track-1.bin').is_file()
+
+    looper.tracks[1].set_empty(5)
+    written = journal.bytes_written
+    journal.sync()
+    assert journal.bytes_written == written
+    assert not (tmp_path / 'track-1.bin').exists()
+
+
+def test_journal_keeps_recoverable_loop_over_restarts(tmp_path):
+    looper = _looper(tmp_path)
+    looper.master_chunks = [np.full(4, i, dtype=np.float32) for i in range(5)]
+    looper.tracks[0].set_track(looper.master_chunks, fade=False)
+    looper.phase = LoopPhase.LOOP
+    journal = LoopJournal(looper)
+    journal.start()
+    journal.close()
+
+    for _ in range(2):
+        restarted = _looper(tmp_path)
+        journal = LoopJournal(restarted)
+        journal.start()
+        journal.close()
+        assert journal.recoverable
@@ -0,0 +1,31 @@
+import numpy as np
+
+from looper.check.latency import analyze_latency, generate_pulse_train, select_input_channel
+from looper.runner.config import Config
+
+
+def test_latency_found_by_cross_correlation_in_noise():
+    config = Config()
+    train = generate_pulse_train(config, repetitions=10)
+    latency = 1234
+    recording = np.roll(train.signal, latency) * 0.3
+    recording += np.random.default_rng(0).normal(0, 0.01, len(recording))
+
+    stats = analyze_latency(recording, train, config.sampling_rate)
+
+    assert stats.detected == 10
+    assert stats.median == latency
+    assert stats.spread == 0
+
+
+def test_pulses_measured_on_input_channel_receiving_them():
+    config = Config(chunk_size=256)
+    train = generate_pulse_train(config, repetitions=5)
+    recording = np.zeros((len(train.signal), 3))
+    recording[:, 0] = np.random.default_rng(0).normal(0, 0.01, len(train.signal))
+    recording[:, 2] = np.roll(train.signal, 300) * 0.3
+
+    stats = analyze_latency(select_input_channel(recording), train, config.sampling_rate)
+
+    assert stats.detected == 5
+    assert stats.median == 300
@@ -0,0 +1,51 @@
+import time
+
+from looper.runner.metrics import ControlLatencyStats
+
+
+def test_control_events_are_stamped_by_audio_callback():
+    stats = ControlLatencyStats(chunk_size=256)
+    with stats.event('gpio', 'toggle_record'):
+        pass
+    with stats.event('http', 'toggle_play'):
+        pass
+    event = stats.pending[0]
+    stats.on_callback(callback_index=10, loop_position=3, start_time=event.source_time + 0.015)
+    assert not stats.pending
+
+    report = stats.report()
+    assert set(report) == {'gpio', 'http'}
+    gpio = report['gpio']
+    assert gpio['count'] == 1
+    assert gpio['histogram']['<=20ms'] == 1
+    assert 14.9 < gpio['effect_p50_ms'] < 15.1
+    assert gpio['last'] == {
+        'action': 'toggle_record',
+        'effect_ms': gpio['last']['effect_ms'],
+        'effect_sample': 2560,
+        'effect_position': 768,
+    }
+
+
+def test_failed_control_action_is_not_measured():
+    stats = ControlLatencyStats(chunk_size=256)
+    try:
+        with stats.event('http', 'remove_track'):
+            raise RuntimeError('can not remove last track')
+    except RuntimeError:
+        pass
+    assert not stats.pending
+
+
+def test_control_event_is_stamped_by_first_callback_after_applying_it():
+    stats = ControlLatencyStats(chunk_size=256)
+    with stats.event('gpio', 'toggle_record'):
+        event = stats.pending[0]
+        # callback holding the lock the action waits for doesn't see its change
+        stats.on_callback(callback_index=10, loop_position=3, start_time=time.perf_counter())
+        assert stats.pending and not stats.report()
+    stats.on_callback(callback_index=11, loop_position=4, start_time=time.perf_counter())
+
+    assert not stats.pending
+    assert event.effect_time >= event.applied_time
+    assert stats.report()['gpio']['last']['effect_sample'] == 11 * 256
@@ -0,0 +1,49 @@
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.mixer import InputMixer, input_gains_vector
+from looper.runner.trace import TraceBackend
+
+
+def test_route_inputs_to_track_channels():
+    config = Config(chunk_size=4, channels=2, input_channels=3)
+    mixer = InputMixer(config)
+    mixer.set_volume(2, -20)
+    frames = np.array([[1, 2, 10]] * 4, dtype=np.float32)
+
+    amplified = mixer.process(frames, 0)
+    assert np.allclose(amplified[0], [1, 2, 1])
+
+    routed = mixer.route(amplified, input_gains_vector(config, [0, 1, 0]))
+    assert routed.shape == (4, 2)
+    assert np.allclose(routed[0], [2, 2])
+
+    # default routing mixes all inputs when they don't match output channels
+    assert np.allclose(mixer.route(amplified)[0], [4, 4])
+
+    levels = mixer.read_levels()
+    assert np.allclose(levels, [0, 20 * np.log10(2), 0])
+    assert mixer.read_levels() == [-100, -100, -100]
+
+
+def test_single_input_passes_through():
+    mixer = InputMixer(Config(chunk_size=4))
+    frames = np.arange(4, dtype=np.float32)
+    assert mixer.route(frames) is frames
+
+
+def test_direct_monitoring_muted_with_input_or_output(offline_looper):
+    class MonitoringBackend(TraceBackend):
+        muted = None
+
+        def mute_direct_monitoring(self, muted: bool):
+            self.muted = muted
+
+    looper = offline_looper(backend=MonitoringBackend())
+    looper.toggle_output_mute()
+    assert looper.audio_backend.muted
+    looper.toggle_input_mute()
+    looper.toggle_output_mute()
+    assert looper.audio_backend.muted
+    looper.toggle_input_mute()
+    assert not looper.audio_backend.muted
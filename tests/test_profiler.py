@@ -0,0 +1,57 @@
+import pstats
+import threading
+import time
+
+import numpy as np
+
+from looper.runner.profiler import IDLE_STACK, ThreadStackSampler, profile_looper
+
+
+def _busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampler_collects_collapsed_stacks(tmp_path):
+    stop = threading.Event()
+    thread = threading.Thread(target=_busy_loop, args=(stop,))
+    thread.start()
+    try:
+        sampler = ThreadStackSampler(thread.ident, interval_s=0.001)
+        sampler.run(0.2)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert sampler.samples > 10
+    assert any(stack.endswith('test_profiler.py:_busy_loop') for stack in sampler.stacks)
+    assert sampler.stacks[IDLE_STACK] < sampler.samples
+    path = tmp_path / 'profile.folded'
+    sampler.save_collapsed(path)
+    stack, count = path.read_text().splitlines()[0].rsplit(' ', 1)
+    assert ';' in stack and int(count) > 0
+
+
+def test_callback_profile_is_saved_as_pstats(offline_looper, tmp_path):
+    looper = offline_looper(chunk_size=64, output_profiles_dir=str(tmp_path))
+    backend = looper.audio_backend
+    stop = threading.Event()
+
+    def stream():
+        while not stop.is_set():
+            backend.stream_callback(np.zeros(64, dtype=np.float32))
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=stream)
+    thread.start()
+    try:
+        result = profile_looper(looper, 0.2, target='audio', mode='cprofile')
+    finally:
+        stop.set()
+        thread.join()
+
+    assert result['format'] == 'pstats'
+    assert result['callbacks'] > 0
+    assert looper.profiler is None
+    stats = pstats.Stats(result['file'])
+    assert any(func[2] == '_stream_audio_chunk' for func in stats.stats)
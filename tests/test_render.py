@@ -0,0 +1,35 @@
+import pickle
+import wave
+
+import numpy as np
+import pytest
+
+from looper.runner.config import Config
+from looper.runner.render import render_session
+from looper.runner.sessions import Session
+from looper.runner.track import Track
+
+
+def test_render_session_to_wav(tmp_path):
+    config = Config(chunk_size=4, sampling_rate=8, recorder_max_gain=0, output_sessions_dir=str(tmp_path))
+    tracks = []
+    for index in range(3):
+        track = Track(index, config, has_gpio=False)
+        track.set_track([np.full(4, 0.25, dtype=np.float32) for _ in range(5)], fade=False)
+        tracks.append(track)
+    tracks[0].playing = True
+    tracks[1].playing = True
+    tracks[1].volume = -6.0206  # half amplitude
+    with (tmp_path / 'jam.pickle').open('wb') as handle:
+        pickle.dump(Session('jam', 0, 0, tracks), handle)
+
+    out_path = render_session(config, 'jam.pickle', loops=3, out_file=str(tmp_path / 'jam.wav'))
+
+    with wave.open(str(out_path)) as wav:
+        assert wav.getnframes() == 3 * 5 * 4
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+    assert np.all(np.abs(samples / 32767 - 0.375) < 1e-3)
+
+    with pytest.raises(ValueError):
+        render_session(config, 'jam.pickle', out_file=str(tmp_path / 'jam.ogg'))
+    assert not (tmp_path / 'jam.ogg').exists()
@@ -0,0 +1,92 @@
+import pickle
+
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.events import EngineEventType
+from looper.runner.looper import LoopPhase, Looper
+from looper.runner.sessions import SESSION_CACHE_DIR, Session, SessionManager
+from looper.runner.track import Track
+
+
+def test_restore_session_converts_audio_format(tmp_path):
+    saved_config = Config(sampling_rate=16000, chunk_size=100, tracks_num=2, output_sessions_dir=str(tmp_path))
+    looper = Looper(None, saved_config)
+    looper.reset()
+    looper.master_chunks = [np.full(100, 0.5, dtype=np.float32) for _ in range(10)]
+    looper.tracks[0].set_track(looper.master_chunks, fade=False)
+    looper.tracks[1].set_empty(10)
+    looper.phase = LoopPhase.LOOP
+    SessionManager(looper).save_session('jam')
+
+    config = Config(sampling_rate=8000, chunk_size=64, channels=2, tracks_num=2, output_sessions_dir=str(tmp_path))
+    looper = Looper(None, config)
+    SessionManager(looper).restore_session('jam.pickle')
+
+    # 1000 samples at 16kHz last 500 samples at 8kHz, rounded to whole chunks
+    assert looper.loop_chunks_num == 8
+    assert looper.tracks[0].loop_chunks[3].shape == (64, 2)
+    assert np.allclose(looper.tracks[0].loop_chunks[3], 0.5, atol=0.01)
+    assert looper.tracks[1].empty
+    assert len(list((tmp_path / SESSION_CACHE_DIR).glob('jam.*.pickle'))) == 1
+    assert [session.filename for session in SessionManager(looper).list_sessions()] == ['jam.pickle']
+
+    SessionManager(looper).restore_session('jam.pickle')
+    assert looper.loop_chunks_num == 8
+
+
+def test_restore_session_saved_by_older_version(tmp_path):
+    config = Config(chunk_size=4, tracks_num=2, output_sessions_dir=str(tmp_path))
+    # config and tracks as pickled before track storage, panning and routing were added
+    saved_config = Config(chunk_size=4)
+    baseline_fields = {'sampling_rate', 'chunk_size', 'sample_format', 'channels', 'tracks_num', 'input_volume'}
+    object.__setattr__(saved_config, '__dict__',
+                       {key: value for key, value in saved_config.__dict__.items() if key in baseline_fields})
+    tracks = []
+    for index, value in enumerate([0.5, 0.0]):
+        track = Track.__new__(Track)
+        track.__dict__.update({
+            'index': index, 'config': saved_config, 'has_gpio': False, 'recording': False, 'playing': value > 0,
+            'empty': value == 0, 'volume': -3, 'name': f'track {index}', 'recording_from': -1,
+            'loop_chunks': [np.full(4, value, dtype=np.float32) for _ in range(3)], 'dsp': None,
+            '_last_recorded_chunk': None, '_last_recorded_position': -1,
+        })
+        tracks.append(track)
+    session = Session.__new__(Session)
+    session.__dict__.update({'name': 'old', 'input_volume': 0, 'output_volume': 0, 'tracks': tracks})
+    with open(tmp_path / 'old.pickle', 'wb') as handle:
+        pickle.dump(session, handle)
+
+    looper = Looper(None, config)
+    SessionManager(looper).restore_session('old.pickle')
+
+    assert looper.loop_chunks_num == 3
+    assert looper.tracks[0].volume == -3 and looper.tracks[0].codec is not None
+    assert np.allclose(looper.tracks[0].current_playback(1), 0.5 * 10 ** (-3 / 20))
+    assert looper.tracks[1].empty
+
+
+def test_switched_session_drops_actions_of_replaced_loop(offline_looper, tmp_path):
+    looper = offline_looper(tracks_num=2, output_sessions_dir=str(tmp_path))
+    looper.master_chunks = [np.full(8, 0.5, dtype=np.float32) for _ in range(4)]
+    looper.tracks[0].set_track(looper.master_chunks, fade=False)
+    looper.tracks[0].playing = True
+    looper.tracks[1].set_empty(4)
+    looper.phase = LoopPhase.LOOP
+    SessionManager(looper).save_session('jam')
+    events = looper.events.subscribe()
+    callback = looper.audio_backend.stream_callback
+    callback(np.zeros(8, dtype=np.float32))
+
+    SessionManager(looper).switch_session('jam.pickle', 'loop')
+    looper.schedule_action('record', 1, 'loop')
+    for _ in range(4):
+        callback(np.zeros(8, dtype=np.float32))
+
+    assert not looper.actions.pending
+    assert not looper.tracks[1].recording
+    assert looper.tracks[0].playing
+    published = []
+    while not events.empty():
+        published.append(events.get().type)
+    assert EngineEventType.ACTIONS in published
@@ -0,0 +1,92 @@
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.looper import LoopPhase, Looper
+from looper.runner.spill import SpillManager
+
+
+def test_spill_track_and_load_back(tmp_path):
+    config = Config(tracks_num=2, tracks_memory_budget_mb=1, spill_dir=str(tmp_path))
+    looper = Looper(None, config)
+    looper.reset()
+    track = looper.tracks[1]
+    chunks = [np.full(config.chunk_size, i, dtype=np.float32) for i in range(10)]
+    track.set_track(chunks, fade=False)
+    spill = SpillManager(looper)
+
+    assert spill.spill_track(track)
+    assert track.spilled
+    assert track.resident_bytes() == 0
+    assert np.array_equal(track.current_playback(3), chunks[3])
+
+    track.toggle_play()
+    assert track.pending_play and not track.playing
+
+    spill.load_track(track)
+    assert not track.spilled
+    assert track.resident_bytes() == 10 * chunks[0].nbytes
+    looper.start_pending_tracks()
+    assert track.playing
+
+
+def test_spill_least_recently_used_tracks_within_budget(tmp_path):
+    config = Config(tracks_num=4, tracks_memory_budget_mb=1, spill_dir=str(tmp_path))
+    looper = Looper(None, config)
+    looper.reset()
+    chunks = [np.ones(config.chunk_size, dtype=np.float32) for _ in range(10)]
+    for track, touched in zip(looper.tracks, [30, 10, 40, 20]):
+        track.set_track(chunks, fade=False)
+        track.last_touched = touched
+    looper.tracks[3].pending_play = True
+    spill = SpillManager(looper)
+
+    assert [track.index for track in spill._spill_candidates()] == [1, 0, 2]
+
+    spill.budget_bytes = 2 * looper.tracks[0].resident_bytes()
+    spill._enforce_budget()
+    assert [track.spilled for track in looper.tracks] == [True, True, False, False]
+    assert spill.resident_bytes() <= spill.budget_bytes
+
+
+def test_spill_discarded_when_track_overdubbed_meanwhile(tmp_path, monkeypatch):
+    config = Config(tracks_num=2, tracks_memory_budget_mb=1, spill_dir=str(tmp_path))
+    looper = Looper(None, config)
+    looper.reset()
+    track = looper.tracks[1]
+    track.set_track([np.zeros(config.chunk_size, dtype=np.float32) for _ in range(10)], fade=False)
+    track.last_touched = 0
+    spill = SpillManager(looper)
+    memmap = np.memmap
+
+    def overdub_while_copying(*args, **kwargs):
+        track.overdub(np.ones(config.chunk_size, dtype=np.float32), 3)
+        return memmap(*args, **kwargs)
+
+    monkeypatch.setattr(np, 'memmap', overdub_while_copying)
+    assert not spill.spill_track(track)
+    assert not track.spilled
+    assert np.any(track.current_playback(3))
+    assert not list(tmp_path.glob('track-*.bin'))
+
+
+def test_recording_spilled_track_starts_once_loaded_back(offline_looper, tmp_path):
+    looper = offline_looper(tracks_num=2)
+    looper.master_chunks = [np.zeros(8, dtype=np.float32) for _ in range(4)]
+    looper.tracks[0].set_track(looper.master_chunks, fade=False)
+    track = looper.tracks[1]
+    track.set_track(looper.master_chunks, fade=False)
+    looper.phase = LoopPhase.LOOP
+    spill = SpillManager(looper)
+    spill.spill_dir = tmp_path
+    assert spill.spill_track(track)
+    callback = looper.audio_backend.stream_callback
+
+    looper.toggle_record(1)
+    callback(np.ones(8, dtype=np.float32))
+    assert track.pending_record and not track.recording
+    assert not np.any(track.decoded_chunks()[0])
+
+    spill.load_track(track)
+    callback(np.ones(8, dtype=np.float32))
+    assert track.recording and not track.pending_record
+    assert not track.spilled
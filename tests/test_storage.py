@@ -0,0 +1,31 @@
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.track import Track
+
+
+def test_compact_track_storage_roundtrip():
+    for track_storage in ['int16', 'float16']:
+        config = Config(track_storage=track_storage)
+        chunk = np.linspace(-0.5, 0.5, config.chunk_size, dtype=np.float32)
+        track = Track(0, config, has_gpio=False)
+        track.set_track([np.copy(chunk), np.copy(chunk)], fade=False)
+
+        assert track.loop_chunks[0].nbytes == chunk.nbytes // 2
+        assert track.current_playback(0).dtype == np.float32
+        assert np.allclose(track.current_playback(0), chunk, atol=1e-3)
+
+        track.overdub(np.copy(chunk), 1)
+        assert np.allclose(track.current_playback(1), 2 * chunk, atol=1e-3)
+
+
+def test_compact_track_storage_roundtrip_of_int32_samples():
+    for track_storage in ['int16', 'float16']:
+        config = Config(track_storage=track_storage, sample_format='int32')
+        chunk = np.linspace(-2 ** 30, 2 ** 30, config.chunk_size).astype(np.int32)
+        track = Track(0, config, has_gpio=False)
+        track.set_track([np.copy(chunk)], fade=False)
+
+        playback = track.current_playback(0)
+        assert playback.dtype == np.int32
+        assert np.allclose(playback, chunk, rtol=0, atol=2 ** 31 * 1e-3)
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from looper.runner.bounce import bounce_tracks
+from looper.runner.looper import LoopPhase
+from looper.runner.sessions import SessionManager
+from looper.runner.trace import read_trace, replay_trace
+
+
+def _capture(offline_looper, path):
+    looper = offline_looper(path, tracks_num=2, tracks_memory_budget_mb=0, track_storage='int16')
+    backend = looper.audio_backend
+    rng = np.random.default_rng(1)
+    for index in range(40):
+        if index == 2:
+            looper.toggle_record(0)
+        if index == 12:
+            looper.toggle_record(0)
+        if index == 15:
+            looper.toggle_record(1)
+            looper.set_track_volume(1, -6)
+        if index == 25:
+            looper.toggle_record(1)
+        input_chunk = (rng.random(8, dtype=np.float32) - 0.5) * 10000
+        backend.stream_callback(input_chunk)
+    assert looper.phase == LoopPhase.LOOP
+    looper.close()
+
+
+def test_replayed_trace_is_bit_exact(offline_looper, tmp_path):
+    path = tmp_path / 'session.trace'
+    _capture(offline_looper, path)
+
+    trace = read_trace(path)
+    assert len(trace.inputs) == 40
+    assert trace.events[2] == [('toggle_record', [0])]
+    assert trace.events[15] == [('toggle_record', [1]), ('set_track_volume', [1, -6])]
+    assert trace.output_hash is not None
+
+    replay_trace(str(path))
+
+
+def test_replay_detects_changed_output(offline_looper, tmp_path):
+    path = tmp_path / 'session.trace'
+    _capture(offline_looper, path)
+    with path.open('r+b') as file:
+        file.seek(-1, 2)
+        file.write(b'x')
+
+    with pytest.raises(RuntimeError):
+        replay_trace(str(path))
+    replay_trace(str(path), update=True)
+    replay_trace(str(path))
+
+
+def test_only_outermost_control_call_is_recorded(offline_looper, tmp_path):
+    path = tmp_path / 'armed.trace'
+    looper = offline_looper(path, record_trigger=True)
+    backend = looper.audio_backend
+    looper.toggle_record(0)
+    for index in range(10):
+        backend.stream_callback(np.full(8, 0.5 if index >= 3 else 0, dtype=np.float32))
+    looper.toggle_record(0)
+    backend.stream_callback(np.zeros(8, dtype=np.float32))
+    assert looper.phase == LoopPhase.LOOP
+    looper.close()
+
+    events = [name for chunk_events in read_trace(path).events.values() for name, _ in chunk_events]
+    assert events == ['reset', 'toggle_record', 'toggle_record']
+    replay_trace(str(path))
+
+
+def test_operations_with_untraced_state_are_refused_while_capturing(offline_looper, tmp_path):
+    looper = offline_looper(tmp_path / 'session.trace', tracks_num=2)
+    looper.master_chunks = [np.zeros(8, dtype=np.float32) for _ in range(4)]
+    looper.tracks[0].set_track(looper.master_chunks, fade=False)
+    looper.phase = LoopPhase.LOOP
+
+    with pytest.raises(RuntimeError, match='capturing'):
+        SessionManager(looper).restore_session('session.pickle')
+    with pytest.raises(RuntimeError, match='capturing'):
+        bounce_tracks(looper, [0, 1])
+    with pytest.raises(RuntimeError, match='capturing'):
+        looper.journal.recover()
+    assert not looper.actions.pending
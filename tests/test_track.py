@@ -1,9 +1,94 @@
 
 
-from looper.runner.track import shift_loop_position
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.track import Track, common_loop_length, shift_loop_position
 
 
 def test_shift_loop_position():
     assert shift_loop_position(7, 5, 10) == 2
     assert shift_loop_position(2, -4, 10) == 8
     assert shift_loop_position(0, -1, 10) == 9
+
+
+def test_overdub_compensates_latency_with_wrap_around():
+    config = Config(chunk_size=4)
+    track = Track(0, config, has_gpio=False)
+    track.set_empty(3)
+    track.start_recording(at_position=1)
+    track.recording_from = -1  # skip fade in
+
+    track.overdub(np.arange(1, 5, dtype=np.float32), position=0, latency=2)
+
+    assert list(track.loop_chunks[2]) == [0, 0, 1, 2]
+    assert list(track.loop_chunks[0]) == [3, 4, 0, 0]
+    assert list(track.loop_chunks[1]) == [0, 0, 0, 0]
+
+
+def test_stereo_overdub_and_pan():
+    config = Config(chunk_size=4, channels=2)
+    track = Track(0, config, has_gpio=False)
+    track.set_empty(2)
+    assert track.loop_chunks[0].shape == (4, 2)
+    track.start_recording(at_position=0)
+    track.recording_from = -1  # skip fade in
+
+    track.overdub(np.ones((4, 2), dtype=np.float32), position=0, latency=1)
+    track.playing = True
+
+    assert track.loop_chunks[0][:, 0].tolist() == [1, 1, 1, 0]
+    assert track.loop_chunks[1][:, 1].tolist() == [0, 0, 0, 1]
+
+    track.set_pan(1)
+    playback = track.current_playback(0)
+    assert playback[:, 0].tolist() == [0, 0, 0, 0]
+    assert np.allclose(playback[:, 1], [np.sqrt(2), np.sqrt(2), np.sqrt(2), 0])
+
+
+def test_repeated_chunks_are_referenced_until_overdubbed():
+    config = Config(chunk_size=4)
+    track = Track(0, config, has_gpio=False)
+    track.set_track([np.full(4, 1, dtype=np.float32), np.full(4, 2, dtype=np.float32)], fade=False)
+    track.set_length(6)
+    assert track.loop_chunks[4] is track.loop_chunks[0]
+    assert track.resident_bytes() == 2 * 4 * 4
+
+    track.start_recording(at_position=2)
+    track.recording_from = -1  # skip fade in
+    track.overdub(np.ones(4, dtype=np.float32), position=2)
+
+    assert [chunk[0] for chunk in track.loop_chunks] == [1, 2, 2, 2, 1, 2]
+    assert track.resident_bytes() == 3 * 4 * 4
+    track.set_empty(6)
+    assert track.resident_bytes() == 4 * 4
+
+
+def test_longer_track_follows_master_loop_cycles():
+    from looper.runner.looper import LoopPhase, Looper
+    from looper.runner.trace import TraceBackend
+
+    config = Config(chunk_size=4, tracks_num=3, offline=True, journal=False, prioritize_process=False,
+                    listen_input=False)
+    looper = Looper(None, config)
+    looper.run(TraceBackend())
+    looper.master_chunks = [np.zeros(4, dtype=np.float32) for _ in range(2)]
+    looper.tracks[0].set_track(looper.master_chunks, fade=False)
+    looper.tracks[1].set_track([np.full(4, value, dtype=np.float32) for value in [1, 2]], fade=False)
+    looper.tracks[2].set_track([np.full(4, value, dtype=np.float32) for value in [10, 20]], fade=False)
+    looper.tracks[1].playing = looper.tracks[2].playing = True
+    looper.phase = LoopPhase.LOOP
+
+    looper.set_track_length(1, 2, 1)
+    looper.set_track_length(2, 1, 2)
+    looper.tracks[1].loop_chunks[2] = np.full(4, 3, dtype=np.float32)
+    output = [looper.audio_backend.stream_callback(np.zeros(4, dtype=np.float32))[0] for _ in range(5)]
+
+    assert output == [11, 12, 13, 12, 11]
+    assert looper.loop_cycle == 2
+    looper.close()
+
+
+def test_common_loop_length():
+    assert common_loop_length([4, 6, 2]) == 12
+    assert common_loop_length([5]) == 5
@@ -0,0 +1,56 @@
+from typing import Dict
+
+import numpy as np
+
+from looper.runner.config import Config
+from looper.runner.looper import LoopPhase
+from looper.runner.trigger import RecordTrigger, align_chunks
+
+
+def _settings(**kwargs) -> Dict:
+    kwargs.setdefault('record_preroll_s', 10 / 44100)
+    return dict(auto_anti_bias=False, listen_input=False, input_volume=0, record_trigger=True, **kwargs)
+
+
+def test_trigger_returns_preroll_from_previous_chunks():
+    trigger = RecordTrigger(Config(chunk_size=8, **_settings()))
+    for index in range(3):
+        assert trigger.process(np.full(8, index / 1024, dtype=np.float32)) is None
+    onset = np.zeros(8, dtype=np.float32)
+    onset[4] = 0.5
+
+    chunks, start_sample = trigger.process(onset)
+    # onset at sample 20 of the last 3 chunks, 10 samples of pre-roll
+    assert len(chunks) == 2
+    assert chunks[0].tolist() == [2 / 1024] * 8
+    assert start_sample == 2
+    assert align_chunks(chunks, start_sample, 8)[0].tolist() == [2 / 1024] * 6 + [0, 0]
+
+
+def test_armed_master_recording_starts_at_threshold_crossing(offline_looper):
+    looper = offline_looper(**_settings(record_preroll_s=2 / 44100))
+    backend = looper.audio_backend
+    looper.toggle_record(0)
+    assert looper.phase == LoopPhase.ARMED
+
+    for _ in range(3):
+        backend.stream_callback(np.zeros(8, dtype=np.float32))
+    assert looper.phase == LoopPhase.ARMED
+    backend.stream_callback(np.array([0, 0, 0, 0, 0, 1, 1, 1], dtype=np.float32))
+    assert looper.phase == LoopPhase.RECORDING_MASTER
+    for value in range(4, 8):
+        backend.stream_callback(np.full(8, value, dtype=np.float32))
+    looper.toggle_record(0)
+
+    assert looper.phase == LoopPhase.LOOP
+    assert looper.loop_chunks_num == 4
+    assert looper.master_chunks[0][:2].tolist() == [0, 0]
+    assert looper.master_chunks[0][2] > 0
+    assert looper.master_chunks[1].tolist() == [4] * 5 + [5] * 3
+
+
+def test_disarming_returns_to_void(offline_looper):
+    looper = offline_looper(**_settings())
+    looper.toggle_record(0)
+    looper.toggle_record(0)
+    assert looper.phase == LoopPhase.VOID